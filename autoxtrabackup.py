@@ -13,11 +13,12 @@ from sys import platform as _platform
 from sys import exit
 
 from backup_prepare.prepare import Prepare
+from backup_scheduler.daemon import BackupDaemon
+from backup_scheduler.multi_instance import MultiInstanceScheduler
 from general_conf.generalops import GeneralClass
 from general_conf import path_config
 from master_backup_script.backuper import Backup
 from partial_recovery.partial import PartialRecovery
-from prepare_env_test_mode.runner_test_mode import RunnerTestMode
 from process_runner.process_runner import ProcessRunner
 
 
@@ -117,6 +118,12 @@ def validate_file(file):
 @click.option('--backup',
               is_flag=True,
               help="Take full and incremental backups.")
+@click.option('--schedule',
+              is_flag=True,
+              help="Run as daemon taking backups driven by schedule and redo volume.")
+@click.option('--instances',
+              help="With --schedule, back up all MySQL instances listed in the given file "
+                   "under shared resource budget")
 @click.option('--partial',
               is_flag=True,
               help="Recover specified table (partial recovery).")
@@ -184,7 +191,7 @@ def validate_file(file):
 
 
 @click.pass_context
-def all_procedure(ctx, prepare, backup, partial, tag, show_tags,
+def all_procedure(ctx, prepare, backup, schedule, instances, partial, tag, show_tags,
                   verbose, log_file, log, defaults_file,
                   dry_run, test_mode, log_file_max_bytes,
                   log_file_backup_count, keyring_vault):
@@ -231,6 +238,7 @@ def all_procedure(ctx, prepare, backup, partial, tag, show_tags,
         with pid_file:  # User PidFile for locking to single instance
             if (prepare is False and
                     backup is False and
+                    schedule is False and
                     partial is False and
                     verbose is False and
                     dry_run is False and
@@ -245,6 +253,8 @@ def all_procedure(ctx, prepare, backup, partial, tag, show_tags,
             elif test_mode and defaults_file:
                 logger.warning("Enabled Test Mode!!!")
                 logger.info("Starting Test Mode")
+                # Test mode modules are only needed here
+                from prepare_env_test_mode.runner_test_mode import RunnerTestMode
                 test_obj = RunnerTestMode(config=defaults_file)
                 for basedir in test_obj.basedirs:
                     if ('5.7' in basedir) and ('2_4_ps_5_7' in defaults_file):
@@ -301,6 +311,14 @@ def all_procedure(ctx, prepare, backup, partial, tag, show_tags,
                     else:
                         b = Backup(config=defaults_file, dry_run=1)
                         b.all_backup()
+            elif schedule and not test_mode:
+                if dry_run:
+                    logger.warning("Dry run enabled!")
+                if instances:
+                    s = MultiInstanceScheduler(config=instances, dry_run=1 if dry_run else 0, tag=tag)
+                else:
+                    s = BackupDaemon(config=defaults_file, dry_run=1 if dry_run else 0, tag=tag)
+                s.run()
             elif partial:
                 if not dry_run:
                     c = PartialRecovery(config=defaults_file)
@@ -316,7 +334,8 @@ def all_procedure(ctx, prepare, backup, partial, tag, show_tags,
                     "Backup (pid: " + pid_str + ") has been running for logger than: " + str(
                         humanfriendly.format_timespan(
                             config.pid_runtime_warning)))
-        # logger.warn("Pid file already exists: " + str(error))
+        # Overlapping runs are reported, use --schedule to have due backups queued instead
+        logger.warning("Another autoxtrabackup is running, skipping this run: " + str(error))
     except pid.PidFileAlreadyRunningError as error:
         if hasattr(config, 'pid_runtime_warning'):
             if time.time() - os.stat(pid_file.filename).st_ctime > config.pid_runtime_warning:
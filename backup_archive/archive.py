@@ -0,0 +1,359 @@
+# Archive engine.
+# Packs backup directories into tar and compresses them with selectable codec:
+# zstd(with worker threads), pigz, lz4 or gzip. Throughput and ratio are measured for every archive.
+#
+# Archive is written as a sequence of independently compressed frames, each one holding whole tar members.
+# Concatenated frames are still a valid .tar.zst/.tar.gz/.tar.lz4, so archive can be unpacked with usual tools.
+# Side index(<archive>.index) maps every member to its frame, so single table or database is extracted
+# by decompressing only the frames which contain it.
+#
+# Every frame is compressed by a compressor process of its own: the zstd/pigz/lz4/gzip CLIs can not end a frame
+# on request and report where it ended in the output. Frames are therefore large, so process start and the drain
+# of multithreaded compressor at the end of every frame are paid once per 256MiB; the cost is that extracting
+# a single table decompresses up to that much. The frame size is recorded in the index.
+
+import os
+import json
+import stat
+import time
+import shutil
+import logging
+import tarfile
+import threading
+import subprocess
+from datetime import datetime
+from backup_catalog.sizing import Sizing
+from process_runner.process_runner import ProcessHandler, ProcessRunner
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveEngine:
+
+    # Preferred order for codec=auto
+    codecs = ('zstd', 'pigz', 'lz4', 'gzip')
+
+    extensions = {'zstd': '.tar.zst', 'pigz': '.tar.gz', 'lz4': '.tar.lz4', 'gzip': '.tar.gz'}
+
+    default_levels = {'zstd': 3, 'pigz': 6, 'lz4': 1, 'gzip': 6}
+
+    decompress_commands = {'zstd': ['zstd', '-q', '-d', '-c'],
+                           'pigz': ['pigz', '-d', '-c'],
+                           'lz4': ['lz4', '-q', '-d', '-c'],
+                           'gzip': ['gzip', '-d', '-c']}
+
+    index_suffix = '.index'
+
+    # Members are grouped into frames of about this size, bigger files get frame of their own
+    frame_size = 256 * 1024 * 1024
+
+    buffer_size = 4 * 1024 * 1024
+
+    def __init__(self, codec='auto', level=None, threads=0, envelope=None):
+        """
+        :param codec: One of ArchiveEngine.codecs or auto(first available of them)
+        :param level: Compression level, codec default if None
+        :param threads: Number of compression threads for zstd and pigz, 0 means all cores
+        :param envelope: CgroupEnvelope compressors of archive are run in, see cgroup.py, None for no limits
+        """
+        if codec == 'auto':
+            available = [i for i in self.codecs if shutil.which(i)]
+            if not available:
+                logger.error("None of {} is available for archiving".format(', '.join(self.codecs)))
+                raise RuntimeError("None of {} is available for archiving".format(', '.join(self.codecs)))
+            codec = available[0]
+        elif codec not in self.codecs:
+            logger.error("Unknown archive codec {}, must be one of auto, {}".format(codec, ', '.join(self.codecs)))
+            raise RuntimeError("Unknown archive codec {}".format(codec))
+        elif not shutil.which(codec):
+            logger.error("{} executable is not available for archiving".format(codec))
+            raise RuntimeError("{} executable is not available for archiving".format(codec))
+        self.codec = codec
+        self.level = self.default_levels[codec] if level is None else int(level)
+        self.threads = threads if threads else os.cpu_count() or 1
+        self.envelope = envelope
+
+    @property
+    def extension(self):
+        return self.extensions[self.codec]
+
+    def compress_command(self):
+        """
+        :return: List of arguments of compressor reading stdin and writing stdout
+        """
+        if self.codec == 'zstd':
+            return ['zstd', '-q', '-c', '-T{}'.format(self.threads), '-{}'.format(self.level)]
+        elif self.codec == 'pigz':
+            return ['pigz', '-c', '-p', str(self.threads), '-{}'.format(self.level)]
+        elif self.codec == 'lz4':
+            return ['lz4', '-q', '-c', '-{}'.format(self.level)]
+        return ['gzip', '-c', '-{}'.format(self.level)]
+
+    def decompress_command(self):
+        return self.decompress_commands[self.codec]
+
+    @staticmethod
+    def codec_of(archive_file):
+        # Guess codec from archive file name
+        for codec, extension in (('zstd', '.tar.zst'), ('lz4', '.tar.lz4'), ('gzip', '.tar.gz')):
+            if archive_file.endswith(extension):
+                return codec
+        raise RuntimeError("Unknown archive format of {}".format(archive_file))
+
+    @staticmethod
+    def walk_sources(sources):
+        """
+        Static method for listing members in the order they are archived.
+        Member names are paths without leading /, as tar stores them.
+        Hardlinked files are stored as regular files, so every member can be extracted on its own.
+        :return: Generator of (path, TarInfo)
+        :raise: FileNotFoundError if source does not exist.
+        """
+        for source in sources:
+            paths = [source]
+            for dirpath, dirnames, filenames in os.walk(source, onerror=ArchiveEngine.raise_error):
+                dirnames.sort()
+                paths.extend(os.path.join(dirpath, name) for name in dirnames + sorted(filenames))
+            for path in sorted(paths):
+                st = os.lstat(path)
+                info = tarfile.TarInfo(path.lstrip('/'))
+                info.mode = stat.S_IMODE(st.st_mode)
+                info.uid, info.gid = st.st_uid, st.st_gid
+                info.mtime = st.st_mtime
+                if stat.S_ISDIR(st.st_mode):
+                    info.type = tarfile.DIRTYPE
+                elif stat.S_ISLNK(st.st_mode):
+                    info.type = tarfile.SYMTYPE
+                    info.linkname = os.readlink(path)
+                elif stat.S_ISREG(st.st_mode):
+                    info.size = st.st_size
+                else:
+                    logger.warning("Skipping {}, it is not a regular file".format(path))
+                    continue
+                yield path, info
+
+    @staticmethod
+    def raise_error(err):
+        raise err
+
+    def frames(self, sources):
+        """
+        Method for grouping members into frames.
+        :return: Generator of lists of (path, TarInfo)
+        """
+        frame, frame_bytes = [], 0
+        for path, info in self.walk_sources(sources):
+            if frame and frame_bytes + info.size > self.frame_size:
+                yield frame
+                frame, frame_bytes = [], 0
+            frame.append((path, info))
+            frame_bytes += info.size + tarfile.BLOCKSIZE
+        if frame:
+            yield frame
+
+    def write_frame(self, output, members, data=b''):
+        """
+        Method for compressing tar members into the end of archive, as a frame of its own.
+        :param output: Archive file object opened for writing
+        :param members: List of (path, TarInfo)
+        :param data: Raw bytes written after the members(tar end of archive marker)
+        :return: Tuple of (frame offset, frame length, uncompressed bytes)
+        """
+        offset = os.lseek(output.fileno(), 0, os.SEEK_CUR)
+        join_cgroup = self.envelope.joiner() if self.envelope is not None else None
+        compressor = ProcessHandler.start_process(self.compress_command(), join_cgroup, stdin=subprocess.PIPE,
+                                                  stdout=output, stderr=subprocess.PIPE)
+        input_bytes = 0
+        try:
+            for path, info in members:
+                compressor.stdin.write(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+                if not info.isreg():
+                    continue
+                # File content is padded up to the size recorded in the header
+                with open(path, 'rb') as member:
+                    remaining = info.size
+                    while remaining > 0:
+                        chunk = member.read(min(self.buffer_size, remaining)) or b'\0' * min(self.buffer_size,
+                                                                                              remaining)
+                        compressor.stdin.write(chunk)
+                        remaining -= len(chunk)
+                compressor.stdin.write(b'\0' * (-info.size % tarfile.BLOCKSIZE))
+                input_bytes += info.size
+            compressor.stdin.write(data)
+        except (OSError, RuntimeError) as err:
+            compressor.kill()
+            compressor.communicate()
+            raise RuntimeError("FAILED: writing frame: {}".format(err))
+        error = compressor.communicate()[1]
+        if compressor.returncode != 0:
+            raise RuntimeError("FAILED: {}: {}".format(' '.join(self.compress_command()),
+                                                       error.decode('utf-8', 'replace')))
+        return offset, os.lseek(output.fileno(), 0, os.SEEK_CUR) - offset, input_bytes
+
+    def create(self, archive_file, sources):
+        """
+        Method for creating compressed tar archive of independently compressed frames, with side index.
+        Compressors of all frames share one cgroup, its summary is returned in metrics.
+        :param archive_file: Full path of archive, see ArchiveEngine.extension
+        :param sources: List of directories to archive
+        :return: Dictionary of metrics: codec, level, input_bytes, output_bytes, duration, ratio, throughput(bytes/s),
+                 started(timestamp), cgroup(see CgroupEnvelope.summary(), None without envelope)
+        :raise: RuntimeError on error.
+        """
+        logger.info("Archiving {} into {} using {} level {} with {} threads".format(
+            ', '.join(sources), archive_file, self.codec, self.level, self.threads))
+        start = time.time()
+        index = {'codec': self.codec, 'frame_size': self.frame_size, 'frames': [], 'members': {}}
+        input_bytes = 0
+        watcher = None
+        try:
+            watcher = ProcessHandler.open_envelope(self.envelope, '{}-{}'.format(self.codec, os.getpid()))
+            with open(archive_file, 'wb') as output:
+                frames = self.frames(sources)
+                members = next(frames, [])
+                while members is not None:
+                    following = next(frames, None)
+                    # Last frame ends with end of archive marker, no compressor is started just for it
+                    offset, length, frame_bytes = self.write_frame(
+                        output, members, b'' if following is not None else b'\0' * tarfile.BLOCKSIZE * 2)
+                    for path, info in members:
+                        index['members'][info.name] = len(index['frames'])
+                    index['frames'].append([offset, length])
+                    input_bytes += frame_bytes
+                    members = following
+            with open(archive_file + self.index_suffix + '.tmp', 'w') as index_file:
+                json.dump(index, index_file)
+            os.replace(archive_file + self.index_suffix + '.tmp', archive_file + self.index_suffix)
+        except (OSError, RuntimeError) as err:
+            for path in (archive_file, archive_file + self.index_suffix + '.tmp'):
+                if os.path.exists(path):
+                    os.remove(path)
+            logger.error("FAILED: Archiving -> {}".format(archive_file))
+            logger.error(err)
+            raise RuntimeError("FAILED: Archiving -> {}".format(archive_file))
+        finally:
+            cgroup = ProcessHandler.leave_envelope(self.envelope, watcher) if watcher is not None else None
+
+        duration = time.time() - start
+        output_bytes = os.path.getsize(archive_file)
+        metrics = {'codec': self.codec,
+                   'level': self.level,
+                   'input_bytes': input_bytes,
+                   'output_bytes': output_bytes,
+                   'duration': duration,
+                   'ratio': input_bytes / output_bytes if output_bytes else 0,
+                   'throughput': input_bytes / duration if duration else 0,
+                   'started': start,
+                   'cgroup': cgroup}
+        logger.info("OK: Archived {} of {} into {} in {:.1f} seconds, ratio {:.2f}, {}/s".format(
+            Sizing.human_size(input_bytes), ', '.join(sources), Sizing.human_size(output_bytes), duration,
+            metrics['ratio'], Sizing.human_size(metrics['throughput'])))
+        return metrics
+
+    @staticmethod
+    def read_index(archive_file):
+        """
+        :return: Index dictionary of archive or None if archive has no index(created by older versions)
+        """
+        if not os.path.isfile(archive_file + ArchiveEngine.index_suffix):
+            return None
+        with open(archive_file + ArchiveEngine.index_suffix, 'r') as index_file:
+            return json.load(index_file)
+
+    @staticmethod
+    def find_members(archive_file, match):
+        """
+        Static method for searching archive members by index, without reading archive itself.
+        :param match: Function taking member name and returning True for wanted members
+        :return: Sorted list of member names
+        """
+        index = ArchiveEngine.read_index(archive_file)
+        if index is None:
+            return []
+        return sorted(name for name in index['members'] if match(name))
+
+    @staticmethod
+    def extract(archive_file, names, target_dir, envelope=None):
+        """
+        Static method for extracting given members of indexed archive.
+        Only frames containing wanted members are read and decompressed.
+        :param archive_file: Full path of archive
+        :param names: List of member names, directory name extracts everything under it
+        :param target_dir: Directory to extract into, member paths are kept
+        :param envelope: CgroupEnvelope decompressor is run in, see cgroup.py, None for no limits
+        :return: List of extracted member names
+        :raise: RuntimeError on error.
+        """
+        index = ArchiveEngine.read_index(archive_file)
+        if index is None:
+            logger.error("FAILED: {} has no index, it must be extracted as a whole".format(archive_file))
+            raise RuntimeError("FAILED: {} has no index".format(archive_file))
+        prefixes = [name.strip('/') for name in names]
+        wanted = {name for name in index['members']
+                  if any(name == prefix or name.startswith(prefix + '/') for prefix in prefixes)}
+        frames = sorted({index['members'][name] for name in wanted})
+        logger.info("Extracting {} members of {} from {} of {} frames".format(
+            len(wanted), archive_file, len(frames), len(index['frames'])))
+
+        command = ArchiveEngine.decompress_commands[index['codec']]
+        start = datetime.now()
+        watcher, join_cgroup = ProcessHandler.enter_envelope(envelope, command)
+        try:
+            decompressor = ProcessHandler.start_process(command, join_cgroup, stdin=subprocess.PIPE,
+                                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except (OSError, RuntimeError):
+            ProcessHandler.leave_envelope(envelope, watcher)
+            raise
+
+        def feed():
+            # Concatenated frames decompress into contiguous tar stream of their members
+            try:
+                with open(archive_file, 'rb') as archive:
+                    for frame in frames:
+                        offset, length = index['frames'][frame]
+                        archive.seek(offset)
+                        while length > 0:
+                            chunk = archive.read(min(ArchiveEngine.buffer_size, length))
+                            if not chunk:
+                                break
+                            decompressor.stdin.write(chunk)
+                            length -= len(chunk)
+            except OSError as err:
+                logger.error("FAILED: reading {}: {}".format(archive_file, err))
+            finally:
+                decompressor.stdin.close()
+
+        feeder = threading.Thread(target=feed, name='archive-feed')
+        feeder.start()
+        # Python 3.12+ warns about extraction without filter
+        options = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        extracted = []
+        try:
+            with tarfile.open(fileobj=decompressor.stdout, mode='r|') as archive:
+                for member in archive:
+                    if member.name in wanted:
+                        archive.extract(member, target_dir, set_attrs=False, **options)
+                        extracted.append(member.name)
+        except tarfile.TarError as err:
+            decompressor.kill()
+            logger.error("FAILED: extracting from {}: {}".format(archive_file, err))
+            raise RuntimeError("FAILED: extracting from {}".format(archive_file))
+        finally:
+            # stdin is closed by the feeder, so communicate() can not be used here
+            decompressor.stdout.read()
+            feeder.join()
+            error = decompressor.stderr.read()
+            decompressor.wait()
+            ProcessRunner.summarize_process(command, start, datetime.now(), decompressor.returncode,
+                                            ProcessHandler.leave_envelope(envelope, watcher))
+        if decompressor.returncode != 0 or sorted(extracted) != sorted(wanted):
+            logger.error("FAILED: extracting from {}".format(archive_file))
+            logger.error(error.decode('utf-8', 'replace'))
+            raise RuntimeError("FAILED: extracting from {}".format(archive_file))
+        logger.info("OK: Extracted {} members into {}".format(len(extracted), target_dir))
+        return extracted
+
+
+def archive_backup_set(codec, level, threads, archive_file, sources, envelope=None):
+    # Entry point of archiving worker processes, see Backup.create_backup_archives()
+    return ArchiveEngine(codec=codec, level=level, threads=threads, envelope=envelope).create(archive_file, sources)
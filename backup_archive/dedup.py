@@ -0,0 +1,311 @@
+# Deduplicated archive store, alternative archive_dir backend(archive_backend = dedup).
+# Backup files are split into content-defined chunks, every unique chunk is stored once, compressed
+# and addressed by its sha256. Each archive is a manifest listing chunks of its files.
+# Chunk reference counts are kept in SQLite database, chunk is deleted when the last archive using it is removed.
+#
+# Chunk boundaries are decided by crc32 of 4KiB aligned blocks instead of byte-wise rolling hash:
+# InnoDB files are page structured, so changed pages never shift the data around them,
+# and hashing whole blocks keeps chunking at the speed of zlib instead of Python loop per byte.
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from backup_archive.archive import ArchiveEngine
+from backup_catalog.sizing import Sizing
+
+logger = logging.getLogger(__name__)
+
+
+class DedupStore:
+
+    file_name = 'dedup_store.db'
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            stored_size INTEGER NOT NULL,
+            refs INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS archives (
+            name TEXT PRIMARY KEY,
+            created TEXT,
+            input_bytes INTEGER
+        );
+    """
+
+    # Chunk boundaries are only placed at multiples of align
+    align = 4096
+    min_chunk = 64 * 1024
+    max_chunk = 4 * 1024 * 1024
+    # 1 of 64 aligned blocks ends a chunk, giving about 320KiB average chunk
+    boundary_mask = 0x3f
+
+    def __init__(self, root, level=6, threads=4):
+        """
+        :param root: Store directory(archive_dir)
+        :param level: zlib compression level of chunks
+        :param threads: Number of files chunked, hashed and compressed in parallel
+        """
+        self.root = root
+        self.level = 6 if level is None else int(level)
+        self.threads = threads if threads else os.cpu_count() or 1
+        self.chunk_dir = join(root, 'chunks')
+        self.manifest_dir = join(root, 'manifests')
+        os.makedirs(self.chunk_dir, exist_ok=True)
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        with closing(self.connect()) as conn, conn:
+            conn.executescript(self.schema)
+
+    def connect(self):
+        conn = sqlite3.connect(join(self.root, self.file_name), timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def chunk_path(self, digest):
+        return join(self.chunk_dir, digest[:2], digest)
+
+    def manifest_path(self, name):
+        return join(self.manifest_dir, name + '.json')
+
+    def split(self, path, size):
+        """
+        Method for splitting file into content-defined chunks.
+        :param path: File path
+        :param size: Number of bytes to read
+        :return: Generator of bytes
+        """
+        pending = bytearray()
+        with open(path, 'rb') as data_file:
+            eof = False
+            while not eof or pending:
+                while not eof and len(pending) < self.max_chunk:
+                    data = data_file.read(min(self.max_chunk, size))
+                    size -= len(data)
+                    if not data or size <= 0:
+                        eof = True
+                    pending += data
+                if not pending:
+                    break
+                cut = min(len(pending), self.max_chunk)
+                for offset in range(self.min_chunk, cut, self.align):
+                    if zlib.crc32(pending[offset - self.align:offset]) & self.boundary_mask == 0:
+                        cut = offset
+                        break
+                yield bytes(pending[:cut])
+                del pending[:cut]
+
+    def store_chunk(self, chunk):
+        """
+        Method for storing chunk if it is not in store yet.
+        :return: Tuple of (sha256, stored size, True if chunk is new)
+        """
+        digest = hashlib.sha256(chunk).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, os.path.getsize(path), False
+        data = zlib.compress(chunk, self.level)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(tmp_path, 'wb') as chunk_file:
+            chunk_file.write(data)
+        os.replace(tmp_path, path)
+        return digest, len(data), True
+
+    def store_file(self, path, info):
+        """
+        Method for storing chunks of one member.
+        :return: Tuple of (manifest entry, dictionary of sha256 -> (size, stored size), newly stored bytes)
+        """
+        entry = {'name': info.name, 'type': 'file', 'mode': info.mode, 'mtime': info.mtime, 'size': info.size,
+                 'chunks': []}
+        if info.isdir():
+            entry['type'] = 'dir'
+        elif info.issym():
+            entry.update(type='symlink', linkname=info.linkname)
+        chunks, new_bytes = {}, 0
+        if info.isreg():
+            for chunk in self.split(path, info.size):
+                digest, stored_size, new = self.store_chunk(chunk)
+                entry['chunks'].append(digest)
+                chunks[digest] = (len(chunk), stored_size)
+                new_bytes += stored_size if new else 0
+        return entry, chunks, new_bytes
+
+    def archives(self):
+        """
+        :return: List of archive names, oldest first
+        """
+        with closing(self.connect()) as conn:
+            return [row['name'] for row in conn.execute("SELECT name FROM archives ORDER BY name")]
+
+    def total_size(self):
+        # Bytes taken by stored chunks
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT COALESCE(SUM(stored_size), 0) FROM chunks").fetchone()[0]
+
+    def read_manifest(self, name):
+        with open(self.manifest_path(name), 'r') as manifest:
+            return json.load(manifest)
+
+    def add(self, name, sources):
+        """
+        Method for storing directories as new archive.
+        :param name: Archive name, for eg, full backup name
+        :param sources: List of directories to archive
+        :return: Dictionary of metrics as ArchiveEngine.create(), output_bytes being newly stored bytes
+        :raise: RuntimeError on error.
+        """
+        if name in self.archives():
+            logger.error("FAILED: Archive {} already exists in {}".format(name, self.root))
+            raise RuntimeError("FAILED: Archive {} already exists in {}".format(name, self.root))
+        logger.info("Archiving {} into deduplicated store {} as {}".format(', '.join(sources), self.root, name))
+        start = time.time()
+        chunks, new_bytes = {}, 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                futures = [executor.submit(self.store_file, path, info)
+                           for path, info in ArchiveEngine.walk_sources(sources)]
+                entries = []
+                for future in futures:
+                    entry, file_chunks, file_new_bytes = future.result()
+                    entries.append(entry)
+                    chunks.update(file_chunks)
+                    new_bytes += file_new_bytes
+        except OSError as err:
+            logger.error("FAILED: Archiving -> {}".format(name))
+            logger.error(err)
+            # Chunks stored by this run are not referenced by any archive
+            self.collect_garbage()
+            raise RuntimeError("FAILED: Archiving -> {}".format(name))
+
+        input_bytes = sum(entry['size'] for entry in entries if entry['type'] == 'file')
+        created = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        with open(self.manifest_path(name) + '.tmp', 'w') as manifest:
+            json.dump({'name': name, 'created': created, 'members': entries}, manifest)
+        os.replace(self.manifest_path(name) + '.tmp', self.manifest_path(name))
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("INSERT OR IGNORE INTO chunks (hash, size, stored_size, refs) VALUES (?, ?, ?, 0)",
+                             [(digest, size, stored_size) for digest, (size, stored_size) in chunks.items()])
+            conn.executemany("UPDATE chunks SET refs = refs + 1 WHERE hash = ?", [(digest,) for digest in chunks])
+            conn.execute("INSERT INTO archives (name, created, input_bytes) VALUES (?, ?, ?)",
+                         (name, created, input_bytes))
+
+        duration = time.time() - start
+        metrics = {'codec': 'dedup',
+                   'level': self.level,
+                   'input_bytes': input_bytes,
+                   'output_bytes': new_bytes,
+                   'duration': duration,
+                   'ratio': input_bytes / new_bytes if new_bytes else 0,
+                   'throughput': input_bytes / duration if duration else 0}
+        logger.info("OK: Archived {} of {} into {}, {} of new chunks in {:.1f} seconds, {}/s".format(
+            Sizing.human_size(input_bytes), ', '.join(sources), self.root, Sizing.human_size(new_bytes), duration,
+            Sizing.human_size(metrics['throughput'])))
+        return metrics
+
+    def remove(self, name):
+        """
+        Method for removing archive, chunks which are not referenced by other archives are deleted.
+        :param name: Archive name
+        :return: Number of freed bytes
+        """
+        digests = set()
+        if os.path.isfile(self.manifest_path(name)):
+            for entry in self.read_manifest(name)['members']:
+                digests.update(entry['chunks'])
+        with closing(self.connect()) as conn, conn:
+            conn.executemany("UPDATE chunks SET refs = refs - 1 WHERE hash = ?", [(digest,) for digest in digests])
+            unused = conn.execute("SELECT hash, stored_size FROM chunks WHERE refs <= 0").fetchall()
+            conn.execute("DELETE FROM chunks WHERE refs <= 0")
+            conn.execute("DELETE FROM archives WHERE name = ?", (name,))
+        for row in unused:
+            if os.path.exists(self.chunk_path(row['hash'])):
+                os.remove(self.chunk_path(row['hash']))
+        if os.path.exists(self.manifest_path(name)):
+            os.remove(self.manifest_path(name))
+        freed = sum(row['stored_size'] for row in unused)
+        logger.info("Removed archive {} from {}, freed {}".format(name, self.root, Sizing.human_size(freed)))
+        return freed
+
+    def collect_garbage(self):
+        """
+        Method for deleting chunks and manifests left by failed or interrupted archiving.
+        Must not run while another process adds archive to the same store.
+        :return: Number of deleted files
+        """
+        with closing(self.connect()) as conn:
+            known = {row['hash'] for row in conn.execute("SELECT hash FROM chunks")}
+        names = set(self.archives())
+        deleted = 0
+        for dirpath, dirnames, filenames in os.walk(self.chunk_dir):
+            for filename in filenames:
+                if filename not in known:
+                    os.remove(join(dirpath, filename))
+                    deleted += 1
+        for filename in os.listdir(self.manifest_dir):
+            if filename[:-len('.json')] not in names:
+                os.remove(join(self.manifest_dir, filename))
+                deleted += 1
+        if deleted:
+            logger.info("Deleted {} unreferenced files from {}".format(deleted, self.root))
+        return deleted
+
+    def find_members(self, name, match):
+        """
+        Method for searching archive members, see ArchiveEngine.find_members()
+        :param name: Archive name
+        :param match: Function taking member name and returning True for wanted members
+        :return: Sorted list of member names
+        """
+        return sorted(entry['name'] for entry in self.read_manifest(name)['members'] if match(entry['name']))
+
+    def read_chunk(self, digest):
+        with open(self.chunk_path(digest), 'rb') as chunk_file:
+            return zlib.decompress(chunk_file.read())
+
+    def extract(self, name, names, target_dir, envelope=None):
+        """
+        Method for restoring given members of archive, see ArchiveEngine.extract()
+        :param name: Archive name
+        :param names: List of member names, directory name extracts everything under it
+        :param target_dir: Directory to extract into, member paths are kept
+        :param envelope: Not used, chunks are decompressed without spawning processes
+        :return: List of extracted member names
+        :raise: RuntimeError if chunk is missing or corrupted.
+        """
+        prefixes = [i.strip('/') for i in names]
+        extracted = []
+        for entry in self.read_manifest(name)['members']:
+            if not any(entry['name'] == prefix or entry['name'].startswith(prefix + '/') for prefix in prefixes):
+                continue
+            path = join(target_dir, entry['name'])
+            if entry['type'] == 'dir':
+                os.makedirs(path, exist_ok=True)
+            elif entry['type'] == 'symlink':
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.symlink(entry['linkname'], path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as member:
+                    for digest in entry['chunks']:
+                        try:
+                            chunk = self.read_chunk(digest)
+                        except (OSError, zlib.error) as err:
+                            logger.error("FAILED: reading chunk {} of {}: {}".format(digest, entry['name'], err))
+                            raise RuntimeError("FAILED: reading chunk {} of {}".format(digest, entry['name']))
+                        member.write(chunk)
+                os.chmod(path, entry['mode'])
+                os.utime(path, (entry['mtime'], entry['mtime']))
+            extracted.append(entry['name'])
+        logger.info("OK: Extracted {} members of {} into {}".format(len(extracted), name, target_dir))
+        return extracted
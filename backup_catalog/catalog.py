@@ -0,0 +1,341 @@
+# Persistent backup catalog.
+# Keeps one row per backup set inside SQLite database stored in backup directory.
+# Replaces backup_tags.txt and scanning of full/inc directories for finding backups.
+
+import os
+import re
+import sqlite3
+import logging
+from contextlib import closing
+from os.path import join, isfile
+
+logger = logging.getLogger(__name__)
+
+
+class BackupCatalog:
+
+    file_name = 'backup_catalog.db'
+    legacy_tags_file = 'backup_tags.txt'
+
+    archive_columns = ('name', 'full_backup', 'codec', 'level', 'input_bytes', 'output_bytes', 'duration', 'created')
+
+    columns = ('name', 'backup_type', 'parent', 'status', 'from_lsn', 'to_lsn', 'size_bytes', 'size',
+               'start_time', 'end_time', 'duration', 'tool_version', 'binlog_pos', 'gtid',
+               'stream', 'compressed', 'encrypted', 'tag', 'linked_from', 'linked_bytes', 'prepare_duration')
+
+    # Columns added after first release, added to existing catalogs on open
+    added_columns = (('linked_from', 'TEXT'), ('linked_bytes', 'INTEGER'), ('prepare_duration', 'REAL'))
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS backups (
+            name TEXT PRIMARY KEY,
+            backup_type TEXT NOT NULL,
+            parent TEXT,
+            status TEXT NOT NULL,
+            from_lsn INTEGER,
+            to_lsn INTEGER,
+            size_bytes INTEGER,
+            size TEXT,
+            start_time TEXT,
+            end_time TEXT,
+            duration REAL,
+            tool_version TEXT,
+            binlog_pos TEXT,
+            gtid TEXT,
+            stream TEXT,
+            compressed INTEGER,
+            encrypted INTEGER,
+            tag TEXT,
+            linked_from TEXT,
+            linked_bytes INTEGER,
+            prepare_duration REAL
+        );
+        CREATE INDEX IF NOT EXISTS backups_type_name ON backups (backup_type, status, name);
+        CREATE INDEX IF NOT EXISTS backups_parent ON backups (parent);
+        CREATE INDEX IF NOT EXISTS backups_tag ON backups (tag);
+        CREATE INDEX IF NOT EXISTS backups_from_lsn ON backups (from_lsn);
+        CREATE TABLE IF NOT EXISTS archives (
+            name TEXT PRIMARY KEY,
+            full_backup TEXT,
+            codec TEXT,
+            level INTEGER,
+            input_bytes INTEGER,
+            output_bytes INTEGER,
+            duration REAL,
+            created TEXT
+        );
+        CREATE INDEX IF NOT EXISTS archives_full_backup ON archives (full_backup);
+        CREATE TABLE IF NOT EXISTS skipped_backups (
+            name TEXT PRIMARY KEY,
+            parent TEXT,
+            base_lsn INTEGER,
+            current_lsn INTEGER
+        );
+    """
+
+    def __init__(self, backup_dir):
+        self.backup_dir = backup_dir
+        self.path = join(backup_dir, self.file_name)
+        with closing(self.connect()) as conn, conn:
+            conn.executescript(self.schema)
+            existing = {row['name'] for row in conn.execute("PRAGMA table_info(backups)")}
+            for column, column_type in self.added_columns:
+                if column not in existing:
+                    conn.execute("ALTER TABLE backups ADD COLUMN {} {}".format(column, column_type))
+        self.import_backup_tags()
+
+    @staticmethod
+    def exists(backup_dir):
+        """
+        Check if catalog(or legacy backup_tags.txt to be imported) is inside given backup directory.
+        Used to avoid creating empty catalog for read only actions.
+        """
+        return isfile(join(backup_dir, BackupCatalog.file_name)) or \
+            isfile(join(backup_dir, BackupCatalog.legacy_tags_file))
+
+    def connect(self):
+        # Connection per operation; catalog is shared by backup, prepare and background jobs
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def import_backup_tags(self):
+        """
+        Method for one time import of legacy backup_tags.txt into catalog.
+        Tags of already deleted backups are skipped. The file is renamed to backup_tags.txt.imported afterwards.
+        :return: Number of imported tags.
+        """
+        tags_file = join(self.backup_dir, self.legacy_tags_file)
+        if not isfile(tags_file):
+            return 0
+
+        imported = 0
+        with open(tags_file, 'r') as bcktags, closing(self.connect()) as conn, conn:
+            for line in bcktags:
+                splitted = line.rstrip("\n\r").split('\t')
+                if len(splitted) < 6:
+                    continue
+                name, backup_type, status, end_time, size = splitted[:5]
+                type_dir = 'full' if backup_type == 'Full' else 'inc'
+                if not os.path.isdir(join(self.backup_dir, type_dir, name)):
+                    continue
+                tag = '\t'.join(splitted[5:]).strip("'")
+                conn.execute("INSERT OR IGNORE INTO backups (name, backup_type, status, end_time, size, tag) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (name, backup_type, status, end_time, size, tag))
+                # Keep the tag of already recorded backup
+                conn.execute("UPDATE backups SET tag = ? WHERE name = ? AND tag IS NULL", (tag, name))
+                imported += 1
+        os.rename(tags_file, tags_file + '.imported')
+        logger.info("Imported {} backup tags from {} into backup catalog".format(imported, tags_file))
+        return imported
+
+    def add_backup(self, name, backup_type, status, **fields):
+        """
+        Method for recording(or updating) a backup set.
+        :param name: Backup directory name, for eg, 2017-11-09_19-37-16
+        :param backup_type: Full or Inc
+        :param status: OK or FAILED
+        :param fields: Any other column from BackupCatalog.columns
+        :return: True on success.
+        """
+        assert backup_type in ('Full', 'Inc'), "add_backup(): backup_type {}: must be 'Full' or 'Inc'".format(
+            backup_type)
+        unknown = set(fields) - set(self.columns)
+        if unknown:
+            raise ValueError("Unknown backup catalog columns: {}".format(', '.join(sorted(unknown))))
+
+        row = dict(fields, name=name, backup_type=backup_type, status=status)
+        names = sorted(row)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO backups ({}) VALUES ({})".format(
+                ', '.join(names), ', '.join('?' * len(names))), [row[i] for i in names])
+        return True
+
+    def update_backup(self, name, **fields):
+        # Update given columns of already recorded backup set
+        unknown = set(fields) - set(self.columns)
+        if unknown:
+            raise ValueError("Unknown backup catalog columns: {}".format(', '.join(sorted(unknown))))
+        if not fields:
+            return True
+        names = sorted(fields)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("UPDATE backups SET {} WHERE name = ?".format(', '.join('{} = ?'.format(i) for i in names)),
+                         [fields[i] for i in names] + [name])
+        return True
+
+    def remove_backup(self, name):
+        # Forget deleted backup set, files linked to it(full_dedup) are owned by linking backup alone from now on
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM backups WHERE name = ?", (name,))
+            conn.execute("UPDATE backups SET linked_from = NULL, linked_bytes = NULL WHERE linked_from = ?", (name,))
+        return True
+
+    def get_backup(self, name):
+        """
+        :param name: Backup directory name
+        :return: sqlite3.Row of backup set or None
+        """
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT * FROM backups WHERE name = ?", (name,)).fetchone()
+
+    def recent_backup(self, backup_type, status='OK'):
+        """
+        Method for finding the most recent backup set of given type.
+        :param backup_type: Full or Inc
+        :param status: Only backups with this status are considered.
+        :return: Backup name or None if there is no such backup.
+        """
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT name FROM backups WHERE backup_type = ? AND status = ? "
+                               "ORDER BY name DESC LIMIT 1", (backup_type, status)).fetchone()
+        return row['name'] if row else None
+
+    def has_backups(self, backup_type):
+        # Check if any backup of given type was ever recorded, regardless of status
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT 1 FROM backups WHERE backup_type = ? LIMIT 1",
+                                (backup_type,)).fetchone() is not None
+
+    def backups(self, backup_type=None, status=None, parent=None):
+        """
+        Method for listing recorded backup sets, ordered by name(i.e by time).
+        :return: List of sqlite3.Row
+        """
+        conditions, params = [], []
+        for column, value in (('backup_type', backup_type), ('status', status), ('parent', parent)):
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                params.append(value)
+        query = "SELECT * FROM backups"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY name"
+        with closing(self.connect()) as conn:
+            return conn.execute(query, params).fetchall()
+
+    def find_by_tag(self, tag):
+        """
+        :param tag: The tag name to search
+        :return: sqlite3.Row of the most recent backup with this tag or None
+        """
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT * FROM backups WHERE tag = ? ORDER BY name DESC LIMIT 1",
+                                (tag,)).fetchone()
+
+    def tagged_backups(self):
+        # Backups with tags, used by --show-tags
+        with closing(self.connect()) as conn:
+            return conn.execute("SELECT * FROM backups WHERE tag IS NOT NULL ORDER BY name").fetchall()
+
+    def chain(self, name):
+        """
+        Method for resolving backup chain by following parent links.
+        :param name: The last backup name of the chain
+        :return: List of sqlite3.Row from full backup to given backup.
+        :raise: RuntimeError if chain is broken
+        """
+        chain = []
+        row = self.get_backup(name)
+        while row is not None:
+            chain.append(row)
+            if row['backup_type'] == 'Full':
+                return list(reversed(chain))
+            if row['parent'] is None:
+                break
+            row = self.get_backup(row['parent'])
+        raise RuntimeError("Could not resolve backup chain of {} from backup catalog".format(name))
+
+    def add_archive(self, name, **fields):
+        """
+        Method for recording archive and its metrics.
+        :param name: Archive file name inside archive_dir, for eg, 2017-11-09_19-37-16.tar.zst
+        :param fields: Any other column from BackupCatalog.archive_columns
+        :return: True on success.
+        """
+        unknown = set(fields) - set(self.archive_columns)
+        if unknown:
+            raise ValueError("Unknown archive catalog columns: {}".format(', '.join(sorted(unknown))))
+        row = dict(fields, name=name)
+        names = sorted(row)
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO archives ({}) VALUES ({})".format(
+                ', '.join(names), ', '.join('?' * len(names))), [row[i] for i in names])
+        return True
+
+    def remove_archive(self, name):
+        # Forget deleted archive
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM archives WHERE name = ?", (name,))
+        return True
+
+    def archives(self, full_backup=None):
+        """
+        Method for listing recorded archives, ordered by name(i.e by time).
+        :param full_backup: Only archives of this full backup
+        :return: List of sqlite3.Row
+        """
+        with closing(self.connect()) as conn:
+            if full_backup is None:
+                return conn.execute("SELECT * FROM archives ORDER BY name").fetchall()
+            return conn.execute("SELECT * FROM archives WHERE full_backup = ? ORDER BY name",
+                                (full_backup,)).fetchall()
+
+    def add_skip(self, name, parent, base_lsn, current_lsn):
+        """
+        Method for recording incremental backup which was not taken, because LSN did not move enough.
+        :param name: Time of the skipped backup, for eg, 2017-11-09_19-37-16
+        :param parent: The backup it would have been based on
+        :return: True on success.
+        """
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO skipped_backups (name, parent, base_lsn, current_lsn) "
+                         "VALUES (?, ?, ?, ?)", (name, parent, base_lsn, current_lsn))
+        return True
+
+    def skipped_backups(self, parent=None):
+        """
+        :param parent: Only skips based on this backup
+        :return: List of sqlite3.Row of skipped incremental backups, ordered by name
+        """
+        with closing(self.connect()) as conn:
+            if parent is None:
+                return conn.execute("SELECT * FROM skipped_backups ORDER BY name").fetchall()
+            return conn.execute("SELECT * FROM skipped_backups WHERE parent = ? ORDER BY name",
+                                (parent,)).fetchall()
+
+    @staticmethod
+    def read_xtrabackup_info(directory):
+        """
+        Static method for parsing xtrabackup_info file(written to LSN sidecar with --extra-lsndir).
+        :param directory: Directory containing xtrabackup_info
+        :return: Dictionary of catalog fields, empty if file is missing.
+        """
+        path = join(directory, 'xtrabackup_info')
+        if not isfile(path):
+            return {}
+
+        info = {}
+        with open(path, 'r') as info_file:
+            for line in info_file:
+                if '=' in line:
+                    key, value = line.split('=', 1)
+                    info[key.strip()] = value.strip()
+
+        fields = {}
+        if 'tool_version' in info:
+            fields['tool_version'] = info['tool_version']
+        if info.get('binlog_pos'):
+            fields['binlog_pos'] = info['binlog_pos']
+            # filename 'mysql-bin.000003', position '154', GTID of the last change '...'
+            gtid = re.search(r"GTID of the last change '([^']*)'", info['binlog_pos'])
+            if gtid:
+                fields['gtid'] = gtid.group(1).replace('\n', '')
+        for key in ('innodb_from_lsn', 'innodb_to_lsn'):
+            if info.get(key, '').isdigit():
+                fields[key[len('innodb_'):]] = int(info[key])
+        if 'compressed' in info:
+            fields['compressed'] = 0 if info['compressed'] in ('N', '0') else 1
+        if 'encrypted' in info:
+            fields['encrypted'] = 0 if info['encrypted'] in ('N', '0') else 1
+        return fields
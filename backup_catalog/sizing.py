@@ -0,0 +1,95 @@
+# Directory sizing.
+# Scans directories with os.scandir by thread pool, one task per directory.
+# Sizes of finished backup sets are kept in backup catalog(size_bytes), so they are never scanned again.
+
+import os
+import logging
+import threading
+import humanfriendly
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+
+class Sizing:
+
+    threads = 8
+
+    @staticmethod
+    def scan_directory(path, seen, lock):
+        """
+        Static method for summing sizes of files directly inside given directory.
+        Hardlinked files(see prepare_snapshot) are counted once, as du does.
+        :return: Tuple of (size in bytes, list of subdirectory paths)
+        """
+        size = 0
+        subdirs = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        # Removed while scanning
+                        continue
+                    if stat.st_nlink > 1:
+                        with lock:
+                            if (stat.st_dev, stat.st_ino) in seen:
+                                continue
+                            seen.add((stat.st_dev, stat.st_ino))
+                    size += stat.st_size
+        except FileNotFoundError:
+            pass
+        return size, subdirs
+
+    @staticmethod
+    def directory_size(path, threads=None):
+        """
+        Static method for calculating total size of files inside given directory.
+        :param path: Directory path
+        :param threads: Number of directories scanned in parallel
+        :return: Size in bytes
+        """
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        seen, lock = set(), threading.Lock()
+        total = 0
+        with ThreadPoolExecutor(max_workers=threads or Sizing.threads) as executor:
+            pending = {executor.submit(Sizing.scan_directory, path, seen, lock)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    size, subdirs = future.result()
+                    total += size
+                    pending.update(executor.submit(Sizing.scan_directory, subdir, seen, lock) for subdir in subdirs)
+        return total
+
+    @staticmethod
+    def human_size(size):
+        """
+        :param size: Size in bytes
+        :return: String with human readable size info, for eg, 5.3 MiB
+        """
+        return humanfriendly.format_size(size, binary=True)
+
+    @staticmethod
+    def backup_size(catalog, name, path):
+        """
+        Static method for getting size of finished backup set.
+        The size is taken from backup catalog, the directory is scanned only if it is not recorded yet.
+        :param catalog: BackupCatalog object or None
+        :param name: Backup directory name
+        :param path: Backup directory path
+        :return: Size in bytes
+        """
+        if catalog is not None:
+            row = catalog.get_backup(name)
+            if row is not None and row['size_bytes'] is not None:
+                return row['size_bytes']
+        size = Sizing.directory_size(path)
+        if catalog is not None and row is not None:
+            catalog.update_backup(name, size_bytes=size, size=Sizing.human_size(size))
+        return size
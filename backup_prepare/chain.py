@@ -0,0 +1,172 @@
+# Incremental backup chain resolver.
+# Builds LSN-continuous chain of incremental backups on top of full backup,
+# so broken chains are rejected before any prepare command runs.
+# With cumulative incremental backups(inc_policy) several backups may start at the same LSN,
+# then the chain with fewest deltas is picked and superseded backups are skipped.
+
+import os
+import heapq
+import logging
+from collections import defaultdict
+from backup_prepare.checkpoints import Checkpoints
+
+logger = logging.getLogger(__name__)
+
+
+class ChainResolver:
+
+    def __init__(self, full_dir, inc_dir, lsn_dir, catalog=None, allow_forks=False):
+        self.full_dir = full_dir
+        self.inc_dir = inc_dir
+        self.lsn_dir = lsn_dir
+        self.catalog = catalog
+        self.allow_forks = allow_forks
+
+    def backup_lsns(self, backup_dir, backup_name):
+        """
+        Method for finding from_lsn and to_lsn of the backup.
+        Looking in LSN sidecar, then inside backup directory itself, then in backup catalog.
+        :param backup_dir: full_dir or inc_dir
+        :param backup_name: Backup directory name
+        :return: Tuple of (from_lsn, to_lsn), (None, None) if they can not be found.
+        """
+        for directory in (os.path.join(self.lsn_dir, backup_name), os.path.join(backup_dir, backup_name)):
+            checkpoints = Checkpoints.read(directory)
+            if checkpoints and 'from_lsn' in checkpoints and 'to_lsn' in checkpoints:
+                return checkpoints['from_lsn'], checkpoints['to_lsn']
+
+        if self.catalog is not None:
+            row = self.catalog.get_backup(backup_name)
+            if row is not None and row['from_lsn'] is not None and row['to_lsn'] is not None:
+                return row['from_lsn'], row['to_lsn']
+        return None, None
+
+    def backup_size(self, backup_name):
+        # Size recorded in backup catalog, used for choosing between chains with the same number of deltas
+        if self.catalog is not None:
+            row = self.catalog.get_backup(backup_name)
+            if row is not None and row['size_bytes']:
+                return row['size_bytes']
+        return 0
+
+    def broken_chain_errors(self, full_backup, full_to_lsn, current_lsn, lsns, leftovers):
+        errors = []
+        for inc in leftovers:
+            from_lsn, to_lsn = lsns[inc]
+            if from_lsn > current_lsn:
+                errors.append("gap: {} starts at LSN {}, chain ends at LSN {}".format(inc, from_lsn, current_lsn))
+            elif from_lsn < full_to_lsn:
+                errors.append("orphan: {} (LSN {}-{}) does not belong to full backup {}".format(
+                    inc, from_lsn, to_lsn, full_backup))
+            else:
+                errors.append("overlap: {} (LSN {}-{}) overlaps the chain".format(inc, from_lsn, to_lsn))
+        logger.error("Broken incremental backup chain: {}".format('; '.join(errors)))
+        raise RuntimeError("Broken incremental backup chain: {}".format('; '.join(errors)))
+
+    def resolve_shortest(self, full_backup, full_to_lsn, lsns, until=None):
+        """
+        Method for picking chain when incremental backups form a tree(cumulative incremental backups).
+        Every non-empty incremental backup is an edge from_lsn -> to_lsn, the chain reaching the newest LSN
+        (or until) with fewest deltas, then fewest bytes, is returned.
+        :param full_backup: Full backup directory name
+        :param full_to_lsn: to_lsn of full backup
+        :param lsns: Dictionary of incremental backup name -> (from_lsn, to_lsn)
+        :param until: Stop the chain at this incremental backup
+        :return: List of incremental backup names in apply order.
+        :raise: RuntimeError if some incremental backup can not be reached from full backup.
+        """
+        edges = defaultdict(list)
+        for inc in sorted(lsns):
+            if lsns[inc][1] != lsns[inc][0]:
+                edges[lsns[inc][0]].append(inc)
+
+        # Dijkstra over LSNs, cost is (number of deltas, bytes)
+        best = {full_to_lsn: ((0, 0), [])}
+        queue = [((0, 0), full_to_lsn, [])]
+        while queue:
+            cost, lsn, chain = heapq.heappop(queue)
+            if best[lsn][0] < cost:
+                continue
+            for inc in edges[lsn]:
+                to_lsn = lsns[inc][1]
+                inc_cost = (cost[0] + 1, cost[1] + self.backup_size(inc))
+                if to_lsn not in best or inc_cost < best[to_lsn][0]:
+                    best[to_lsn] = (inc_cost, chain + [inc])
+                    heapq.heappush(queue, (inc_cost, to_lsn, chain + [inc]))
+
+        leftovers = sorted(inc for inc, (from_lsn, to_lsn) in lsns.items() if from_lsn not in best)
+        if leftovers:
+            self.broken_chain_errors(full_backup, full_to_lsn, max(best), lsns, leftovers)
+
+        if until is not None:
+            if until not in lsns:
+                raise RuntimeError("Incremental backup {} is not part of the chain of full backup {}".format(
+                    until, full_backup))
+            chain = best[lsns[until][0]][1] + [until]
+        else:
+            chain = best[max(best)][1]
+        superseded = sorted(set(lsns) - set(chain))
+        if superseded:
+            logger.info("Skipping incremental backups superseded by cumulative ones: {}".format(
+                ', '.join(superseded)))
+        logger.info("Resolved incremental backup chain of {}: {}".format(full_backup, ' -> '.join(chain)))
+        return chain
+
+    def resolve(self, full_backup, inc_backups, until=None):
+        """
+        Method for building incremental backup chain of given full backup.
+        Every incremental backup must start exactly where the previous one(or full backup) ends.
+        :param full_backup: Full backup directory name
+        :param inc_backups: Incremental backup directory names, in any order
+        :param until: Stop the chain at this incremental backup(used with backup tags)
+        :return: List of incremental backup names in apply order.
+        :raise: RuntimeError on gaps, overlaps and orphaned incremental backups,
+                and on incremental backups starting at the same LSN unless allow_forks is set.
+        """
+        full_to_lsn = current_lsn = self.backup_lsns(self.full_dir, full_backup)[1]
+        lsns = {inc: self.backup_lsns(self.inc_dir, inc) for inc in inc_backups}
+        missing = [inc for inc, (from_lsn, to_lsn) in lsns.items() if from_lsn is None]
+        if current_lsn is None or missing:
+            # Backups taken without LSN sidecar and with encrypted xtrabackup_checkpoints
+            logger.warning("Could not read LSNs of {}, falling back to directory name order".format(
+                ', '.join(missing) if missing else full_backup))
+            chain = sorted(inc_backups)
+            if until is not None:
+                if until not in chain:
+                    raise RuntimeError("Incremental backup {} is not found".format(until))
+                chain = chain[:chain.index(until) + 1]
+            return chain
+
+        if self.allow_forks:
+            return self.resolve_shortest(full_backup, full_to_lsn, lsns, until=until)
+
+        by_from_lsn = defaultdict(list)
+        for inc in sorted(inc_backups):
+            by_from_lsn[lsns[inc][0]].append(inc)
+
+        chain = []
+        while current_lsn in by_from_lsn:
+            candidates = by_from_lsn.pop(current_lsn)
+            # Empty incrementals(from_lsn == to_lsn) are harmless, anything else starting at the same LSN is a fork
+            advancing = [inc for inc in candidates if lsns[inc][1] != current_lsn]
+            if len(advancing) > 1:
+                raise RuntimeError("Overlapping incremental backups {} all start at LSN {}".format(
+                    ', '.join(advancing), current_lsn))
+            for inc in [i for i in candidates if i not in advancing] + advancing:
+                chain.append(inc)
+                if inc == until:
+                    return chain
+            if not advancing:
+                break
+            current_lsn = lsns[advancing[0]][1]
+
+        if until is not None:
+            raise RuntimeError("Incremental backup {} is not part of the chain of full backup {}".format(
+                until, full_backup))
+
+        leftovers = sorted(inc for incs in by_from_lsn.values() for inc in incs)
+        if leftovers:
+            self.broken_chain_errors(full_backup, full_to_lsn, current_lsn, lsns, leftovers)
+
+        logger.info("Resolved incremental backup chain of {}: {}".format(full_backup, ' -> '.join(chain)))
+        return chain
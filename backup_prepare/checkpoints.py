@@ -0,0 +1,78 @@
+# Helpers for reading xtrabackup_checkpoints files.
+# Every backup keeps a copy of this file in its LSN sidecar directory (see --extra-lsndir),
+# so the LSN metadata can be read without extracting streamed or encrypted backups.
+
+import os
+import re
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Checkpoints:
+
+    file_name = 'xtrabackup_checkpoints'
+
+    @staticmethod
+    def read(directory):
+        """
+        Static method for parsing xtrabackup_checkpoints file inside given directory.
+        :param directory: The directory containing xtrabackup_checkpoints
+        :return: Dictionary of checkpoint values, for eg, {'backup_type': 'full-backuped', 'to_lsn': 2503656, ...}
+                 or None if file does not exist.
+        """
+        path = os.path.join(directory, Checkpoints.file_name)
+        if not os.path.isfile(path):
+            return None
+
+        checkpoints = {}
+        with open(path, 'r') as xchk_file:
+            for line in xchk_file:
+                if '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                key, value = key.strip(), value.strip()
+                checkpoints[key] = int(value) if value.isdigit() else value
+        return checkpoints
+
+    @staticmethod
+    def to_lsn(directory):
+        """
+        Static method for getting to_lsn of the backup.
+        :param directory: The directory containing xtrabackup_checkpoints
+        :return: to_lsn as integer or None if it can not be found.
+        """
+        checkpoints = Checkpoints.read(directory)
+        if checkpoints is None or 'to_lsn' not in checkpoints:
+            return None
+        return checkpoints['to_lsn']
+
+    @staticmethod
+    def last_lsn(directory):
+        """
+        Static method for getting the LSN up to which the backup holds changes.
+        :param directory: The directory containing xtrabackup_checkpoints
+        :return: Greater of to_lsn and last_lsn as integer or None if they can not be found.
+        """
+        checkpoints = Checkpoints.read(directory) or {}
+        lsns = [checkpoints[key] for key in ('to_lsn', 'last_lsn') if isinstance(checkpoints.get(key), int)]
+        return max(lsns) if lsns else None
+
+    @staticmethod
+    def innodb_status_lsn(output):
+        """
+        Static method for parsing current LSN from SHOW ENGINE INNODB STATUS output.
+        :return: LSN as integer or None if it can not be found.
+        """
+        match = re.search(r'Log sequence number\s+(\d+)', output)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def is_extracted(directory):
+        """
+        Check if the backup directory already contains extracted backup files,
+        i.e it is not only holding the xbstream file.
+        :param directory: Backup directory path
+        :return: True if xtrabackup_checkpoints(plain or encrypted) is inside directory
+        """
+        return os.path.isfile(os.path.join(directory, Checkpoints.file_name)) or \
+            os.path.isfile(os.path.join(directory, Checkpoints.file_name + '.xbcrypt'))
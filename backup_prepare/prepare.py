@@ -7,11 +7,21 @@
 import os
 import subprocess
 import shutil
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from general_conf.generalops import GeneralClass
-from os.path import isfile
+from os.path import isdir, isfile, join
+from backup_prepare.checkpoints import Checkpoints
+from backup_prepare.chain import ChainResolver
+from backup_prepare.snapshot import Snapshot
+from backup_prepare.restore import Restore
+from backup_catalog.catalog import BackupCatalog
+from backup_catalog.sizing import Sizing
 from general_conf import path_config
 from process_runner.process_runner import  ProcessRunner
+from process_runner.cgroup import CgroupEnvelope
 import logging
 logger = logging.getLogger(__name__)
 
@@ -30,23 +40,166 @@ class Prepare(GeneralClass):
             pass
 
         if self.tag:
-            if not os.path.isfile("{}/backup_tags.txt".format(self.backupdir)):
-                raise RuntimeError("Could not find backup_tags.txt inside backup directory. "
+            if not BackupCatalog.exists(self.backupdir):
+                raise RuntimeError("Could not find backup catalog inside backup directory. "
                                    "Please run without --tag option")
 
+    @property
+    def catalog(self):
+        # Backup catalog inside backup directory, opened on first use
+        if not hasattr(self, '_catalog'):
+            self._catalog = BackupCatalog(self.backupdir)
+        return self._catalog
+
+    @property
+    def envelope(self):
+        # cgroup limits of spawned processes, new cgroup for every process, None if [Cgroup] is not configured
+        return CgroupEnvelope.from_config(self)
+
     def recent_full_backup_file(self):
         # Return last full backup dir name
-        if len(os.listdir(self.full_dir)) > 0:
+        if BackupCatalog.exists(self.backupdir) and self.catalog.has_backups('Full'):
+            recent = self.catalog.recent_backup('Full')
+            if recent:
+                return recent
+        # Backups taken before backup catalog existed
+        elif len(os.listdir(self.full_dir)) > 0:
             return max(os.listdir(self.full_dir))
-        else:
-            raise RuntimeError("The full backup directory is empty, it seems you have not backups")
+        raise RuntimeError("The full backup directory is empty, it seems you have not backups")
 
     def check_inc_backups(self):
         # Check for Incremental backups
+        if BackupCatalog.exists(self.backupdir) and self.catalog.has_backups('Inc'):
+            return 1 if self.catalog.backups(backup_type='Inc', status='OK') else 0
+        # Backups taken before backup catalog existed
         if len(os.listdir(self.inc_dir)) > 0:
             return 1
         return 0
 
+    def resolve_chain(self, until=None):
+        """
+        Method for resolving incremental backup chain of recent full backup from LSNs.
+        Gaps, overlaps and orphaned incremental backups are rejected before anything is prepared.
+        :param until: The incremental backup name to stop the chain at
+        :return: List of incremental backup names in apply order.
+        :raise: RuntimeError if chain is broken.
+        """
+        if BackupCatalog.exists(self.backupdir) and self.catalog.has_backups('Inc'):
+            catalog = self.catalog
+            inc_backups = [row['name'] for row in catalog.backups(backup_type='Inc', status='OK')
+                           if os.path.isdir(join(self.inc_dir, row['name']))]
+        else:
+            catalog = None
+            inc_backups = os.listdir(self.inc_dir)
+
+        resolver = ChainResolver(full_dir=self.full_dir, inc_dir=self.inc_dir, lsn_dir=self.lsn_dir, catalog=catalog,
+                                 allow_forks=self.inc_policy != 'chain')
+        return resolver.resolve(full_backup=self.recent_full_backup_file(), inc_backups=inc_backups, until=until)
+
+    def prepare_target(self, full_backup=None):
+        """
+        Method for finding the directory where full backup is prepared.
+        With prepare_snapshot enabled it is the snapshot of full backup, otherwise the full backup itself.
+        :param full_backup: Full backup directory name, recent full backup by default
+        :return: Full path of directory to prepare
+        """
+        if full_backup is None:
+            full_backup = self.recent_full_backup_file()
+        if hasattr(self, 'prepare_snapshot'):
+            return join(self.snapshot_dir, full_backup)
+        return join(self.full_dir, full_backup)
+
+    def create_snapshot(self, full_backup, inc_backups=()):
+        """
+        Method for cloning unpacked full backup into snapshot_dir, prior to prepare.
+        Only one snapshot is kept, previously prepared snapshot is removed.
+        :param full_backup: Full backup directory name
+        :param inc_backups: Incremental backup names which are going to be applied to snapshot
+        :return: True on success.
+        """
+        if not hasattr(self, 'prepare_snapshot'):
+            # Prepare writes full backup in place, files hardlinked to previous full backup(full_dedup) are copied
+            if self.dry == 0 and self.full_dedup in ('auto', 'hardlink'):
+                Snapshot.unshare_tree(join(self.full_dir, full_backup))
+            return True
+        snapshot = self.prepare_target(full_backup)
+        logger.info("Creating {} snapshot of full backup {} -> {}".format(self.prepare_snapshot,
+                                                                           full_backup, snapshot))
+        if self.dry == 1:
+            return True
+        if os.path.isdir(self.snapshot_dir):
+            for old_snapshot in os.listdir(self.snapshot_dir):
+                shutil.rmtree(join(self.snapshot_dir, old_snapshot))
+        inc_dirs = [join(self.inc_dir, inc) for inc in inc_backups]
+        if any(isfile(join(inc_dir, 'inc_backup.stream')) and not Checkpoints.is_extracted(inc_dir)
+               for inc_dir in inc_dirs):
+            # Streamed incrementals are extracted after cloning, so files they replace(.frm, MyISAM, CSV...)
+            # are not known yet and none of them can be shared with full backup
+            logger.info("Incremental backups are not extracted yet, no file of snapshot is hardlinked")
+            overwritten = None
+        else:
+            overwritten = Snapshot.overwritten_files(inc_dirs)
+        Snapshot(self.prepare_snapshot).clone_tree(join(self.full_dir, full_backup), snapshot,
+                                                   overwritten=overwritten)
+        return True
+
+    def extract_xbstream(self, backup_dir, stream_file, target_dir=None):
+        """
+        Method for extracting streamed backup into its own directory.
+        Incremental backups are based on LSN sidecars, so streams are not extracted during backup stage anymore
+        and every streamed backup in the chain is extracted here, prior to prepare.
+        :param backup_dir: Full path of backup directory
+        :param stream_file: The stream file name inside backup directory, full_backup.stream or inc_backup.stream
+        :param target_dir: Extract into this directory instead of backup directory itself
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        if not (hasattr(self, 'stream') and self.stream == 'xbstream'):
+            return True
+
+        target_dir = backup_dir if target_dir is None else target_dir
+        if Checkpoints.is_extracted(target_dir):
+            logger.info("{} is already extracted, skipping xbstream".format(target_dir))
+            return True
+
+        if hasattr(self, 'encrypt') and hasattr(self, 'xbs_decrypt'):
+            logger.info("Using xbstream to extract and decrypt from {}!".format(stream_file))
+            xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} -C {}".format(
+                                   self.xbstream,
+                                   self.xbstream_options,
+                                   self.decrypt,
+                                   self.encrypt_key,
+                                   self.encrypt_threads,
+                                   target_dir)
+        else:
+            logger.info("Using xbstream to extract from {}!".format(stream_file))
+            xbstream_command = "{} {} -C {}".format(
+                                self.xbstream,
+                                self.xbstream_options,
+                                target_dir)
+
+        logger.info("The following xbstream command will be executed {} < {}/{}".format(xbstream_command,
+                                                                                         backup_dir, stream_file))
+        if self.dry == 0 and isfile("{}/{}".format(backup_dir, stream_file)):
+            self.run_xbstream(xbstream_command, "{}/{}".format(backup_dir, stream_file))
+        return True
+
+    def run_xbstream(self, xbstream_command, stream_path):
+        """
+        Method for extracting stream file with xbstream, in cgroup envelope.
+        :param xbstream_command: xbstream command without input redirect
+        :param stream_path: Full path of stream file
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        try:
+            ProcessRunner.run_command(xbstream_command, envelope=self.envelope, stdin=stream_path)
+        except ChildProcessError:
+            logger.error("FAILED: XBSTREAM command.")
+            raise RuntimeError("FAILED: XBSTREAM command.")
+        logger.info("OK: XBSTREAM command succeeded.")
+        return True
+
     @staticmethod
     def parse_backup_tags(backup_dir, tag_name):
         """
@@ -54,17 +207,12 @@ class Prepare(GeneralClass):
         :param backup_dir: The backup directory path
         :param tag_name: The tag name to search
         :return: Tuple of (backup directory, backup type) (2017-11-09_19-37-16, Full).
-        :raises: RuntimeError if there is no such tag inside backup_tags.txt
+        :raises: RuntimeError if there is no such tag inside backup catalog
         """
-        if os.path.isfile("{}/backup_tags.txt".format(backup_dir)):
-            with open('{}/backup_tags.txt'.format(backup_dir), 'r') as bcktags:
-                f = bcktags.readlines()
-
-            for i in f:
-                splitted = i.split('\t')
-                if tag_name == splitted[-1].rstrip("'\n\r").lstrip("'"):
-                    return splitted[0], splitted[1]
+        found = BackupCatalog(backup_dir).find_by_tag(tag_name)
+        if found is None:
             raise RuntimeError('There is no such tag for backups')
+        return found['name'], found['backup_type']
 
     def prepare_with_tags(self):
         # Method for preparing backups based on passed backup tags
@@ -79,51 +227,35 @@ class Prepare(GeneralClass):
                         and hasattr(self, 'encrypt') \
                         and hasattr(self, 'xbs_decrypt'):
                     logger.info("Using xbstream to extract and decrypt from full_backup.stream!")
-                    xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} " \
-                                       "< {}/{}/full_backup.stream -C {}/{}".format(
+                    xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} -C {}/{}".format(
                         self.xbstream,
                         self.xbstream_options,
                         self.decrypt,
                         self.encrypt_key,
                         self.encrypt_threads,
                         self.full_dir,
-                        self.recent_full_backup_file(),
-                        self.full_dir,
                         self.recent_full_backup_file())
 
-                    logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-                    if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(
-                            self.full_dir, self.recent_full_backup_file())):
-                        status, output = subprocess.getstatusoutput(xbstream_command)
-                        if status == 0:
-                            logger.info("OK: XBSTREAM command succeeded.")
-                        else:
-                            logger.error("FAILED: XBSTREAM command.")
-                            logger.error(output)
-                            raise RuntimeError("FAILED: XBSTREAM command.")
+                    stream_path = "{}/{}/full_backup.stream".format(self.full_dir, self.recent_full_backup_file())
+                    logger.info("The following xbstream command will be executed {} < {}".format(
+                        xbstream_command, stream_path))
+                    if self.dry == 0 and isfile(stream_path):
+                        self.run_xbstream(xbstream_command, stream_path)
 
                 # Extract streamed full backup prior to executing incremental backup
                 elif hasattr(self, 'stream'):
                     logger.info("Using xbstream to extract from full_backup.stream!")
-                    xbstream_command = "{} {} < {}/{}/full_backup.stream -C {}/{}".format(
+                    xbstream_command = "{} {} -C {}/{}".format(
                         self.xbstream,
                         self.xbstream_options,
                         self.full_dir,
-                        self.recent_full_backup_file(),
-                        self.full_dir,
                         self.recent_full_backup_file())
 
-                    logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-
-                    if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(
-                            self.full_dir, self.recent_full_backup_file())):
-                        status, output = subprocess.getstatusoutput(xbstream_command)
-                        if status == 0:
-                            logger.info("OK: XBSTREAM command succeeded.")
-                        else:
-                            logger.error("FAILED: XBSTREAM command.")
-                            logger.error(output)
-                            raise RuntimeError("FAILED: XBSTREAM command.")
+                    stream_path = "{}/{}/full_backup.stream".format(self.full_dir, self.recent_full_backup_file())
+                    logger.info("The following xbstream command will be executed {} < {}".format(
+                        xbstream_command, stream_path))
+                    if self.dry == 0 and isfile(stream_path):
+                        self.run_xbstream(xbstream_command, stream_path)
 
                 # Check if decryption enabled
                 if hasattr(self, 'decrypt'):
@@ -144,7 +276,7 @@ class Prepare(GeneralClass):
                     logger.info("Trying to decrypt backup")
                     logger.info("Running decrypt command -> {}".format(decr))
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decr)
+                        status = ProcessRunner.run_command(decr, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decrypted!")
                         else:
@@ -168,18 +300,20 @@ class Prepare(GeneralClass):
                     logger.info("Trying to decompress backup")
                     logger.info("Running decompress command -> {}".format(decmp))
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decmp)
+                        status = ProcessRunner.run_command(decmp, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decompressed")
                         else:
                             logger.error("FAILED: FULL BACKUP decompression")
                             raise RuntimeError("FAILED: FULL BACKUP decompression")
 
+                # Prepare runs on snapshot(if enabled), so backup itself can be prepared again
+                self.create_snapshot(self.recent_full_backup_file())
+
                 # Actual prepare command goes here
-                xtrabackup_prepare_cmd = "{} --prepare --target-dir={}/{}".format(
+                xtrabackup_prepare_cmd = "{} --prepare --target-dir={}".format(
                     self.backup_tool,
-                    self.full_dir,
-                    self.recent_full_backup_file())
+                    self.prepare_target())
 
                 # Checking if extra options were passed:
                 if hasattr(self, 'xtra_options'):
@@ -192,7 +326,7 @@ class Prepare(GeneralClass):
                     xtrabackup_prepare_cmd += self.xtra_prepare_options
 
                 if self.dry == 0:
-                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd)
+                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd, envelope=self.envelope)
                     if not status:
                         logger.error("FAILED: FULL BACKUP prepare.")
                         raise RuntimeError("FAILED: FULL BACKUP prepare.")
@@ -203,202 +337,22 @@ class Prepare(GeneralClass):
                 self.prepare_only_full_backup()
             else:
                 logger.info("- - - - You have Incremental backups. - - - -")
-                if self.prepare_only_full_backup():
-                    logger.info("Preparing Incs: ")
-                    list_of_dir = sorted(os.listdir(self.inc_dir))
-                    # Find the index number inside all list for backup(which was found via tag)
-                    index_num = list_of_dir.index(found_backups[0])
-                    # Limit the iteration until this found backup
-                    for i in list_of_dir[:index_num+1]:
-                        if i != found_backups[0]:
-                            logger.info("Preparing inc backups in sequence. inc backup dir/name is {}".format(i))
-                            # Check if decryption enabled
-                            if hasattr(self, 'decrypt'):
-                                if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
-                                    decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        i)
-                                else:
-                                    decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{}".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        i)
-                                logger.info("Trying to decrypt backup")
-                                logger.info("Running decrypt command -> {}".format(decr))
-                                if self.dry == 0:
-                                    status = ProcessRunner.run_command(decr)
-                                    if status:
-                                        logger.info("OK: Decrypted!")
-                                    else:
-                                        logger.error("FAILED: FULL BACKUP decrypt.")
-                                        raise RuntimeError("FAILED: FULL BACKUP decrypt.")
-
-                            # Check if decompression enabled, if it is, decompress
-                            # backup prior prepare
-                            if hasattr(self, 'decompress'):
-                                #todo: this if decompress statement is a repeating pattern; functionalize it
-                                if hasattr(self, 'remove_original_comp') and self.remove_original_comp:
-                                    decmp = "{} --decompress={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decompress,
-                                        self.inc_dir,
-                                        i)
-                                else:
-                                    decmp = "{} --decompress={} --target-dir={}/{}".format(
-                                        self.backup_tool,
-                                        self.decompress,
-                                        self.inc_dir,
-                                        i)
-                                logger.info("Trying to decompress backup")
-                                logger.info(
-                                    "Running decompress command -> {}".format(decmp))
-                                if self.dry == 0:
-                                    status = ProcessRunner.run_command(decmp)
-                                    if status:
-                                        logger.info("OK: Decompressed")
-                                    else:
-                                        logger.error("FAILED: INCREMENTAL BACKUP decompression.")
-                                        raise RuntimeError("FAILED: INCREMENTAL BACKUP decompression.")
-
-                            # Actual prepare command goes here
-                            xtrabackup_prepare_cmd = '{} --prepare {} --target-dir={}/{} --incremental-dir={}/{}'\
-                                .format(self.backup_tool,
-                                        self.xtrabck_prepare,
-                                        self.full_dir,
-                                        self.recent_full_backup_file(),
-                                        self.inc_dir,
-                                        i)
-
-                            # Checking if extra options were passed:
-                            if hasattr(self, 'xtra_options'):
-                                xtrabackup_prepare_cmd += " "
-                                xtrabackup_prepare_cmd += self.xtra_options
-
-                            # Checking of extra prepare options were passed:
-                            if hasattr(self, 'xtra_prepare_options'):
-                                xtrabackup_prepare_cmd += " "
-                                xtrabackup_prepare_cmd += self.xtra_prepare_options
-
-                            logger.info("Running prepare command -> {}".format(xtrabackup_prepare_cmd))
-                            if self.dry == 0:
-                                status = ProcessRunner.run_command(xtrabackup_prepare_cmd)
-                                if not status:
-                                    logger.error("FAILED: Incremental BACKUP prepare")
-                                    raise RuntimeError("FAILED: Incremental BACKUP prepare")
-
-                        else:
-                            logger.info("Preparing last incremental backup, inc backup dir/name is {}".format(i))
-                            # Extracting streamed incremental backup prior to preparing
-
-                            if hasattr(self, 'stream'):
-                                logger.info("Using xbstream to extract from inc_backup.stream!")
-                                xbstream_command = "{} {} < {}/{}/inc_backup.stream -C {}/{}".format(
-                                    self.xbstream,
-                                    self.xbstream_options,
-                                    self.inc_dir,
-                                    i,
-                                    self.inc_dir,
-                                    i)
-
-                                logger.info(
-                                    "The following xbstream command will be executed {}".format(xbstream_command))
-                                if self.dry == 0 and isfile("{}/{}/inc_backup.stream".format(self.inc_dir, i)):
-                                    status, output = subprocess.getstatusoutput(xbstream_command)
-                                    if status == 0:
-                                        logger.info("OK: XBSTREAM command succeeded.")
-                                    else:
-                                        logger.error("FAILED: XBSTREAM command.")
-                                        logger.error(output)
-                                        raise RuntimeError("FAILED: XBSTREAM command.")
-
-                            # Check if decryption enabled
-                            if hasattr(self, 'decrypt'):
-                                if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
-                                    decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        i)
-                                else:
-                                    decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{}".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        i)
-
-                                logger.info("Trying to decrypt backup")
-                                logger.info("Running decrypt command -> {}".format(decr))
-                                if self.dry == 0:
-                                    status = ProcessRunner.run_command(decr)
-                                    if status:
-                                        logger.info("OK: Decrypted!")
-                                    else:
-                                        logger.error("FAILED: FULL BACKUP decrypt.")
-                                        raise RuntimeError
-
-                            # Check if decompression enabled, if it is, decompress
-                            # backup prior prepare
-                            if hasattr(self, 'decompress'):
-                                if hasattr(self, 'remove_original_comp') and self.remove_original_comp:
-                                    decmp = "{} --decompress={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decompress,
-                                        self.inc_dir,
-                                        i)
-                                else:
-                                    decmp = "{} --decompress={} --target-dir={}/{}".format(
-                                        self.backup_tool,
-                                        self.decompress,
-                                        self.inc_dir,
-                                        i)
-                                logger.info("Trying to decompress backup")
-                                logger.info("Running decompress command -> {}".format(decmp))
-
-                                if self.dry == 0:
-                                    status = ProcessRunner.run_command(decmp)
-                                    if status:
-                                        logger.info("OK: Decompressed")
-                                    else:
-                                        logger.error("FAILED: INCREMENTAL BACKUP decompression")
-                                        raise RuntimeError("FAILED: INCREMENTAL BACKUP decompression")
-
-                            xtrabackup_prepare_inc_cmd = '{} --prepare --target-dir={}/{} --incremental-dir={}/{}'.format(
-                                self.backup_tool,
-                                self.full_dir,
-                                self.recent_full_backup_file(),
-                                self.inc_dir,
-                                i)
-
-                            # Checking if extra options were passed:
-                            if hasattr(self, 'xtra_options'):
-                                xtrabackup_prepare_inc_cmd += " "
-                                xtrabackup_prepare_inc_cmd += self.xtra_options
-
-                            # Checking of extra prepare options were passed:
-                            if hasattr(self, 'xtra_prepare_options'):
-                                xtrabackup_prepare_inc_cmd += " "
-                                xtrabackup_prepare_inc_cmd += self.xtra_prepare_options
-
-                            logger.info("Running prepare command -> {}".format(xtrabackup_prepare_inc_cmd))
-                            if self.dry == 0:
-                                status2 = ProcessRunner.run_command(xtrabackup_prepare_inc_cmd)
-                                if not status2:
-                                    logger.error("FAILED: Incremental BACKUP prepare")
-                                    raise RuntimeError("FAILED: Incremental BACKUP prepare")
+                # Resolve the chain until the backup(which was found via tag) prior to preparing anything
+                list_of_dir = self.resolve_chain(until=found_backups[0])
+                if self.prepare_only_full_backup(inc_backups=list_of_dir):
+                    self.prepare_inc_backups(list_of_dir)
 
         logger.info("- - - - The end of the Prepare Stage. - - - -")
     ##########################################################################
     # PREPARE ONLY FULL BACKUP
     ##########################################################################
 
-    def prepare_only_full_backup(self):
+    def prepare_only_full_backup(self, inc_backups=()):
+        """
+        Method for preparing recent full backup.
+        :param inc_backups: Incremental backup names to be applied afterwards, if any
+        :return: True on success.
+        """
         recent_bck = self.recent_full_backup_file()
         if recent_bck:
             if self.check_inc_backups() == 0:
@@ -410,64 +364,47 @@ class Prepare(GeneralClass):
                                                                                 recent_bck)
                     logger.info("The following tar command will be executed -> {}".format(untar_cmd))
                     if self.dry == 0 and isfile("{}/{}/full_backup.tar".format(self.full_dir, recent_bck)):
-                        status, output = subprocess.getstatusoutput(untar_cmd)
-                        if status == 0:
-                            logger.info("OK: extracting full backup from tar.")
-                        else:
+                        try:
+                            ProcessRunner.run_command(untar_cmd, envelope=self.envelope)
+                        except ChildProcessError:
                             logger.error("FAILED: extracting full backup from tar")
-                            logger.error(output)
                             raise RuntimeError("FAILED: extracting full backup from tar")
+                        logger.info("OK: extracting full backup from tar.")
 
                 # Extract and decrypt streamed full backup prior to executing incremental backup
                 if hasattr(self, 'stream') and self.stream == 'xbstream' \
                         and hasattr(self, 'encrypt') \
                         and hasattr(self, 'xbs_decrypt'):
                     logger.info("Using xbstream to extract and decrypt from full_backup.stream!")
-                    xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} " \
-                                       "< {}/{}/full_backup.stream -C {}/{}".format(
+                    xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} -C {}/{}".format(
                                            self.xbstream,
                                            self.xbstream_options,
                                            self.decrypt,
                                            self.encrypt_key,
                                            self.encrypt_threads,
                                            self.full_dir,
-                                           recent_bck,
-                                           self.full_dir,
                                            recent_bck)
 
-                    logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-                    if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(
-                                                self.full_dir, recent_bck)):
-                        status, output = subprocess.getstatusoutput(xbstream_command)
-                        if status == 0:
-                            logger.info("OK: XBSTREAM command succeeded.")
-                        else:
-                            logger.error("FAILED: XBSTREAM command.")
-                            logger.error(output)
-                            raise RuntimeError("FAILED: XBSTREAM command.")
+                    stream_path = "{}/{}/full_backup.stream".format(self.full_dir, recent_bck)
+                    logger.info("The following xbstream command will be executed {} < {}".format(
+                        xbstream_command, stream_path))
+                    if self.dry == 0 and isfile(stream_path):
+                        self.run_xbstream(xbstream_command, stream_path)
 
                 # Extract streamed full backup prior to executing incremental backup
                 elif hasattr(self, 'stream') and self.stream == 'xbstream':
                     logger.info("Using xbstream to extract from full_backup.stream!")
-                    xbstream_command = "{} {} < {}/{}/full_backup.stream -C {}/{}".format(
+                    xbstream_command = "{} {} -C {}/{}".format(
                                         self.xbstream,
                                         self.xbstream_options,
                                         self.full_dir,
-                                        recent_bck,
-                                        self.full_dir,
                                         recent_bck)
 
-                    logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-
-                    if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(
-                                                self.full_dir, recent_bck)):
-                        status, output = subprocess.getstatusoutput(xbstream_command)
-                        if status == 0:
-                            logger.info("OK: XBSTREAM command succeeded.")
-                        else:
-                            logger.error("FAILED: XBSTREAM command.")
-                            logger.error(output)
-                            raise RuntimeError("FAILED: XBSTREAM command.")
+                    stream_path = "{}/{}/full_backup.stream".format(self.full_dir, recent_bck)
+                    logger.info("The following xbstream command will be executed {} < {}".format(
+                        xbstream_command, stream_path))
+                    if self.dry == 0 and isfile(stream_path):
+                        self.run_xbstream(xbstream_command, stream_path)
 
                 # Check if decryption enabled
                 if hasattr(self, 'decrypt'):
@@ -488,7 +425,7 @@ class Prepare(GeneralClass):
                     logger.info("Trying to decrypt backup")
                     logger.info("Running decrypt command -> {}".format(decr))
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decr)
+                        status = ProcessRunner.run_command(decr, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decrypted!")
                         else:
@@ -511,18 +448,20 @@ class Prepare(GeneralClass):
                                  recent_bck)
                     logger.info("Trying to decompress backup")
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decmp)
+                        status = ProcessRunner.run_command(decmp, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decompressed")
                         else:
                             logger.error("FAILED: FULL BACKUP decompression")
                             raise RuntimeError("FAILED: FULL BACKUP decompression")
 
+                # Prepare runs on snapshot(if enabled), so backup itself can be prepared again
+                self.create_snapshot(recent_bck)
+
                 # Actual prepare command goes here
-                xtrabackup_prepare_cmd = "{} --prepare --target-dir={}/{}".format(
+                xtrabackup_prepare_cmd = "{} --prepare --target-dir={}".format(
                         self.backup_tool,
-                        self.full_dir,
-                        recent_bck)
+                        self.prepare_target(recent_bck))
 
                 # Checking if extra options were passed:
                 if hasattr(self, 'xtra_options'):
@@ -537,7 +476,7 @@ class Prepare(GeneralClass):
                 logger.debug("Running prepare command -> {}".format(xtrabackup_prepare_cmd))
 
                 if self.dry == 0:
-                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd)
+                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd, envelope=self.envelope)
                     if status:
                         logger.info("Prepare command ran successfully.")
                     else:
@@ -549,6 +488,9 @@ class Prepare(GeneralClass):
                 logger.info("- - - - Final prepare,will occur after preparing all inc backups - - - -")
                 time.sleep(3)
 
+                # Extract streamed full backup, it is not extracted while taking incremental backups
+                self.extract_xbstream(join(self.full_dir, recent_bck), 'full_backup.stream')
+
                 # Check if decryption enabled
                 if hasattr(self, 'decrypt'):
                     if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
@@ -568,7 +510,7 @@ class Prepare(GeneralClass):
                     logger.info("Trying to decrypt backup")
                     logger.info("Running decrypt command -> {}".format(decr))
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decr)
+                        status = ProcessRunner.run_command(decr, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decrypted!")
                         else:
@@ -593,19 +535,21 @@ class Prepare(GeneralClass):
                     logger.info("Trying to decompress backup")
                     logger.info("Running decompress command -> {}".format(decmp))
                     if self.dry == 0:
-                        status = ProcessRunner.run_command(decmp)
+                        status = ProcessRunner.run_command(decmp, envelope=self.envelope)
                         if status:
                             logger.info("OK: Decompressed")
                         else:
                             logger.error("FAILED: FULL BACKUP decompression")
                             raise RuntimeError("FAILED: FULL BACKUP decompression")
 
+                # Prepare runs on snapshot(if enabled), so more incrementals can be applied to backup later
+                self.create_snapshot(recent_bck, inc_backups=inc_backups)
+
                 # Actual prepare command goes here
-                xtrabackup_prepare_cmd = '{} --prepare {} --target-dir={}/{}'.format(
+                xtrabackup_prepare_cmd = '{} --prepare {} --target-dir={}'.format(
                         self.backup_tool,
                         self.xtrabck_prepare,
-                        self.full_dir,
-                        self.recent_full_backup_file())
+                        self.prepare_target(recent_bck))
 
                 # Checking if extra options were passed:
                 if hasattr(self, 'xtra_options'):
@@ -619,7 +563,7 @@ class Prepare(GeneralClass):
 
                 logger.info("Running prepare command -> {}".format(xtrabackup_prepare_cmd))
                 if self.dry == 0:
-                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd)
+                    status = ProcessRunner.run_command(xtrabackup_prepare_cmd, envelope=self.envelope)
                     if status:
                         logger.info("Prepare command ran successfully")
                     else:
@@ -633,6 +577,229 @@ class Prepare(GeneralClass):
     # PREPARE INC BACKUPS
     ##########################################################################
 
+    def decrypt_backup(self, backup_dir):
+        """
+        Method for decrypting backup directory, if decryption is enabled.
+        :param backup_dir: Full path of backup directory
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        if not hasattr(self, 'decrypt'):
+            return True
+
+        decr = "{} --decrypt={} --encrypt-key={} --target-dir={}".format(
+                self.backup_tool,
+                self.decrypt,
+                self.encrypt_key,
+                backup_dir)
+        if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
+            decr += " --remove-original"
+        logger.info("Trying to decrypt backup")
+        logger.info("Running decrypt command -> {}".format(decr))
+        if self.dry == 0:
+            status = ProcessRunner.run_command(decr, envelope=self.envelope)
+            if status:
+                logger.info("OK: Decrypted!")
+            else:
+                logger.error("FAILED: BACKUP decrypt -> {}".format(backup_dir))
+                raise RuntimeError("FAILED: BACKUP decrypt -> {}".format(backup_dir))
+        return True
+
+    def decompress_backup(self, backup_dir):
+        """
+        Method for decompressing backup directory, if decompression is enabled.
+        :param backup_dir: Full path of backup directory
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        if not hasattr(self, 'decompress'):
+            return True
+
+        decmp = "{} --decompress={} --target-dir={}".format(
+                 self.backup_tool,
+                 self.decompress,
+                 backup_dir)
+        if hasattr(self, 'remove_original_comp') and self.remove_original_comp:
+            decmp += " --remove-original"
+        logger.info("Trying to decompress backup")
+        logger.info("Running decompress command -> {}".format(decmp))
+        if self.dry == 0:
+            status = ProcessRunner.run_command(decmp, envelope=self.envelope)
+            if status:
+                logger.info("OK: Decompressed")
+            else:
+                logger.error("FAILED: BACKUP decompression -> {}".format(backup_dir))
+                raise RuntimeError("FAILED: BACKUP decompression -> {}".format(backup_dir))
+        return True
+
+    def unpack_inc_backup(self, inc_backup_dir):
+        """
+        Method for making incremental backup ready to apply: extract stream, decrypt and decompress.
+        These steps are CPU-bound and independent for every incremental, so they can run ahead of apply.
+        :param inc_backup_dir: Incremental backup directory name
+        :return: inc_backup_dir
+        """
+        path = join(self.inc_dir, inc_backup_dir)
+        self.extract_xbstream(path, 'inc_backup.stream')
+        self.decrypt_backup(path)
+        self.decompress_backup(path)
+        return inc_backup_dir
+
+    def estimate_unpack_size(self, inc_backup_dir):
+        """
+        Method for estimating additional disk space needed for unpacking incremental backup.
+        Extracted stream and decompressed files are written next to the originals,
+        so roughly the size of backup is needed for every step.
+        :param inc_backup_dir: Incremental backup directory name
+        :return: Estimated size in bytes
+        """
+        catalog = self.catalog if BackupCatalog.exists(self.backupdir) else None
+        size = Sizing.backup_size(catalog, inc_backup_dir, join(self.inc_dir, inc_backup_dir))
+        steps = sum(1 for i in ('stream', 'decrypt', 'decompress') if hasattr(self, i))
+        return size * steps
+
+    def unpacked_inc_backups(self, list_of_dir):
+        """
+        Generator for yielding incremental backups in chain order, each one already unpacked.
+        With prepare_lookahead > 0, worker pool unpacks next incremental backups while caller applies current one.
+        The look-ahead is limited by free disk space of inc_dir.
+        :param list_of_dir: Incremental backup names in apply order
+        """
+        if self.prepare_lookahead <= 0 or self.dry == 1:
+            for inc_backup_dir in list_of_dir:
+                yield self.unpack_inc_backup(inc_backup_dir)
+            return
+
+        logger.info("Unpacking up to {} incremental backups ahead of prepare".format(self.prepare_lookahead))
+        waiting = deque(list_of_dir)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.prepare_lookahead)
+        try:
+            while waiting or pending:
+                # Keep current backup plus look-ahead ones in the pipeline
+                while waiting and len(pending) <= self.prepare_lookahead:
+                    need = self.estimate_unpack_size(waiting[0])
+                    reserved = sum(size for future, size in pending if not future.done())
+                    if pending and reserved + need > shutil.disk_usage(self.inc_dir).free:
+                        logger.info("Not enough free space to unpack {} ahead, waiting".format(waiting[0]))
+                        break
+                    pending.append((executor.submit(self.unpack_inc_backup, waiting.popleft()), need))
+                future, need = pending.popleft()
+                yield future.result()
+        finally:
+            for future, need in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def prepare_command(self, target_dir, incremental_dir=None, final=False):
+        """
+        Method for building xtrabackup --prepare command.
+        :param target_dir: Full path of full backup to prepare
+        :param incremental_dir: Full path of incremental backup to apply, if any
+        :param final: If True, --apply-log-only(xtra_prepare) is not passed
+        :return: String of prepare command
+        """
+        if final:
+            xtrabackup_prepare_cmd = '{} --prepare --target-dir={}'.format(self.backup_tool, target_dir)
+        else:
+            xtrabackup_prepare_cmd = '{} --prepare {} --target-dir={}'.format(self.backup_tool,
+                                                                             self.xtrabck_prepare,
+                                                                             target_dir)
+        if incremental_dir is not None:
+            xtrabackup_prepare_cmd += ' --incremental-dir={}'.format(incremental_dir)
+
+        # Checking if extra options were passed:
+        if hasattr(self, 'xtra_options'):
+            xtrabackup_prepare_cmd += " "
+            xtrabackup_prepare_cmd += self.xtra_options
+
+        # Checking of extra prepare options were passed:
+        if hasattr(self, 'xtra_prepare_options'):
+            xtrabackup_prepare_cmd += " "
+            xtrabackup_prepare_cmd += self.xtra_prepare_options
+        return xtrabackup_prepare_cmd
+
+    def apply_inc_backup(self, inc_backup_dir, last=False):
+        """
+        Method for applying unpacked incremental backup to recent full backup.
+        :param inc_backup_dir: Incremental backup directory name
+        :param last: If True, final prepare is run(without --apply-log-only)
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        if last:
+            logger.info("Preparing last incremental backup, inc backup dir/name is {}".format(inc_backup_dir))
+        else:
+            logger.info("Preparing inc backups in sequence. inc backup dir/name is {}".format(inc_backup_dir))
+        xtrabackup_prepare_inc_cmd = self.prepare_command(target_dir=self.prepare_target(),
+                                                          incremental_dir=join(self.inc_dir, inc_backup_dir),
+                                                          final=last)
+
+        logger.info("Running prepare command -> {}".format(xtrabackup_prepare_inc_cmd))
+        if self.dry == 0:
+            start = time.time()
+            status = ProcessRunner.run_command(xtrabackup_prepare_inc_cmd, envelope=self.envelope)
+            if not status:
+                logger.error("FAILED: Incremental BACKUP prepare")
+                raise RuntimeError("FAILED: Incremental BACKUP prepare")
+            # Measured apply time is used for projecting prepare time of backup chains(see backup_scheduler)
+            if BackupCatalog.exists(self.backupdir):
+                self.catalog.update_backup(inc_backup_dir, prepare_duration=time.time() - start)
+        return True
+
+    def run_prepare(self, target_dir, incremental_dir=None, final=False):
+        command = self.prepare_command(target_dir=target_dir, incremental_dir=incremental_dir, final=final)
+        logger.info("Running prepare command -> {}".format(command))
+        if self.dry == 0:
+            status = ProcessRunner.run_command(command, envelope=self.envelope)
+            if not status:
+                logger.error("FAILED: prepare -> {}".format(target_dir))
+                raise RuntimeError("FAILED: prepare -> {}".format(target_dir))
+        return True
+
+    def copy_backup(self, backup_dir, stream_file, target_dir):
+        """
+        Method for copying backup into separate directory, for shadow copy and synthetic full backup.
+        Streamed backups are extracted straight into target directory, original backup is left untouched.
+        :param backup_dir: Full path of full or incremental backup
+        :param stream_file: The stream file name inside backup directory
+        :param target_dir: Directory to copy into, replaced if it exists
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        logger.info("Copying {} to {}".format(backup_dir, target_dir))
+        if self.dry == 1:
+            return True
+        if isdir(target_dir):
+            shutil.rmtree(target_dir)
+
+        if hasattr(self, 'stream') and self.stream == 'xbstream' and isfile(join(backup_dir, stream_file)):
+            os.makedirs(target_dir)
+            self.extract_xbstream(backup_dir, stream_file, target_dir=target_dir)
+        elif hasattr(self, 'stream') and self.stream == 'tar' and isfile(join(backup_dir, 'full_backup.tar')):
+            os.makedirs(target_dir)
+            untar_cmd = "tar -xf {}/full_backup.tar -C {}".format(backup_dir, target_dir)
+            logger.info("The following tar command will be executed -> {}".format(untar_cmd))
+            try:
+                ProcessRunner.run_command(untar_cmd, envelope=self.envelope)
+            except ChildProcessError:
+                logger.error("FAILED: extracting full backup from tar")
+                raise RuntimeError("FAILED: extracting full backup from tar")
+        else:
+            shutil.copytree(backup_dir, target_dir)
+        return True
+
+    def prepare_inc_backups(self, list_of_dir):
+        """
+        Method for applying resolved incremental backup chain to already prepared(--apply-log-only) full backup.
+        :param list_of_dir: Incremental backup names in apply order, the last one gets final prepare
+        :return: True on success.
+        """
+        logger.info("Preparing Incs: ")
+        for inc_backup_dir in self.unpacked_inc_backups(list_of_dir):
+            self.apply_inc_backup(inc_backup_dir, last=inc_backup_dir == list_of_dir[-1])
+        return True
+
     def prepare_inc_full_backups(self):
         if self.check_inc_backups() == 0:
             logger.info("- - - - You have no Incremental backups. So will prepare only latest Full backup - - - -")
@@ -640,190 +807,10 @@ class Prepare(GeneralClass):
             return status
         else:
             logger.info("- - - - You have Incremental backups. - - - -")
-            if self.prepare_only_full_backup():
-                logger.info("Preparing Incs: ")
-                list_of_dir = sorted(os.listdir(self.inc_dir))
-                for inc_backup_dir in list_of_dir:
-                    if inc_backup_dir != max(os.listdir(self.inc_dir)):
-                        logger.info("Preparing inc backups in sequence. inc backup dir/name is {}".format(inc_backup_dir))
-                        # Check if decryption enabled
-                        if hasattr(self, 'decrypt'):
-                            if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
-                                decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        inc_backup_dir)
-                            else:
-                                decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{}".format(
-                                         self.backup_tool,
-                                         self.decrypt,
-                                         self.encrypt_key,
-                                         self.inc_dir,
-                                         inc_backup_dir)
-                            logger.info("Trying to decrypt backup")
-                            logger.info("Running decrypt command -> {}".format(decr))
-                            if self.dry == 0:
-                                status = ProcessRunner.run_command(decr)
-                                if status:
-                                    logger.info("OK: Decrypted!")
-                                else:
-                                    logger.error("FAILED: FULL BACKUP decrypt.")
-                                    raise RuntimeError("FAILED: FULL BACKUP decrypt.")
-
-                        # Check if decompression enabled, if it is, decompress
-                        # backup prior prepare
-                        if hasattr(self, 'decompress'):
-                            if hasattr(self, 'remove_original_comp') and self.remove_original_comp:
-                                decmp = "{} --decompress={} --target-dir={}/{} --remove-original".format(
-                                         self.backup_tool,
-                                         self.decompress,
-                                         self.inc_dir,
-                                         inc_backup_dir)
-                            else:
-                                decmp = "{} --decompress={} --target-dir={}/{}".format(
-                                         self.backup_tool,
-                                         self.decompress,
-                                         self.inc_dir,
-                                         inc_backup_dir)
-                            logger.info("Trying to decompress backup")
-                            logger.info(
-                                "Running decompress command -> {}".format(decmp))
-                            if self.dry == 0:
-                                status = ProcessRunner.run_command(decmp)
-                                if status:
-                                    logger.info("OK: Decompressed")
-                                else:
-                                    logger.error("FAILED: FULL BACKUP decrypt.")
-                                    raise RuntimeError("FAILED: FULL BACKUP decrypt.")
-                                                   
-                        # Actual prepare command goes here
-                        xtrabackup_prepare_inc_cmd = '{} --prepare {} --target-dir={}/{} --incremental-dir={}/{}' \
-                            .format(self.backup_tool,
-                                    self.xtrabck_prepare,
-                                    self.full_dir,
-                                    self.recent_full_backup_file(),
-                                    self.inc_dir,
-                                    inc_backup_dir)
-                        
-                        # Checking if extra options were passed:
-                        if hasattr(self, 'xtra_options'):
-                            xtrabackup_prepare_inc_cmd += " "
-                            xtrabackup_prepare_inc_cmd += self.xtra_options
-
-                        # Checking of extra prepare options were passed:
-                        if hasattr(self, 'xtra_prepare_options'):
-                            xtrabackup_prepare_inc_cmd += " "
-                            xtrabackup_prepare_inc_cmd += self.xtra_prepare_options
-
-                        logger.info("Running prepare command -> {}".format(xtrabackup_prepare_inc_cmd))
-                        if self.dry == 0:
-                            status = ProcessRunner.run_command(xtrabackup_prepare_inc_cmd)
-                            if not status:
-                                logger.error("FAILED: Incremental BACKUP prepare")
-                                raise RuntimeError("FAILED: Incremental BACKUP prepare")
-
-                    else:
-                        logger.info("Preparing last incremental backup, inc backup dir/name is {}".format(inc_backup_dir))
-                        # Extracting streamed incremental backup prior to preparing
-
-                        if hasattr(self, 'stream'):
-                            logger.info("Using xbstream to extract from inc_backup.stream!")
-                            xbstream_command = "{} {} < {}/{}/inc_backup.stream -C {}/{}".format(
-                                                self.xbstream,
-                                                self.xbstream_options,
-                                                self.inc_dir,
-                                                inc_backup_dir,
-                                                self.inc_dir,
-                                                inc_backup_dir)
-
-                            logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-                            if self.dry == 0 and isfile("{}/{}/inc_backup.stream".format(self.inc_dir, inc_backup_dir)):
-                                status, output = subprocess.getstatusoutput(xbstream_command)
-                                if status == 0:
-                                    logger.info("OK: XBSTREAM command succeeded.")
-                                else:
-                                    logger.error("FAILED: XBSTREAM command.")
-                                    logger.error(output)
-                                    raise RuntimeError("FAILED: XBSTREAM command.")
-
-                        # Check if decryption enabled
-                        if hasattr(self, 'decrypt'):
-                            if hasattr(self, 'remove_original_enc') and self.remove_original_enc:
-                                decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{} --remove-original".format(
-                                        self.backup_tool,
-                                        self.decrypt,
-                                        self.encrypt_key,
-                                        self.inc_dir,
-                                        inc_backup_dir)
-                            else:
-                                decr = "{} --decrypt={} --encrypt-key={} --target-dir={}/{}".format(
-                                                                    self.backup_tool,
-                                                                    self.decrypt,
-                                                                    self.encrypt_key,
-                                                                    self.inc_dir,
-                                                                    inc_backup_dir)
-
-                            logger.info("Trying to decrypt backup")
-                            logger.info("Running decrypt command -> {}".format(decr))
-                            if self.dry == 0:
-                                status = ProcessRunner.run_command(decr)
-                                if status:
-                                    logger.info("OK: Decrypted!")
-                                else:
-                                    logger.error("FAILED: FULL BACKUP decrypt.")
-                                    raise RuntimeError
-
-                        # Check if decompression enabled, if it is, decompress
-                        # backup prior prepare
-                        if hasattr(self, 'decompress'):
-                            if hasattr(self, 'remove_original_comp') and self.remove_original_comp:
-                                decmp = "{} --decompress={} --target-dir={}/{} --remove-original".format(
-                                         self.backup_tool,
-                                         self.decompress,
-                                         self.inc_dir,
-                                         inc_backup_dir)
-                            else:
-                                decmp = "{} --decompress={} --target-dir={}/{}".format(
-                                         self.backup_tool,
-                                         self.decompress,
-                                         self.inc_dir,
-                                         inc_backup_dir)
-                            logger.info("Trying to decompress backup")
-                            logger.info("Running decompress command -> {}".format(decmp))
-
-                            if self.dry == 0:
-                                status = ProcessRunner.run_command(decmp)
-                                if status:
-                                    logger.info("OK: Decompressed")
-                                else:
-                                    logger.error("FAILED: INCREMENTAL BACKUP decompression")
-                                    raise RuntimeError("FAILED: INCREMENTAL BACKUP decompression")
-
-                        xtrabackup_prepare_inc_cmd = '{} --prepare --target-dir={}/{} --incremental-dir={}/{}'.format(
-                                self.backup_tool,
-                                self.full_dir,
-                                self.recent_full_backup_file(),
-                                self.inc_dir,
-                                inc_backup_dir)
-                        
-                        # Checking if extra options were passed:
-                        if hasattr(self, 'xtra_options'):
-                            xtrabackup_prepare_inc_cmd += " "
-                            xtrabackup_prepare_inc_cmd += self.xtra_options
-
-                        # Checking of extra prepare options were passed:
-                        if hasattr(self, 'xtra_prepare_options'):
-                            xtrabackup_prepare_inc_cmd += " "
-                            xtrabackup_prepare_inc_cmd += self.xtra_prepare_options
-
-                        logger.info("Running prepare command -> {}".format(xtrabackup_prepare_inc_cmd))
-                        if self.dry == 0:
-                            status = ProcessRunner.run_command(xtrabackup_prepare_inc_cmd)
-                            if not status:
-                                logger.error("FAILED: Incremental BACKUP prepare")
-                                raise RuntimeError("FAILED: Incremental BACKUP prepare")
+            # Resolve and validate the whole chain prior to preparing anything
+            list_of_dir = self.resolve_chain()
+            if self.prepare_only_full_backup(inc_backups=list_of_dir):
+                self.prepare_inc_backups(list_of_dir)
 
             logger.info("- - - - The end of the Prepare Stage. - - - -")
             return True
@@ -845,68 +832,102 @@ class Prepare(GeneralClass):
             logger.error(output)
             raise RuntimeError("FAILED: Shutdown MySQL -> {}".format(output))
 
+    @staticmethod
+    def empty_directory(path):
+        """
+        Static method for deleting everything inside directory, keeping directory itself.
+        :param path: Directory to empty
+        """
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def remove_in_background(path):
+        """
+        Static method for deleting directory without waiting for it.
+        The directory is renamed to a sibling first(same filesystem, so it is instant), then removed by thread.
+        A mount point can not be renamed, so its entries are deleted by thread and the directory is kept;
+        join the thread before writing into it again.
+        :param path: Directory to delete
+        :return: The thread removing directory
+        """
+        if os.path.ismount(path):
+            logger.info("{} is a mount point, emptying it in background".format(path))
+            thread = threading.Thread(target=Prepare.empty_directory, args=(path,),
+                                      name='empty-{}'.format(os.path.basename(path.rstrip('/'))))
+            thread.start()
+            return thread
+        trash = "{}.deleted.{}".format(path.rstrip('/'), time.strftime('%Y-%m-%d_%H-%M-%S'))
+        os.rename(path, trash)
+        logger.info("Removing {} in background".format(trash))
+        thread = threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={'ignore_errors': True},
+                                  name='remove-{}'.format(os.path.basename(trash)))
+        thread.start()
+        return thread
+
     def move_datadir(self):
-        # Move datadir to new directory
+        """
+        Method for moving MySQL datadir to tmpdir and creating empty datadir.
+        Same filesystem: atomic rename. Another filesystem or datadir is a mount point: parallel copy,
+        then the datadir is deleted in background(a mount point is emptied and kept, copy-back waits for it).
+        Previous tmpdir is deleted in background as well.
+        :return: True on success, False on error.
+        """
         logger.info("Moving MySQL datadir to {}".format(self.tmpdir))
-        if os.path.isdir(self.tmpdir):
-            rmdirc = 'rm -rf {}'.format(self.tmpdir)
-            status, output = subprocess.getstatusoutput(rmdirc)
-            if status == 0:
+        try:
+            if os.path.isdir(self.tmpdir):
+                thread = self.remove_in_background(self.tmpdir)
+                if os.path.isdir(self.tmpdir):
+                    # Mount point is kept, datadir is copied into it
+                    thread.join()
                 logger.info("Emptied {} directory ...".format(self.tmpdir))
-                try:
-                    shutil.move(self.datadir, self.tmpdir)
-                    logger.info("Moved datadir to {} ...".format(self.tmpdir))
-                except shutil.Error as err:
-                    logger.error("Error occurred while moving datadir")
-                    logger.error(err)
-                    return False
-
-                logger.info("Creating an empty data directory ...")
-                makedir = "mkdir {}".format(self.datadir)
-                status2, output2 = subprocess.getstatusoutput(makedir)
-                if status2 == 0:
-                    logger.info("Datadir is Created! ...")
-                else:
-                    logger.error("Error while creating datadir")
-                    logger.error(output2)
-                    return False
-
-                return True
 
+            tmpdir_parent = os.path.dirname(self.tmpdir.rstrip('/'))
+            os.makedirs(tmpdir_parent, exist_ok=True)
+            if not os.path.ismount(self.datadir) and Restore.same_device(self.datadir, tmpdir_parent):
+                os.rename(self.datadir, self.tmpdir)
             else:
-                logger.error("Could not delete {} directory".format(self.tmpdir))
-                logger.error(output)
-                return False
+                logger.info("{} is on another filesystem or datadir is a mount point, copying datadir with {} "
+                            "threads".format(self.tmpdir, self.restore_threads))
+                os.makedirs(self.tmpdir, exist_ok=True)
+                Restore(self.datadir, self.tmpdir, method='copy', threads=self.restore_threads,
+                        owner='preserve', skip_metadata=False).restore_tree('copy')
+                thread = self.remove_in_background(self.datadir)
+                if os.path.isdir(self.datadir):
+                    # Mount point is kept, copy-back needs it empty
+                    thread.join()
+            logger.info("Moved datadir to {} ...".format(self.tmpdir))
+        except OSError as err:
+            logger.error("Error occurred while moving datadir")
+            logger.error(err)
+            return False
 
-        else:
-            try:
-                shutil.move(self.datadir, self.tmpdir)
-                logger.info("Moved datadir to {} ...".format(self.tmpdir))
-            except shutil.Error as err:
-                logger.error("Error occurred while moving datadir")
-                logger.error(err)
-                return False
-
-            logger.info("Creating an empty data directory ...")
-            makedir = "mkdir {}".format(self.datadir)
-            status2, output2 = subprocess.getstatusoutput(makedir)
-            if status2 == 0:
-                logger.info("Datadir is Created! ...")
-                return True
-            else:
-                logger.error("Error while creating datadir")
-                logger.error(output2)
-                return False
+        logger.info("Creating an empty data directory ...")
+        try:
+            os.makedirs(self.datadir, exist_ok=True)
+        except OSError as err:
+            logger.error("Error while creating datadir")
+            logger.error(err)
+            return False
+        logger.info("Datadir is Created! ...")
+        return True
 
-    def run_xtra_copyback(self, datadir=None):
+    def run_xtra_copyback(self, datadir=None, backup_dir=None):
         # Running Xtrabackup with --copy-back option
-        copy_back = '{} --copy-back {} --target-dir={}/{} --datadir={}'.format(
+        # backup_dir is the prepared backup to copy back, recent full backup by default
+        copy_back = '{} --copy-back --parallel={} {} --target-dir={} --datadir={}'.format(
                     self.backup_tool,
+                    self.restore_threads,
                     self.xtra_options,
-                    self.full_dir,
-                    self.recent_full_backup_file(),
+                    self.prepare_target() if backup_dir is None else backup_dir,
                     self.datadir if datadir is None else datadir)
-        status = ProcessRunner.run_command(copy_back)
+        status = ProcessRunner.run_command(copy_back, envelope=self.envelope)
         if status:
             logger.info("Data copied back successfully!")
             return True
@@ -964,36 +985,65 @@ class Prepare(GeneralClass):
             else:
                 raise RuntimeError("This full backup is not fully prepared, not doing copy-back!")
 
-    def copy(self, options=None, datadir=None):
+    def copy(self, options=None, datadir=None, backup_dir=None, restore=None):
         """
         Function for running:
-          xtrabackup --copy-back
+          xtrabackup --copy-back(or restore engine, see restore_method option)
           giving chown to datadir
           starting mysql
+        :param restore: Restore object used for timing phases
         :return: True if succeeded. Error if failed
         """
         logger.info("Copying Back Already Prepared Final Backup:")
-        if len(os.listdir(self.datadir if datadir is None else datadir)) > 0:
+        datadir = self.datadir if datadir is None else datadir
+        if len(os.listdir(datadir)) > 0:
             logger.info("MySQL Datadir is not empty!")
             return False
         else:
-            self.run_xtra_copyback(datadir=datadir)
-            self.giving_chown(datadir=datadir)
-            self.start_mysql_func(options=options)
+            if restore is None:
+                restore = Restore(self.prepare_target() if backup_dir is None else backup_dir, datadir,
+                                  method=self.restore_method, threads=self.restore_threads,
+                                  owner=Restore.parse_owner(self.chown_command))
+            method = restore.choose_method()
+            with restore.phase('copy-back'):
+                if method == 'xtrabackup':
+                    self.run_xtra_copyback(datadir=datadir, backup_dir=restore.backup_dir)
+                else:
+                    restore.restore_tree(method)
+            # Restore engine gives the owner while restoring files
+            if method == 'xtrabackup' or restore.owner is None:
+                with restore.phase('chown'):
+                    self.giving_chown(datadir=datadir)
+            with restore.phase('start'):
+                self.start_mysql_func(options=options)
             return True
 
-    def copy_back_action(self, options=None):
+    def copy_back_action(self, options=None, backup_dir=None, disposable=None):
         """
         Function for complete recover/copy-back actions
+        :param backup_dir: The prepared backup to copy back, recent full backup by default
+        :param disposable: True if prepared backup may be moved into datadir.
+                           By default only prepared snapshot(see prepare_snapshot option) is disposable,
+                           its files shared with full backup(hardlink snapshot) are copied, not moved.
         :return: True if succeeded. Error if failed.
         """
         try:
-            self.check_if_backup_prepared(self.full_dir, self.recent_full_backup_file())
-            self.shutdown_mysql()
-            if self.move_datadir():
-                if self.copy(options=options):
+            if backup_dir is None:
+                backup_dir = self.prepare_target()
+                if disposable is None:
+                    disposable = hasattr(self, 'prepare_snapshot')
+            restore = Restore(backup_dir, self.datadir, method=self.restore_method, threads=self.restore_threads,
+                              owner=Restore.parse_owner(self.chown_command), disposable=bool(disposable))
+            self.check_if_backup_prepared(*os.path.split(backup_dir.rstrip('/')))
+            with restore.phase('shutdown'):
+                self.shutdown_mysql()
+            with restore.phase('move-datadir'):
+                moved = self.move_datadir()
+            if moved:
+                if self.copy(options=options, backup_dir=backup_dir, restore=restore):
                     logger.info("All data copied back successfully. ")
                     logger.info("Your MySQL server is UP again")
+            restore.report()
         except Exception as err:
             logger.error("{}: {}".format(type(err).__name__, err))
 
@@ -1011,6 +1061,8 @@ class Prepare(GeneralClass):
         print("1. Prepare Backups and keep for future usage. NOTE('Once Prepared Backups Can not be prepared Again')")
         print("2. Prepare Backups and restore/recover/copy-back immediately")
         print("3. Just copy-back previously prepared backups")
+        if hasattr(self, 'shadow_dir'):
+            print("4. Final prepare of shadow copy and restore/recover/copy-back immediately")
 
         prepare = int(input("Please Choose one of options and type 1 or 2 or 3: "))
         print("")
@@ -1040,5 +1092,13 @@ class Prepare(GeneralClass):
                 self.copy_back_action()
             else:
                 logger.critical("Dry run is not implemented for copy-back/recovery actions!")
+        elif prepare == 4 and hasattr(self, 'shadow_dir'):
+            # Workaround for circular import dependency error in Python
+            from backup_prepare.shadow import ShadowCopy
+            shadow_dir = ShadowCopy(config=self.conf, dry_run=self.dry).prepare_for_restore()
+            if self.dry == 0:
+                self.copy_back_action(backup_dir=shadow_dir, disposable=True)
+            else:
+                logger.critical("Dry run is not implemented for copy-back/recovery actions!")
         else:
             print("Please type 1 or 2 or 3 and nothing more!")
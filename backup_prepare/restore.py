@@ -0,0 +1,169 @@
+# Restore engine for copying prepared backup into MySQL datadir.
+# Files are moved, reflinked or copied by thread pool and get their owner while being restored,
+# so there is no second recursive chown pass. Every phase of restore is timed for RTO report.
+
+import os
+import re
+import pwd
+import grp
+import time
+import shutil
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from backup_prepare.snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class Restore:
+
+    methods = ('auto', 'xtrabackup', 'move-back', 'reflink', 'copy')
+
+    # Backup metadata and leftovers of unpacking, xtrabackup --copy-back skips them as well
+    skip_files = re.compile(r'^(xtrabackup_\w+|backup-my\.cnf|.*\.(qp|xbcrypt|zst|lz4|delta|meta))$')
+
+    def __init__(self, backup_dir, datadir, method='xtrabackup', threads=4, owner=None, disposable=False,
+                 skip_metadata=True):
+        """
+        :param backup_dir: Full path of prepared backup
+        :param datadir: MySQL datadir, must be empty
+        :param method: One of Restore.methods
+        :param threads: Number of files restored in parallel
+        :param owner: Tuple of (uid, gid) given to restored files, 'preserve' to keep owner of source files or None
+        :param disposable: True if prepared backup is not needed after restore(snapshot or shadow copy)
+        :param skip_metadata: Do not restore xtrabackup metadata files(see Restore.skip_files)
+        """
+        if method not in self.methods:
+            logger.error("Unknown restore method {}, must be one of {}".format(method, ', '.join(self.methods)))
+            raise RuntimeError("Unknown restore method {}".format(method))
+        self.backup_dir = backup_dir
+        self.datadir = datadir
+        self.method = method
+        self.threads = threads
+        self.owner = owner
+        self.disposable = disposable
+        self.skip_metadata = skip_metadata
+        self.phases = []
+
+    @staticmethod
+    def parse_owner(chown_command):
+        """
+        Static method for getting owner from chown_command option, for eg, 'chown -R mysql:mysql'.
+        :return: Tuple of (uid, gid) or None if owner can not be found.
+        """
+        for arg in reversed(chown_command.split()):
+            if arg.startswith('-'):
+                continue
+            user, sep, group = arg.partition(':')
+            try:
+                uid = int(user) if user.isdigit() else pwd.getpwnam(user).pw_uid
+                if not group:
+                    gid = pwd.getpwuid(uid).pw_gid
+                else:
+                    gid = int(group) if group.isdigit() else grp.getgrnam(group).gr_gid
+            except KeyError:
+                continue
+            return uid, gid
+        return None
+
+    @staticmethod
+    def same_device(src_dir, dst_dir):
+        return os.stat(src_dir).st_dev == os.stat(dst_dir).st_dev
+
+    def choose_method(self):
+        """
+        Method for choosing restore method.
+        auto: move-back if prepared backup is disposable and on the same filesystem as datadir,
+        reflink if filesystem supports it, otherwise parallel copy.
+        move-back copies files which are hardlinked elsewhere, see restore_file().
+        :return: Restore method
+        """
+        if self.method != 'auto':
+            return self.method
+        if self.disposable and self.same_device(self.backup_dir, self.datadir):
+            return 'move-back'
+        if Snapshot.supports_reflink(self.backup_dir, self.datadir):
+            return 'reflink'
+        return 'copy'
+
+    @contextmanager
+    def phase(self, name):
+        # Time one phase of restore
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+            logger.info("Restore phase {} took {:.2f} seconds".format(name, self.phases[-1][1]))
+
+    def report(self):
+        """
+        Method for logging RTO of restore per phase.
+        :return: List of (phase, seconds) tuples
+        """
+        total = sum(seconds for name, seconds in self.phases)
+        logger.info("RTO: {:.2f} seconds total ({})".format(
+            total, ', '.join("{} {:.2f}s".format(name, seconds) for name, seconds in self.phases)))
+        return self.phases
+
+    def chown(self, path, stat=None):
+        # stat is os.stat() of source, used for preserving owner
+        if self.owner == 'preserve':
+            if stat is not None:
+                os.chown(path, stat.st_uid, stat.st_gid, follow_symlinks=False)
+        elif self.owner is not None:
+            os.chown(path, *self.owner, follow_symlinks=False)
+
+    def restore_file(self, src, dst, method):
+        """
+        Method for restoring single file and giving it the owner.
+        :param method: move-back, reflink or copy
+        :return: Size of restored file in bytes
+        """
+        stat = os.stat(src)
+        if method == 'move-back' and stat.st_nlink > 1:
+            # Hardlinked into another backup(hardlink snapshot, full_dedup), moving it would hand the backup's
+            # own inode to mysqld and chown it, so the file is copied instead
+            shutil.copy2(src, dst)
+        elif method == 'move-back':
+            # Falls back to copy and delete across filesystems
+            shutil.move(src, dst)
+        elif method == 'reflink':
+            try:
+                Snapshot.reflink(src, dst)
+            except OSError:
+                shutil.copy2(src, dst)
+        else:
+            shutil.copy2(src, dst)
+        self.chown(dst, stat)
+        return stat.st_size
+
+    def restore_tree(self, method):
+        """
+        Method for restoring prepared backup into datadir using thread pool.
+        Directories are created by caller thread, files are restored by workers.
+        :param method: move-back, reflink or copy
+        :return: Total size of restored files in bytes
+        """
+        logger.info("Restoring {} into {} using {} with {} threads".format(self.backup_dir, self.datadir,
+                                                                           method, self.threads))
+        self.chown(self.datadir, os.stat(self.backup_dir))
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for dirpath, dirnames, filenames in os.walk(self.backup_dir):
+                rel_dir = os.path.relpath(dirpath, self.backup_dir)
+                for dirname in dirnames:
+                    os.makedirs(join(self.datadir, rel_dir, dirname), exist_ok=True)
+                    self.chown(join(self.datadir, rel_dir, dirname), os.stat(join(dirpath, dirname)))
+                for filename in filenames:
+                    if self.skip_metadata and self.skip_files.match(filename):
+                        continue
+                    futures.append(executor.submit(self.restore_file, join(dirpath, filename),
+                                                   os.path.normpath(join(self.datadir, rel_dir, filename)),
+                                                   method))
+        # Raise the first error of workers, if any
+        size = sum(future.result() for future in futures)
+        logger.info("Restored {} files, {} bytes".format(len(futures), size))
+        return size
@@ -0,0 +1,149 @@
+# Rolling "always prepared" shadow copy of recent full backup.
+# Every successful incremental backup is applied to the shadow copy right after it is taken,
+# so the copy stays in --apply-log-only state and restore needs only the final prepare.
+
+import os
+import json
+import shutil
+import fcntl
+import logging
+from contextlib import contextmanager
+from os.path import isfile, join
+from general_conf import path_config
+from backup_prepare.prepare import Prepare
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowCopy(Prepare):
+
+    state_file = 'shadow_state.json'
+    lock_file = '.lock'
+
+    def __init__(self, config=path_config.config_path_file, dry_run=0):
+        Prepare.__init__(self, config=config, dry_run=dry_run)
+        if not hasattr(self, 'shadow_dir'):
+            logger.error("shadow_dir is not specified in config file")
+            raise RuntimeError("shadow_dir is not specified in config file")
+        self.shadow_full = join(self.shadow_dir, 'full')
+        self.shadow_work = join(self.shadow_dir, 'inc_work')
+
+    @contextmanager
+    def lock(self):
+        # Only one refresh/restore may touch the shadow copy at a time, later ones wait
+        os.makedirs(self.shadow_dir, exist_ok=True)
+        with open(join(self.shadow_dir, self.lock_file), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_state(self):
+        """
+        Method for reading shadow copy state.
+        :return: Dictionary with keys full, applied and valid, or None if there is no shadow copy yet.
+        """
+        path = join(self.shadow_dir, self.state_file)
+        if not isfile(path):
+            return None
+        with open(path, 'r') as state_file:
+            return json.load(state_file)
+
+    def write_state(self, full, applied, valid):
+        # Replace state file atomically, so interrupted refresh never leaves half written state
+        if self.dry == 1:
+            return
+        path = join(self.shadow_dir, self.state_file)
+        with open(path + '.tmp', 'w') as state_file:
+            json.dump({'full': full, 'applied': applied, 'valid': valid}, state_file)
+        os.replace(path + '.tmp', path)
+
+    def seed(self, full_backup):
+        """
+        Method for (re)creating shadow copy from full backup and preparing it with --apply-log-only.
+        :param full_backup: Full backup directory name
+        :return: True on success.
+        """
+        logger.info("- - - - Seeding shadow copy from full backup {} - - - -".format(full_backup))
+        self.write_state(full_backup, [], False)
+        self.copy_backup(join(self.full_dir, full_backup), 'full_backup.stream', self.shadow_full)
+        self.decrypt_backup(self.shadow_full)
+        self.decompress_backup(self.shadow_full)
+        self.run_prepare(self.shadow_full)
+        self.write_state(full_backup, [], True)
+        return True
+
+    def apply(self, full_backup, applied, inc_backup):
+        """
+        Method for applying incremental backup to shadow copy.
+        Incremental backup is unpacked inside shadow_dir, so the backup itself stays as it was taken.
+        :param full_backup: Full backup directory name of shadow copy
+        :param applied: Incremental backup names already applied to shadow copy
+        :param inc_backup: Incremental backup directory name
+        :return: New list of applied incremental backups.
+        """
+        logger.info("Applying incremental backup {} to shadow copy".format(inc_backup))
+        work_dir = join(self.shadow_work, inc_backup)
+        # Failed prepare may leave shadow copy half applied, keep it invalid until apply finishes
+        self.write_state(full_backup, applied, False)
+        self.copy_backup(join(self.inc_dir, inc_backup), 'inc_backup.stream', work_dir)
+        self.decrypt_backup(work_dir)
+        self.decompress_backup(work_dir)
+        self.run_prepare(self.shadow_full, incremental_dir=work_dir)
+        if self.dry == 0:
+            shutil.rmtree(work_dir)
+        applied = applied + [inc_backup]
+        self.write_state(full_backup, applied, True)
+        return applied
+
+    def _refresh(self):
+        full_backup = self.recent_full_backup_file()
+        chain = self.resolve_chain() if self.check_inc_backups() else []
+        state = self.read_state()
+
+        if state is None or not state['valid'] or state['full'] != full_backup \
+                or state['applied'] != chain[:len(state['applied'])]:
+            self.seed(full_backup)
+            applied = []
+        else:
+            applied = state['applied']
+
+        for inc_backup in chain[len(applied):]:
+            applied = self.apply(full_backup, applied, inc_backup)
+        logger.info("Shadow copy of {} is up to date, applied incremental backups: {}".format(
+            full_backup, ', '.join(applied) if applied else 'none'))
+        return True
+
+    def refresh(self):
+        """
+        Method for bringing shadow copy up to recent full backup and its incremental chain.
+        The shadow copy is reseeded if full backup changed, it was already used for restore,
+        previous refresh failed or the chain no longer matches what was applied.
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        with self.lock():
+            return self._refresh()
+
+    def refresh_after_backup(self):
+        # Backup itself already succeeded, so only log the failure; next refresh reseeds the shadow copy
+        try:
+            self.refresh()
+        except Exception as err:
+            logger.error("FAILED: Shadow copy refresh: {}".format(err))
+
+    def prepare_for_restore(self):
+        """
+        Method for final prepare(redo/undo pass) of shadow copy.
+        After this the shadow copy can not take incremental backups anymore and is reseeded on next refresh.
+        :return: Full path of prepared shadow copy.
+        """
+        with self.lock():
+            self._refresh()
+            state = self.read_state()
+            logger.info("- - - - Final prepare of shadow copy - - - -")
+            if state is not None:
+                self.write_state(state['full'], state['applied'], False)
+            self.run_prepare(self.shadow_full, final=True)
+        return self.shadow_full
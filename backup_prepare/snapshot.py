@@ -0,0 +1,161 @@
+# Copy-on-write snapshots of backup sets.
+# Prepare runs against a cheap clone, so the original backup set stays intact
+# and can take more incremental backups or be prepared again up to another tag.
+
+import os
+import re
+import fcntl
+import shutil
+import logging
+from os.path import join
+
+logger = logging.getLogger(__name__)
+
+# ioctl request number of FICLONE(_IOW(0x94, 9, int)), supported by btrfs, XFS(reflink=1), OCFS2...
+FICLONE = 0x40049409
+
+
+class Snapshot:
+
+    methods = ('auto', 'reflink', 'hardlink', 'copy')
+
+    # Files written in place by xtrabackup --prepare, never shared with original backup in hardlink mode
+    modified_files = re.compile(r'.*\.(ibd|ibu|isl)$|^(ibdata\d+|undo_?\d+|ib_logfile\d+|ibtmp\d+|'
+                                r'xtrabackup_logfile|xtrabackup_checkpoints|xtrabackup_info)$')
+
+    def __init__(self, method='auto'):
+        if method not in self.methods:
+            logger.error("Unknown snapshot method {}, must be one of {}".format(method, ', '.join(self.methods)))
+            raise RuntimeError("Unknown snapshot method {}".format(method))
+        self.method = method
+        self.stats = {'reflinked': 0, 'hardlinked': 0, 'copied': 0, 'copied_bytes': 0}
+
+    @staticmethod
+    def reflink(src, dst):
+        """
+        Static method for cloning file with FICLONE ioctl, data blocks are shared until one side is written.
+        :raise: OSError if filesystem does not support reflinks.
+        """
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        shutil.copystat(src, dst)
+
+    @staticmethod
+    def supports_reflink(src_dir, dst_dir):
+        """
+        Static method for checking if files of src_dir can be reflinked into dst_dir.
+        :return: True if FICLONE works between these directories.
+        """
+        probe = join(src_dir, '.reflink_probe')
+        try:
+            with open(probe, 'wb') as probe_file:
+                probe_file.write(b'0')
+            Snapshot.reflink(probe, join(dst_dir, '.reflink_probe'))
+            return True
+        except OSError:
+            return False
+        finally:
+            for path in (probe, join(dst_dir, '.reflink_probe')):
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def resolve_method(self, src_dir, dst_dir):
+        # auto: reflink if filesystem supports it, otherwise hardlink farm
+        if self.method != 'auto':
+            return self.method
+        return 'reflink' if self.supports_reflink(src_dir, dst_dir) else 'hardlink'
+
+    def copy_file(self, src, dst):
+        shutil.copy2(src, dst)
+        self.stats['copied'] += 1
+        self.stats['copied_bytes'] += os.path.getsize(dst)
+
+    def clone_file(self, src, dst, method, modified=False):
+        """
+        Method for cloning single file.
+        :param method: reflink, hardlink or copy
+        :param modified: True if prepare is going to write this file(copy-on-first-write in hardlink mode)
+        """
+        if method == 'reflink':
+            self.reflink(src, dst)
+            self.stats['reflinked'] += 1
+        elif method == 'hardlink' and not modified:
+            try:
+                os.link(src, dst)
+                self.stats['hardlinked'] += 1
+            except OSError:
+                # Different filesystem or link limit reached
+                self.copy_file(src, dst)
+        else:
+            self.copy_file(src, dst)
+
+    def clone_tree(self, src_dir, dst_dir, overwritten=()):
+        """
+        Method for cloning backup directory.
+        In hardlink mode, InnoDB files and files overwritten by incremental backups are physically copied,
+        everything else(.frm, MyISAM, CSV and etc.) is shared with original backup.
+        :param src_dir: Backup directory to clone
+        :param dst_dir: Snapshot directory, must not exist
+        :param overwritten: Relative paths which are going to be written by prepare, None if they are not known
+                            yet(every file is copied in hardlink mode then)
+        :return: Method used for cloning
+        """
+        os.makedirs(os.path.dirname(dst_dir.rstrip('/')), exist_ok=True)
+        os.makedirs(dst_dir)
+        method = self.resolve_method(src_dir, dst_dir)
+        logger.info("Cloning {} to {} using {}".format(src_dir, dst_dir, method))
+        overwritten = None if overwritten is None else set(overwritten)
+        for dirpath, dirnames, filenames in os.walk(src_dir):
+            rel_dir = os.path.relpath(dirpath, src_dir)
+            for dirname in dirnames:
+                os.makedirs(join(dst_dir, rel_dir, dirname), exist_ok=True)
+            for filename in filenames:
+                rel_path = os.path.normpath(join(rel_dir, filename))
+                modified = overwritten is None or rel_path in overwritten or \
+                    self.modified_files.match(filename) is not None
+                self.clone_file(join(dirpath, filename), join(dst_dir, rel_path), method, modified=modified)
+        logger.info("Snapshot {} is ready: {reflinked} reflinked, {hardlinked} hardlinked, "
+                    "{copied} copied({copied_bytes} bytes)".format(dst_dir, **self.stats))
+        return method
+
+    @staticmethod
+    def unshare_tree(backup_dir):
+        """
+        Static method for giving own copy to every hardlinked file of backup directory.
+        Used before preparing in place, so prepare never writes files shared with other backups(see full_dedup).
+        :param backup_dir: Backup directory path
+        :return: Number of copied files
+        """
+        copied = 0
+        for dirpath, dirnames, filenames in os.walk(backup_dir):
+            for filename in filenames:
+                path = join(dirpath, filename)
+                if os.path.islink(path) or os.stat(path).st_nlink < 2:
+                    continue
+                shutil.copy2(path, path + '.unshare')
+                os.replace(path + '.unshare', path)
+                copied += 1
+        if copied:
+            logger.info("Copied {} hardlinked files of {} prior to prepare".format(copied, backup_dir))
+        return copied
+
+    @staticmethod
+    def overwritten_files(inc_dirs):
+        """
+        Static method for listing files incremental backups are going to write into full backup.
+        For eg, t1.ibd.delta and t1.ibd.meta are applied to t1.ibd; t1.frm replaces t1.frm.
+        :param inc_dirs: Full paths of incremental backups
+        :return: Set of paths relative to backup directory.
+        """
+        overwritten = set()
+        for inc_dir in inc_dirs:
+            for dirpath, dirnames, filenames in os.walk(inc_dir):
+                rel_dir = os.path.relpath(dirpath, inc_dir)
+                for filename in filenames:
+                    # Not yet decrypted/decompressed incremental backups keep their suffixes
+                    name, ext = os.path.splitext(filename)
+                    while ext in ('.xbcrypt', '.qp', '.zst', '.lz4', '.delta', '.meta'):
+                        filename = name
+                        name, ext = os.path.splitext(filename)
+                    overwritten.add(os.path.normpath(join(rel_dir, filename)))
+        return overwritten
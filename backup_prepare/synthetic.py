@@ -0,0 +1,96 @@
+# Synthetic full backup.
+# Recent full backup is cloned and its incremental chain is applied to the clone with --apply-log-only,
+# entirely on backup host. The result is registered as new full backup and later incremental backups
+# are based on it, so rotating full backup does not read the whole database from the server.
+
+import os
+import shutil
+import logging
+from os.path import isfile, join
+from general_conf import path_config
+from backup_prepare.prepare import Prepare
+from backup_prepare.snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class SyntheticFull(Prepare):
+
+    work_dir_name = 'synthetic'
+
+    def __init__(self, config=path_config.config_path_file, dry_run=0):
+        Prepare.__init__(self, config=config, dry_run=dry_run)
+        # Built away from full_dir and moved there when ready, so failed build never looks like full backup
+        self.work_dir = join(self.backupdir, self.work_dir_name)
+
+    def clone_full_backup(self, full_backup, inc_backups, target_dir):
+        """
+        Method for cloning full backup as start of synthetic full backup.
+        Unstreamed backups are cloned with synthetic_full method(reflink/hardlink/copy),
+        files written by prepare are always copied. Streamed backups are extracted.
+        :param full_backup: Full backup directory name
+        :param inc_backups: Incremental backup names which are going to be applied
+        :param target_dir: Directory of synthetic full backup, must not exist
+        :return: True on success.
+        """
+        backup_dir = join(self.full_dir, full_backup)
+        if isfile(join(backup_dir, 'full_backup.stream')) or isfile(join(backup_dir, 'full_backup.tar')):
+            return self.copy_backup(backup_dir, 'full_backup.stream', target_dir)
+        logger.info("Cloning full backup {} -> {}".format(full_backup, target_dir))
+        if self.dry == 0:
+            overwritten = Snapshot.overwritten_files([join(self.inc_dir, inc) for inc in inc_backups])
+            Snapshot(self.synthetic_full).clone_tree(backup_dir, target_dir, overwritten=overwritten)
+        return True
+
+    def apply_to(self, target_dir, inc_backup):
+        """
+        Method for applying incremental backup to synthetic full backup.
+        Incremental backup is unpacked inside work directory, so it stays as it was taken(and archived).
+        :param target_dir: Directory of synthetic full backup
+        :param inc_backup: Incremental backup directory name
+        :return: True on success.
+        """
+        logger.info("Applying incremental backup {} to synthetic full backup".format(inc_backup))
+        inc_work_dir = join(self.work_dir, 'inc_work', inc_backup)
+        self.copy_backup(join(self.inc_dir, inc_backup), 'inc_backup.stream', inc_work_dir)
+        self.decrypt_backup(inc_work_dir)
+        self.decompress_backup(inc_work_dir)
+        self.run_prepare(target_dir, incremental_dir=inc_work_dir)
+        if self.dry == 0:
+            shutil.rmtree(inc_work_dir)
+        return True
+
+    def build(self, full_backup, inc_backups, name):
+        """
+        Method for building synthetic full backup.
+        Result stays in --apply-log-only state, so further incremental backups can be applied on top of it.
+        :param full_backup: Full backup directory name
+        :param inc_backups: Incremental backup names in apply order
+        :param name: Name of new full backup, for eg, 2017-11-09_19-37-16
+        :return: Full path of synthetic full backup inside full_dir
+        :raise: RuntimeError on error.
+        """
+        logger.info("- - - - Building synthetic full backup {} from {} and {} incremental backups - - - -".format(
+            name, full_backup, len(inc_backups)))
+        target_dir = join(self.work_dir, name)
+        new_full_dir = join(self.full_dir, name)
+        if self.dry == 0 and os.path.isdir(self.work_dir):
+            # Left by interrupted build
+            shutil.rmtree(self.work_dir)
+        try:
+            self.clone_full_backup(full_backup, inc_backups, target_dir)
+            self.decrypt_backup(target_dir)
+            self.decompress_backup(target_dir)
+            self.run_prepare(target_dir)
+            for inc_backup in inc_backups:
+                self.apply_to(target_dir, inc_backup)
+            if self.dry == 0:
+                os.rename(target_dir, new_full_dir)
+        except (OSError, RuntimeError) as err:
+            logger.error("FAILED: Building synthetic full backup {}: {}".format(name, err))
+            raise RuntimeError("FAILED: Building synthetic full backup {}: {}".format(name, err))
+        finally:
+            if self.dry == 0 and os.path.isdir(self.work_dir):
+                shutil.rmtree(self.work_dir)
+        logger.info("OK: Synthetic full backup {} is ready".format(new_full_dir))
+        return new_full_dir
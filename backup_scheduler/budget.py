@@ -0,0 +1,56 @@
+# Resource budget shared by backups of all MySQL instances of the host.
+# Every running backup gets a fixed share: cpu_threads and write_bandwidth divided by max_backups,
+# so the sum over all xtrabackup processes never exceeds the budget, whichever backups run together.
+# Full backups read the whole datadir, max_full_backups limits how many of them run at once.
+
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceBudget:
+
+    def __init__(self, max_backups=1, max_full_backups=1, cpu_threads=None, write_bandwidth=None):
+        """
+        :param max_backups: Maximum number of backups running at once
+        :param max_full_backups: Maximum number of full backups running at once
+        :param cpu_threads: Threads of all xtrabackup processes together, None for no limit
+        :param write_bandwidth: Bytes per second written by all xtrabackup processes together, None for no limit
+        """
+        if max_backups < 1 or max_full_backups < 1:
+            logger.error("max_backups and max_full_backups must be at least 1")
+            raise RuntimeError("max_backups and max_full_backups must be at least 1")
+        self.max_backups = max_backups
+        self.max_full_backups = max_full_backups
+        self.cpu_threads = cpu_threads
+        self.write_bandwidth = write_bandwidth
+        self.running = {'full': 0, 'inc': 0}
+        self.lock = threading.Lock()
+
+    def share(self):
+        """
+        Method for getting resources of one backup.
+        :return: Dictionary of threads and write_bandwidth, None means no limit
+        """
+        return {'threads': max(self.cpu_threads // self.max_backups, 1) if self.cpu_threads else None,
+                'write_bandwidth': self.write_bandwidth // self.max_backups if self.write_bandwidth else None}
+
+    def acquire(self, action):
+        """
+        Method for reserving share of budget for backup.
+        :param action: full or inc
+        :return: Dictionary of action, threads and write_bandwidth, None if budget is exhausted
+        """
+        with self.lock:
+            if sum(self.running.values()) >= self.max_backups:
+                return None
+            if action == 'full' and self.running['full'] >= self.max_full_backups:
+                return None
+            self.running[action] += 1
+        return dict(self.share(), action=action)
+
+    def release(self, grant):
+        with self.lock:
+            self.running[grant['action']] -= 1
+        return True
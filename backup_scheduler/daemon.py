@@ -0,0 +1,177 @@
+# Long running backup daemon, replaces cron calling --backup.
+# Due backups are decided by RedoScheduler and by fixed inc_backup_interval slots aligned to wall clock,
+# put into persistent JobQueue and taken one at a time, so backups never overlap and a backup which
+# becomes due while another one runs is queued instead of dropped.
+# Slots missed while the daemon was stopped are caught up by one backup.
+# Config file is reloaded when it changes or on SIGHUP, SIGTERM/SIGINT stop the daemon after running job.
+
+import os
+import time
+import signal
+import logging
+import threading
+from general_conf import path_config
+from general_conf.generalops import GeneralClass
+from general_conf.check_env import CheckEnv
+from backup_scheduler.redo_scheduler import RedoScheduler
+from backup_scheduler.job_queue import JobQueue
+from master_backup_script.backuper import Backup
+
+logger = logging.getLogger(__name__)
+
+
+class BackupDaemon(RedoScheduler):
+
+    def __init__(self, config=path_config.config_path_file, dry_run=0, tag=None):
+        RedoScheduler.__init__(self, config=config, dry_run=dry_run, tag=tag)
+        self.tag = tag
+        self.config_mtime = os.stat(self.conf).st_mtime
+        self.config_options = set(vars(GeneralClass(self.conf)))
+        self.queue = JobQueue(self.backupdir)
+        self.stopping = False
+        self.reload_requested = False
+        self.wakeup = threading.Event()
+
+    def reload(self):
+        """
+        Method for reloading config file, previous config is kept if the new one can not be used.
+        :return: True if config was reloaded.
+        """
+        self.config_mtime = os.stat(self.conf).st_mtime
+        try:
+            config = GeneralClass(self.conf)
+            backup = Backup(config=self.conf, dry_run=self.dry, tag=self.tag)
+            check_env_obj = CheckEnv(self.conf, full_dir=config.full_dir, inc_dir=config.inc_dir)
+            assert check_env_obj.check_all_env() is True, "environment checks failed!"
+        except Exception as err:
+            logger.error("FAILED: Reloading config file {}, keeping previous config: {}".format(self.conf, err))
+            return False
+        # Options removed from config file fall back to defaults
+        for option in self.config_options - set(vars(config)):
+            delattr(self, option)
+        GeneralClass.__init__(self, self.conf)
+        self.config_options = set(vars(config))
+        self.backup = backup
+        self.queue = JobQueue(self.backupdir)
+        logger.info("Reloaded config file {}".format(self.conf))
+        return True
+
+    def config_changed(self):
+        try:
+            return os.stat(self.conf).st_mtime != self.config_mtime
+        except OSError:
+            return False
+
+    def reload_if_changed(self):
+        # Reload config file on SIGHUP or when it was modified
+        if self.reload_requested or self.config_changed():
+            self.reload_requested = False
+            return self.reload()
+        return False
+
+    def current_slot(self, now=None):
+        # Number of inc_backup_interval slot, slots start at multiples of interval since epoch
+        if not hasattr(self, 'inc_backup_interval'):
+            return None
+        return int((time.time() if now is None else now) // self.inc_backup_interval)
+
+    def schedule_jobs(self, now=None):
+        """
+        Method for queueing backups which are due.
+        :param now: Current time, for tests
+        :return: Queued job id or None
+        """
+        action, reason = self.decide()
+        slot = self.current_slot(now)
+        if slot is not None:
+            last_slot = self.queue.last_slot('inc')
+            if last_slot is not None and slot > last_slot and action is None:
+                action, reason = 'inc', "inc_backup_interval={} seconds slot started".format(self.inc_backup_interval)
+            if last_slot is None or slot > last_slot:
+                self.queue.set_last_slot('inc', slot)
+        if action is None:
+            logger.debug("No backup is due: {}".format(reason))
+            return None
+        return self.queue.enqueue(action, reason)
+
+    def run_job(self, job):
+        """
+        Method for taking queued backup, failures are recorded in the queue and do not stop the daemon.
+        :param job: sqlite3.Row of job
+        :return: True if backup succeeded.
+        """
+        logger.info("- - - - Taking {} backup, job {}: {} - - - -".format(job['action'], job['id'], job['reason']))
+        try:
+            self.take(job['action'])
+        except (RuntimeError, ChildProcessError, AssertionError) as err:
+            logger.error("FAILED: {} backup job {}: {}".format(job['action'], job['id'], err))
+            self.queue.finish(job['id'], 'failed', str(err))
+            return False
+        self.queue.finish(job['id'], 'done')
+        return True
+
+    def run_once(self, now=None):
+        """
+        Method for queueing due backups and running queued jobs.
+        :return: List of actions of finished jobs
+        """
+        self.reload_if_changed()
+        try:
+            self.schedule_jobs(now)
+        except (RuntimeError, OSError) as err:
+            # Queued jobs still run, scheduling is retried on next tick
+            logger.error("FAILED: Scheduling backups: {}".format(err))
+        taken = []
+        while not self.stopping:
+            job = self.queue.next_job()
+            if job is None:
+                break
+            if self.run_job(job):
+                taken.append(job['action'])
+        self.queue.prune()
+        return taken
+
+    def seconds_to_next_tick(self):
+        # Sample every redo_sample_interval, but wake up exactly when next inc_backup_interval slot starts
+        now = time.time()
+        delay = self.redo_sample_interval
+        slot = self.current_slot(now)
+        if slot is not None:
+            delay = min(delay, (slot + 1) * self.inc_backup_interval - now)
+        return max(delay, 0)
+
+    def handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            logger.info("Got SIGHUP, reloading config file")
+            self.reload_requested = True
+        else:
+            logger.info("Got signal {}, stopping after running job".format(signum))
+            self.stopping = True
+        self.wakeup.set()
+
+    def run(self, iterations=None):
+        """
+        Method for running the daemon until it is stopped by signal.
+        :param iterations: Number of ticks, None means forever
+        :return: List of actions of finished jobs
+        """
+        check_env_obj = CheckEnv(self.conf, full_dir=self.full_dir, inc_dir=self.inc_dir)
+        assert check_env_obj.check_all_env() is True, "environment checks failed!"
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, self.handle_signal)
+        self.queue.recover()
+        logger.info("Starting backup daemon: queue {}, sampling every {} seconds".format(
+            self.queue.path, self.redo_sample_interval))
+
+        taken = []
+        while not self.stopping:
+            taken += self.run_once()
+            if iterations is not None:
+                iterations -= 1
+                if iterations <= 0:
+                    break
+            self.wakeup.wait(self.seconds_to_next_tick())
+            self.wakeup.clear()
+        logger.info("Backup daemon stopped")
+        return taken
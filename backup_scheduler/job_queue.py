@@ -0,0 +1,131 @@
+# Persistent job queue of backup daemon.
+# Kept in SQLite database inside backup directory, so queued jobs survive restarts:
+# job left running by killed daemon is queued again on next start.
+# At most one job per action is queued, backup requested while the same one is already waiting is merged into it.
+
+import time
+import sqlite3
+import logging
+from contextlib import closing
+from os.path import join
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+
+    file_name = 'scheduler_queue.db'
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            reason TEXT,
+            state TEXT NOT NULL,
+            enqueued REAL,
+            started REAL,
+            finished REAL,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+        CREATE TABLE IF NOT EXISTS schedule (
+            name TEXT PRIMARY KEY,
+            last_slot INTEGER
+        );
+    """
+
+    # Full backup makes waiting incremental backup pointless, it is based on the full backup moments later
+    supersedes = {'full': ('inc',)}
+
+    def __init__(self, directory):
+        self.path = join(directory, self.file_name)
+        with closing(self.connect()) as conn, conn:
+            conn.executescript(self.schema)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def enqueue(self, action, reason=None):
+        """
+        Method for queueing backup job.
+        :param action: full or inc
+        :param reason: Why the job was scheduled, for logging
+        :return: Job id, id of already queued job if the same or superseding one is waiting
+        """
+        with closing(self.connect()) as conn, conn:
+            for queued_action in (action,) + tuple(i for i, superseded in self.supersedes.items()
+                                                   if action in superseded):
+                row = conn.execute("SELECT id FROM jobs WHERE state = 'queued' AND action = ? ORDER BY id LIMIT 1",
+                                   (queued_action,)).fetchone()
+                if row is not None:
+                    logger.debug("{} backup is merged into queued {} backup job {}".format(action, queued_action,
+                                                                                        row['id']))
+                    return row['id']
+            for superseded in self.supersedes.get(action, ()):
+                conn.execute("UPDATE jobs SET state = 'superseded', finished = ? "
+                             "WHERE state = 'queued' AND action = ?", (time.time(), superseded))
+            job_id = conn.execute("INSERT INTO jobs (action, reason, state, enqueued) VALUES (?, ?, 'queued', ?)",
+                                  (action, reason, time.time())).lastrowid
+        logger.info("Queued {} backup job {}: {}".format(action, job_id, reason))
+        return job_id
+
+    def next_job(self):
+        """
+        Method for taking the oldest queued job, it is marked as running.
+        :return: sqlite3.Row of job or None if queue is empty
+        """
+        with closing(self.connect()) as conn, conn:
+            row = conn.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET state = 'running', started = ? WHERE id = ?", (time.time(), row['id']))
+        return row
+
+    def finish(self, job_id, state, error=None):
+        # state is done or failed
+        with closing(self.connect()) as conn, conn:
+            conn.execute("UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ?",
+                         (state, time.time(), error, job_id))
+        return True
+
+    def recover(self):
+        """
+        Method for queueing again jobs left running by stopped or killed daemon.
+        :return: Number of recovered jobs
+        """
+        with closing(self.connect()) as conn, conn:
+            recovered = conn.execute("UPDATE jobs SET state = 'queued', started = NULL "
+                                     "WHERE state = 'running'").rowcount
+        if recovered:
+            logger.warning("Queued again {} backup jobs interrupted by previous daemon run".format(recovered))
+        return recovered
+
+    def jobs(self, state=None):
+        """
+        :param state: Only jobs in this state, all jobs if None
+        :return: List of sqlite3.Row, oldest first
+        """
+        with closing(self.connect()) as conn:
+            if state is None:
+                return conn.execute("SELECT * FROM jobs ORDER BY id").fetchall()
+            return conn.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,)).fetchall()
+
+    def prune(self, keep=1000):
+        # Forget finished jobs except the newest ones
+        with closing(self.connect()) as conn, conn:
+            conn.execute("DELETE FROM jobs WHERE state NOT IN ('queued', 'running') AND id NOT IN "
+                         "(SELECT id FROM jobs ORDER BY id DESC LIMIT ?)", (keep,))
+        return True
+
+    def last_slot(self, name):
+        # Number of the last schedule slot jobs were queued for, None if never
+        with closing(self.connect()) as conn:
+            row = conn.execute("SELECT last_slot FROM schedule WHERE name = ?", (name,)).fetchone()
+        return row['last_slot'] if row else None
+
+    def set_last_slot(self, name, slot):
+        with closing(self.connect()) as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO schedule (name, last_slot) VALUES (?, ?)", (name, slot))
+        return True
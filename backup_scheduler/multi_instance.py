@@ -0,0 +1,183 @@
+# Backup daemon for hosts running several MySQL instances.
+# Instances file lists ordinary config file of every instance and the resource budget of the host:
+#
+#   [Instances]
+#   db1 = /etc/autoxtrabackup/db1.cnf
+#   db2 = /etc/autoxtrabackup/db2.cnf
+#
+#   [Budget]
+#   max_backups = 2
+#   max_full_backups = 1
+#   cpu_threads = 8
+#   write_bandwidth = 200MiB
+#
+# Every instance is scheduled by its own BackupDaemon(with its own job queue in its backup_dir),
+# queued jobs of different instances run at once as long as ResourceBudget allows, oldest job first.
+
+import os
+import signal
+import logging
+import threading
+import configparser
+import humanfriendly
+from backup_scheduler.daemon import BackupDaemon
+from backup_scheduler.budget import ResourceBudget
+from general_conf.check_env import CheckEnv
+
+logger = logging.getLogger(__name__)
+
+
+class MultiInstanceScheduler:
+
+    def __init__(self, config, dry_run=0, tag=None):
+        """
+        :param config: Instances file path
+        :param dry_run: Passed to every instance
+        :param tag: Passed to every instance
+        """
+        if not os.path.isfile(config):
+            logger.error("Instances file {} does not exist".format(config))
+            raise RuntimeError("Instances file {} does not exist".format(config))
+        con = configparser.ConfigParser()
+        con.read(config)
+        if 'Instances' not in con or not con['Instances']:
+            logger.error("No instances are listed in [Instances] section of {}".format(config))
+            raise RuntimeError("No instances are listed in [Instances] section of {}".format(config))
+
+        self.daemons = {name: BackupDaemon(config=path, dry_run=dry_run, tag=tag)
+                        for name, path in con['Instances'].items()}
+
+        BUD = con['Budget'] if 'Budget' in con else {}
+        if 'max_backups' in BUD:
+            max_backups = int(BUD['max_backups'])
+        else:
+            max_backups = 1
+        if 'max_full_backups' in BUD:
+            max_full_backups = int(BUD['max_full_backups'])
+        else:
+            max_full_backups = 1
+        cpu_threads = int(BUD['cpu_threads']) if 'cpu_threads' in BUD else None
+        write_bandwidth = humanfriendly.parse_size(BUD['write_bandwidth']) if 'write_bandwidth' in BUD else None
+        self.budget = ResourceBudget(max_backups=max_backups, max_full_backups=max_full_backups,
+                                     cpu_threads=cpu_threads, write_bandwidth=write_bandwidth)
+
+        self.running = {}
+        self.stopping = False
+        self.wakeup = threading.Event()
+
+    def schedule_jobs(self):
+        """
+        Method for queueing due backups of every instance.
+        Config of instance is reloaded only while it has no running backup.
+        """
+        for name, daemon in self.daemons.items():
+            if name in self.running:
+                continue
+            daemon.reload_if_changed()
+            try:
+                daemon.schedule_jobs()
+            except (RuntimeError, OSError) as err:
+                logger.error("FAILED: Scheduling backups of instance {}: {}".format(name, err))
+        return True
+
+    def run_job(self, name, job, grant):
+        # Body of backup thread
+        daemon = self.daemons[name]
+        try:
+            daemon.run_job(job)
+            daemon.queue.prune()
+        finally:
+            daemon.backup.resource_grant = None
+            self.budget.release(grant)
+            self.wakeup.set()
+
+    def dispatch(self):
+        """
+        Method for starting queued jobs of idle instances, oldest first, as long as budget allows.
+        Job not fitting into budget(for eg, full backup while max_full_backups run) waits, later jobs may start.
+        :return: List of instance names started
+        """
+        queued = []
+        for name, daemon in self.daemons.items():
+            if name in self.running:
+                continue
+            jobs = daemon.queue.jobs('queued')
+            if jobs:
+                queued.append((jobs[0]['enqueued'], name))
+
+        started = []
+        for enqueued, name in sorted(queued):
+            daemon = self.daemons[name]
+            action = daemon.queue.jobs('queued')[0]['action']
+            grant = self.budget.acquire(action)
+            if grant is None:
+                continue
+            job = daemon.queue.next_job()
+            daemon.backup.resource_grant = grant
+            logger.info("Starting {} backup of instance {}: {} threads, {} write bandwidth".format(
+                action, name, grant['threads'] or 'unlimited',
+                humanfriendly.format_size(grant['write_bandwidth'], binary=True) + '/s'
+                if grant['write_bandwidth'] else 'unlimited'))
+            thread = threading.Thread(target=self.run_job, args=(name, job, grant), name='backup-' + name)
+            self.running[name] = thread
+            thread.start()
+            started.append(name)
+        return started
+
+    def collect(self):
+        # Forget finished backup threads
+        for name, thread in list(self.running.items()):
+            if not thread.is_alive():
+                thread.join()
+                del self.running[name]
+        return True
+
+    def handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            logger.info("Got SIGHUP, reloading config files of idle instances")
+            for daemon in self.daemons.values():
+                daemon.reload_requested = True
+        else:
+            logger.info("Got signal {}, stopping after running backups".format(signum))
+            self.stopping = True
+        self.wakeup.set()
+
+    def run(self, iterations=None):
+        """
+        Method for running the daemon until it is stopped by signal.
+        Instance failing environment checks is left out, the rest are backed up.
+        :param iterations: Number of ticks, None means forever
+        :return: True
+        """
+        for name, daemon in list(self.daemons.items()):
+            try:
+                check_env_obj = CheckEnv(daemon.conf, full_dir=daemon.full_dir, inc_dir=daemon.inc_dir)
+                assert check_env_obj.check_all_env() is True, "environment checks failed!"
+            except (AssertionError, RuntimeError) as err:
+                logger.error("FAILED: Instance {} is not backed up: {}".format(name, err))
+                del self.daemons[name]
+                continue
+            daemon.queue.recover()
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+                signal.signal(signum, self.handle_signal)
+        logger.info("Starting backup daemon of instances {}: at most {} backups, {} full backups at once".format(
+            ', '.join(sorted(self.daemons)), self.budget.max_backups, self.budget.max_full_backups))
+
+        while not self.stopping:
+            self.collect()
+            self.schedule_jobs()
+            self.dispatch()
+            if iterations is not None:
+                iterations -= 1
+                if iterations <= 0:
+                    break
+            delay = min([daemon.seconds_to_next_tick() for daemon in self.daemons.values()] or [60])
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+        for thread in list(self.running.values()):
+            thread.join()
+        self.collect()
+        logger.info("Backup daemon stopped")
+        return True
@@ -0,0 +1,167 @@
+# Redo volume driven backup scheduling.
+# Instead of fixed intervals, server LSN is sampled and incremental backup is taken
+# after redo_inc_size bytes of redo were generated since the recent backup.
+# New full backup is taken when incremental backups of current chain grow too big
+# or their projected prepare time is too long, and at least every full_backup_interval.
+
+import time
+import logging
+from general_conf import path_config
+from general_conf.generalops import GeneralClass
+from general_conf.check_env import CheckEnv
+from backup_prepare.checkpoints import Checkpoints
+from backup_catalog.catalog import BackupCatalog
+from backup_catalog.sizing import Sizing
+from master_backup_script.backuper import Backup
+
+logger = logging.getLogger(__name__)
+
+
+class RedoScheduler(GeneralClass):
+
+    # Used for projecting prepare time until some incremental backups are prepared and measured
+    default_prepare_rate = 100 * 1024 * 1024
+
+    def __init__(self, config=path_config.config_path_file, dry_run=0, tag=None):
+        self.conf = config
+        self.dry = dry_run
+        GeneralClass.__init__(self, self.conf)
+        self.backup = Backup(config=self.conf, dry_run=dry_run, tag=tag)
+
+    def chain(self):
+        """
+        Method for listing incremental backups based on recent full backup.
+        :return: List of sqlite3.Row
+        """
+        full = self.backup.recent_full_backup_file()
+        if not full or not BackupCatalog.exists(self.backupdir):
+            return []
+        return [row for row in self.backup.catalog.backups(backup_type='Inc', status='OK') if row['name'] > full]
+
+    def restore_chain(self):
+        """
+        Method for listing incremental backups which restore would apply, cumulative ones supersede the rest.
+        :return: List of sqlite3.Row
+        """
+        chain = self.chain()
+        if not chain:
+            return []
+        try:
+            return [self.backup.catalog.get_backup(name) for name in self.backup.restore_chain()]
+        except RuntimeError:
+            return chain
+
+    def prepare_rate(self):
+        """
+        Method for getting apply rate of incremental backups, measured by previous prepares.
+        :return: Bytes per second
+        """
+        if not BackupCatalog.exists(self.backupdir):
+            return self.default_prepare_rate
+        measured = [row for row in self.backup.catalog.backups(backup_type='Inc', status='OK')
+                    if row['prepare_duration'] and row['size_bytes']]
+        duration = sum(row['prepare_duration'] for row in measured)
+        if not duration:
+            return self.default_prepare_rate
+        return sum(row['size_bytes'] for row in measured) / duration
+
+    def projected_prepare_time(self, chain):
+        # Seconds needed for applying given incremental backups
+        return sum(row['size_bytes'] or 0 for row in chain) / self.prepare_rate()
+
+    def redo_since_backup(self):
+        """
+        Method for getting amount of redo generated since the recent backup.
+        :return: Tuple of (recent backup name, bytes of redo or None if LSN can not be read)
+        """
+        base = self.backup.recent_inc_backup_file() or self.backup.recent_full_backup_file()
+        base_lsn = Checkpoints.last_lsn(self.backup.lsn_backup_directory(base)) if base else None
+        if base_lsn is None:
+            return base, None
+        current_lsn = self.backup.current_lsn()
+        if current_lsn is None:
+            return base, None
+        return base, current_lsn - base_lsn
+
+    def decide(self):
+        """
+        Method for deciding which backup is due.
+        :return: Tuple of (action, reason), action is full, inc or None
+        """
+        if not self.backup.recent_full_backup_file():
+            return 'full', "there is no full backup"
+        if self.backup.last_full_backup_date() == 1:
+            return 'full', "full_backup_interval={} seconds exceeded".format(self.full_backup_interval)
+
+        chain = self.chain()
+        inc_size = sum(row['size_bytes'] or 0 for row in chain)
+        if hasattr(self, 'full_max_inc_size') and inc_size >= self.full_max_inc_size:
+            return 'full', "incremental backups take {}, full_max_inc_size is {}".format(
+                Sizing.human_size(inc_size), Sizing.human_size(self.full_max_inc_size))
+        if hasattr(self, 'full_max_prepare_time'):
+            restore_chain = self.restore_chain()
+            prepare_time = self.projected_prepare_time(restore_chain)
+            if prepare_time >= self.full_max_prepare_time:
+                return 'full', "projected prepare time of {} incremental backups is {:.0f} seconds, " \
+                               "full_max_prepare_time is {:.0f}".format(len(restore_chain), prepare_time,
+                                                                        self.full_max_prepare_time)
+
+        base, redo = self.redo_since_backup()
+        if redo is None:
+            return None, "could not read LSN of server or of {}".format(base)
+        if redo >= self.redo_inc_size:
+            return 'inc', "{} of redo generated since {}".format(Sizing.human_size(redo), base)
+        return None, "{} of redo generated since {}, redo_inc_size is {}".format(
+            Sizing.human_size(max(redo, 0)), base, Sizing.human_size(self.redo_inc_size))
+
+    def take(self, action):
+        """
+        Method for taking backup of given type.
+        :param action: full or inc
+        :return: True on success.
+        """
+        if action == 'inc':
+            return self.backup.take_inc_backup()
+        if self.backup.recent_full_backup_file():
+            return self.backup.rotate_full_backup()
+        return self.backup.all_backup()
+
+    def run_once(self):
+        """
+        Method for sampling the server once and taking the backup which is due, if any.
+        :return: full, inc or None
+        """
+        action, reason = self.decide()
+        if action is None:
+            logger.debug("No backup is due: {}".format(reason))
+            return None
+        logger.info("- - - - Taking {} backup: {} - - - -".format(action, reason))
+        self.take(action)
+        return action
+
+    def run(self, iterations=None):
+        """
+        Method for running scheduler loop, the server is sampled every redo_sample_interval seconds.
+        Failed backup is logged and retried on next sample, so the loop keeps running.
+        :param iterations: Number of samples, None means forever
+        :return: List of taken backup types
+        """
+        check_env_obj = CheckEnv(self.conf, full_dir=self.full_dir, inc_dir=self.inc_dir)
+        assert check_env_obj.check_all_env() is True, "environment checks failed!"
+        logger.info("Starting redo scheduler: incremental backup every {} of redo, sampled every {} seconds".format(
+            Sizing.human_size(self.redo_inc_size), self.redo_sample_interval))
+
+        taken = []
+        while iterations is None or iterations > 0:
+            try:
+                action = self.run_once()
+                if action:
+                    taken.append(action)
+            except (RuntimeError, ChildProcessError) as err:
+                logger.error("FAILED: scheduled backup: {}".format(err))
+            if iterations is not None:
+                iterations -= 1
+                if iterations == 0:
+                    break
+            time.sleep(self.redo_sample_interval)
+        return taken
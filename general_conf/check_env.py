@@ -192,6 +192,26 @@ class CheckEnv(GeneralClass):
                 logger.error("FAILED: Could not create directory, ", err)
                 raise RuntimeError("FAILED: Could not create directory")
 
+    def check_mysql_lsndir(self):
+        '''
+        Check LSN sidecar directory path. Every backup stores its xtrabackup_checkpoints here(--extra-lsndir).
+        If this path exists return True if not try to create.
+        :return: True on success.
+        '''
+        if os.path.exists(self.lsn_dir):
+            logger.info('OK: LSN directory exists')
+            return True
+        else:
+            logger.info('LSN directory does not exist')
+            logger.info('Creating LSN directory...')
+            try:
+                os.makedirs(self.lsn_dir)
+                logger.info('OK: Created')
+                return True
+            except Exception as err:
+                logger.error("FAILED: Could not create directory, ", err)
+                raise RuntimeError("FAILED: Could not create directory")
+
     def check_all_env(self):
         '''
         Method for running all checks
@@ -206,6 +226,7 @@ class CheckEnv(GeneralClass):
             self.check_mysql_backupdir()
             self.check_mysql_fullbackupdir()
             self.check_mysql_incbackupdir()
+            self.check_mysql_lsndir()
             self.check_mysql_archive_dir()
         except Exception as err:
             logger.critical("FAILED: Check status")
@@ -48,6 +48,7 @@ class GeneralClass:
             self.backupdir = BCK['backup_dir']
             self.full_dir = self.backupdir + '/full'
             self.inc_dir = self.backupdir + '/inc'
+            self.lsn_dir = self.backupdir + '/lsn'
             self.backup_tool = BCK['backup_tool']
             if 'prepare_tool' in BCK:
                 self.prepare_tool = BCK['prepare_tool']
@@ -63,12 +64,76 @@ class GeneralClass:
                     BCK['full_backup_interval'])
             else:
                 self.full_backup_interval = 86400
+            if 'inc_min_lsn_delta' in BCK:
+                self.inc_min_lsn_delta = humanfriendly.parse_size(BCK['inc_min_lsn_delta'])
+            else:
+                self.inc_min_lsn_delta = 1
+            if 'inc_backup_interval' in BCK:
+                self.inc_backup_interval = humanfriendly.parse_timespan(BCK['inc_backup_interval'])
+            if 'redo_inc_size' in BCK:
+                self.redo_inc_size = humanfriendly.parse_size(BCK['redo_inc_size'])
+            else:
+                self.redo_inc_size = 1073741824
+            if 'redo_sample_interval' in BCK:
+                self.redo_sample_interval = humanfriendly.parse_timespan(BCK['redo_sample_interval'])
+            else:
+                self.redo_sample_interval = 60
+            if 'full_max_inc_size' in BCK:
+                self.full_max_inc_size = humanfriendly.parse_size(BCK['full_max_inc_size'])
+            if 'full_max_prepare_time' in BCK:
+                self.full_max_prepare_time = humanfriendly.parse_timespan(BCK['full_max_prepare_time'])
+            if 'throttle_threads' in BCK:
+                self.throttle_threads = int(BCK['throttle_threads'])
+            if 'throttle_lag' in BCK:
+                self.throttle_lag = humanfriendly.parse_timespan(BCK['throttle_lag'])
+            if 'throttle_row_latency' in BCK:
+                self.throttle_row_latency = humanfriendly.parse_timespan(BCK['throttle_row_latency'])
+            if 'throttle_disk_latency' in BCK:
+                self.throttle_disk_latency = humanfriendly.parse_timespan(BCK['throttle_disk_latency'])
+            if 'throttle_min_rate' in BCK:
+                self.throttle_min_rate = humanfriendly.parse_size(BCK['throttle_min_rate'])
+            else:
+                self.throttle_min_rate = 10485760
+            if 'throttle_max_rate' in BCK:
+                self.throttle_max_rate = humanfriendly.parse_size(BCK['throttle_max_rate'])
+            if 'throttle_interval' in BCK:
+                self.throttle_interval = humanfriendly.parse_timespan(BCK['throttle_interval'])
+            else:
+                self.throttle_interval = 5
+            if 'inc_policy' in BCK:
+                self.inc_policy = BCK['inc_policy']
+            else:
+                self.inc_policy = 'chain'
+            if 'inc_max_chain' in BCK:
+                self.inc_max_chain = int(BCK['inc_max_chain'])
+            else:
+                self.inc_max_chain = 3
             if 'archive_dir' in BCK:
                 self.archive_dir = BCK['archive_dir']
             if 'prepare_archive' in BCK:
                 self.prepare_archive = BCK['prepare_archive']
             if 'move_archive' in BCK:
                 self.move_archive = BCK['move_archive']
+            if 'archive_codec' in BCK:
+                self.archive_codec = BCK['archive_codec']
+            else:
+                self.archive_codec = 'auto'
+            if 'archive_level' in BCK:
+                self.archive_level = int(BCK['archive_level'])
+            else:
+                self.archive_level = None
+            if 'archive_threads' in BCK:
+                self.archive_threads = int(BCK['archive_threads'])
+            else:
+                self.archive_threads = 0
+            if 'archive_backend' in BCK:
+                self.archive_backend = BCK['archive_backend']
+            else:
+                self.archive_backend = 'tar'
+            if 'archive_workers' in BCK:
+                self.archive_workers = int(BCK['archive_workers'])
+            else:
+                self.archive_workers = 2
             # backward compatible with old config 'max_archive_size' and newer 'archive_max_size'
             if 'max_archive_size' in BCK:
                 self.archive_max_size = humanfriendly.parse_size(BCK['max_archive_size'])
@@ -81,6 +146,38 @@ class GeneralClass:
                 self.archive_max_duration = humanfriendly.parse_timespan(BCK['archive_max_duration'])
             if 'partial_list' in BCK:
                 self.partial_list = BCK['partial_list']
+            if 'prepare_lookahead' in BCK:
+                self.prepare_lookahead = int(BCK['prepare_lookahead'])
+            else:
+                self.prepare_lookahead = 0
+            if 'shadow_dir' in BCK:
+                self.shadow_dir = BCK['shadow_dir']
+            if 'prepare_snapshot' in BCK:
+                self.prepare_snapshot = BCK['prepare_snapshot']
+            if 'snapshot_dir' in BCK:
+                self.snapshot_dir = BCK['snapshot_dir']
+            else:
+                self.snapshot_dir = self.backupdir + '/snapshot'
+            if 'restore_method' in BCK:
+                self.restore_method = BCK['restore_method']
+            else:
+                self.restore_method = 'xtrabackup'
+            if 'restore_threads' in BCK:
+                self.restore_threads = int(BCK['restore_threads'])
+            else:
+                self.restore_threads = 4
+            if 'full_dedup' in BCK:
+                self.full_dedup = BCK['full_dedup']
+            else:
+                self.full_dedup = 'none'
+            if 'full_retention' in BCK:
+                self.full_retention = int(BCK['full_retention'])
+            else:
+                self.full_retention = 1
+            if 'synthetic_full' in BCK:
+                self.synthetic_full = BCK['synthetic_full']
+            else:
+                self.synthetic_full = 'none'
 
             if 'Remote' in con:
                 RM = con['Remote']
@@ -88,6 +185,24 @@ class GeneralClass:
                     self.remote_conn = RM['remote_conn']
                 if 'remote_dir' in RM:
                     self.remote_dir = RM['remote_dir']
+                if 'remote_threads' in RM:
+                    self.remote_threads = int(RM['remote_threads'])
+                else:
+                    self.remote_threads = 4
+
+            if 'Cgroup' in con:
+                CG = con['Cgroup']
+                if 'cgroup_dir' in CG:
+                    self.cgroup_dir = CG['cgroup_dir']
+                if 'cpu_max' in CG:
+                    self.cgroup_cpu_max = CG['cpu_max']
+                if 'memory_high' in CG:
+                    self.cgroup_memory_high = CG['memory_high'] if CG['memory_high'] == 'max' else \
+                        str(humanfriendly.parse_size(CG['memory_high']))
+                if 'datadir_io_max' in CG:
+                    self.cgroup_datadir_io_max = CG['datadir_io_max']
+                if 'backup_io_max' in CG:
+                    self.cgroup_backup_io_max = CG['backup_io_max']
 
             COM = con['Compress']
             if 'compress' in COM:
@@ -128,6 +243,12 @@ class GeneralClass:
                 self.xbstream_options = XBS['xbstream_options']
             if 'xbs_decrypt' in XBS:
                 self.xbs_decrypt = XBS['xbs_decrypt']
+            if 'remote_stream' in XBS:
+                self.remote_stream = XBS['remote_stream']
+            if 'stream_command' in XBS:
+                self.stream_command = XBS['stream_command']
+            if 'stream_checksum' in XBS:
+                self.stream_checksum = XBS['stream_checksum']
 
             CM = con['Commands']
             self.start_mysql = CM['start_mysql_command']
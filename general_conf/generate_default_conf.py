@@ -65,12 +65,72 @@ class GenerateDefaultConfig:
             config.set(section3, "#archive_dir", join(self.home, "XB_TEST/backup_archives"))
             config.set(section3, "#prepare_archive", "1")
             config.set(section3, "#move_archive", "0")
+            config.set(section3, "#Optional: archive compression, one of auto, zstd, pigz, lz4, gzip")
+            config.set(section3, "#archive_codec", "zstd")
+            config.set(section3, "#archive_level", "3")
+            config.set(section3, "#Optional: compression threads for zstd and pigz, 0 means all cores")
+            config.set(section3, "#archive_threads", "0")
+            config.set(section3, "#Optional: archive_dir backend, tar or dedup(deduplicated chunk store)")
+            config.set(section3, "#archive_backend", "tar")
+            config.set(section3, "#Optional: number of backup sets archived in parallel")
+            config.set(section3, "#archive_workers", "2")
             config.set(section3, "#full_backup_interval", "1 day")
+            config.set(section3, "#Optional: take incremental backup only if InnoDB LSN moved at least this much "
+                                 "since last backup, 0 disables the check")
+            config.set(section3, "#inc_min_lsn_delta", "1")
+            config.set(section3, "#Optional: with --schedule, take incremental backup at every start of this interval")
+            config.set(section3, "#inc_backup_interval", "1 hour")
+            config.set(section3, "#Optional: with --schedule, take incremental backup after this much redo "
+                                 "and sample server LSN this often")
+            config.set(section3, "#redo_inc_size", "1GiB")
+            config.set(section3, "#redo_sample_interval", "1 minute")
+            config.set(section3, "#Optional: with --schedule, take new full backup when incremental backups "
+                                 "grow this big or their projected prepare time exceeds this")
+            config.set(section3, "#full_max_inc_size", "50GiB")
+            config.set(section3, "#full_max_prepare_time", "1 hour")
+            config.set(section3, "#Optional: back off streamed backups while server is over any of these limits, "
+                                 "read rate stays between throttle_min_rate and throttle_max_rate")
+            config.set(section3, "#throttle_threads", "64")
+            config.set(section3, "#throttle_lag", "30 seconds")
+            config.set(section3, "#throttle_row_latency", "5ms")
+            config.set(section3, "#throttle_disk_latency", "20ms")
+            config.set(section3, "#throttle_min_rate", "10MiB")
+            config.set(section3, "#throttle_max_rate", "500MiB")
+            config.set(section3, "#throttle_interval", "5 seconds")
+            config.set(section3, "#Optional: base of incremental backups, chain(recent backup), "
+                                 "cumulative(full backup) or cost(cheapest with at most inc_max_chain deltas)")
+            config.set(section3, "#inc_policy", "cost")
+            config.set(section3, "#inc_max_chain", "3")
             config.set(section3, "#archive_max_size", "100GiB")
             config.set(section3, "#archive_max_duration", "4 Days")
             config.set(section3, "#Optional: WARNING(Enable this if you want to take partial backups). "
                                  "Specify database names or table names.")
             config.set(section3, "#partial_list", "test.t1 test.t2 dbtest")
+            config.set(section3, "#Optional: unpack(extract/decrypt/decompress) N incremental backups ahead "
+                                 "while applying current one")
+            config.set(section3, "#prepare_lookahead", "2")
+            config.set(section3, "#Optional: keep prepared(--apply-log-only) copy of recent full backup, "
+                                 "every incremental backup is applied to it in background")
+            config.set(section3, "#shadow_dir", join(self.home, "XB_TEST/shadow_copy"))
+            config.set(section3, "#Optional: prepare copy-on-write snapshot instead of backup itself, "
+                                 "one of auto, reflink, hardlink, copy")
+            config.set(section3, "#prepare_snapshot", "auto")
+            config.set(section3, "#Optional: snapshot directory, must be on the same filesystem as backup_dir")
+            config.set(section3, "#snapshot_dir", join(self.home, "XB_TEST/backup_dir/snapshot"))
+            config.set(section3, "#Optional: how to restore prepared backup into datadir, "
+                                 "one of xtrabackup, auto, move-back, reflink, copy")
+            config.set(section3, "#restore_method", "xtrabackup")
+            config.set(section3, "#Optional: number of threads used for copy-back")
+            config.set(section3, "#restore_threads", "4")
+            config.set(section3, "#Optional: link files of new full backup identical to previous full backup, "
+                                 "one of none, auto, reflink, hardlink")
+            config.set(section3, "#full_dedup", "auto")
+            config.set(section3, "#Optional: number of full backups kept on full backup rotation, "
+                                 "full_dedup needs at least 2")
+            config.set(section3, "#full_retention", "2")
+            config.set(section3, "#Optional: build new full backups from recent full and incremental backups on "
+                                 "backup host instead of the server, cloned with auto, reflink, hardlink or copy")
+            config.set(section3, "#synthetic_full", "auto")
 
             section4 = "Compress"
             config.add_section(section4)
@@ -110,17 +170,36 @@ class GenerateDefaultConfig:
             config.set(section6, "#xbs_decrypt", "1")
             config.set(section6, "# WARN, enable this, if you want to stream your backups to remote host")
             config.set(section6, "#remote_stream", "ssh xxx.xxx.xxx.xxx")
+            config.set(section6, "#Optional: pipe stream to upload command as well, "
+                                 "{backup_type}, {backup_name} and {stream_file} are replaced")
+            config.set(section6, "#stream_command", "aws s3 cp - s3://bucket/{backup_type}/{backup_name}/{stream_file}")
+            config.set(section6, "#Optional: write checksum of stream next to it, in sha256sum format")
+            config.set(section6, "#stream_checksum", "sha256")
 
             section7 = "Remote"
             config.add_section(section7)
             config.set(section7, "#Optional remote syncing")
             config.set(section7, "#remote_conn", "root@xxx.xxx.xxx.xxx")
             config.set(section7, "#remote_dir", "{}".format(join(self.home, 'Documents')))
+            config.set(section7, "#Optional: number of parallel transfer streams")
+            config.set(section7, "#remote_threads", "4")
 
-            section8 = "Commands"
+            section8 = "Cgroup"
             config.add_section(section8)
-            config.set(section8, "start_mysql_command", "service mysql start")
-            config.set(section8, "stop_mysql_command", "service mysql stop")
-            config.set(section8, "chown_command", "chown -R mysql:mysql")
+            config.set(section8, "#Optional: run every spawned process in its own cgroup v2 inside cgroup_dir, "
+                                 "limits are applied to running processes when changed")
+            config.set(section8, "#cgroup_dir", "/sys/fs/cgroup/autoxtrabackup.slice")
+            config.set(section8, "#Optional: number of CPUs or cpu.max value")
+            config.set(section8, "#cpu_max", "2")
+            config.set(section8, "#memory_high", "4GiB")
+            config.set(section8, "#Optional: io.max limits of datadir and backup_dir disks")
+            config.set(section8, "#datadir_io_max", "rbps=200MiB riops=2000")
+            config.set(section8, "#backup_io_max", "wbps=200MiB")
+
+            section9 = "Commands"
+            config.add_section(section9)
+            config.set(section9, "start_mysql_command", "service mysql start")
+            config.set(section9, "stop_mysql_command", "service mysql stop")
+            config.set(section9, "chown_command", "chown -R mysql:mysql")
 
             config.write(cfgfile)
\ No newline at end of file
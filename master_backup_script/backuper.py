@@ -6,12 +6,15 @@
 
 import logging
 import os
+import re
 import subprocess
 import shlex
 import shutil
+import threading
 import time
 
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from os.path import join, isfile
 from os import makedirs
 
@@ -19,7 +22,21 @@ from general_conf import path_config
 from general_conf.generalops import GeneralClass
 from general_conf.check_env import CheckEnv
 from backup_prepare.prepare import Prepare
+from backup_prepare.shadow import ShadowCopy
+from backup_prepare.synthetic import SyntheticFull
+from backup_prepare.checkpoints import Checkpoints
+from backup_prepare.chain import ChainResolver
+from backup_catalog.catalog import BackupCatalog
+from backup_catalog.sizing import Sizing
+from backup_archive.archive import ArchiveEngine, archive_backup_set
+from backup_archive.dedup import DedupStore
 from process_runner.process_runner import ProcessRunner
+from process_runner.cgroup import CgroupEnvelope
+from process_runner.stream_pipeline import FileSink, HashSink, CommandSink, RemoteSink
+from master_backup_script.remote_sync import RemoteSync, LocalTransport, SshTransport
+from master_backup_script.full_dedup import FullDedup
+from master_backup_script.inc_policy import IncrementalPolicy
+from master_backup_script.throttle import ServerHealth, AdaptiveThrottle
 
 logger = logging.getLogger(__name__)
 
@@ -32,61 +49,81 @@ class Backup(GeneralClass):
         self.tag = tag
         # Call GeneralClass for storing configuration options
         super().__init__(self.conf)
-
-    def add_tag(self, backup_type: str, backup_size: str, backup_status: str):
+        # Share of resource budget given by multi-instance scheduler, see backup_scheduler/budget.py
+        self.resource_grant = None
+
+    @property
+    def catalog(self):
+        # Backup catalog inside backup directory, opened on first use
+        if not hasattr(self, '_catalog'):
+            self._catalog = BackupCatalog(self.backupdir)
+        return self._catalog
+
+    @property
+    def envelope(self):
+        # cgroup limits of spawned processes, new cgroup for every process, None if [Cgroup] is not configured
+        return CgroupEnvelope.from_config(self)
+
+    def register_backup(self, backup_dir, backup_type, backup_status, parent=None, start_time=None):
         """
-        Method for adding backup tags
+        Method for recording taken backup inside backup catalog.
+        LSNs, tool version and binlog position are read from LSN sidecar of the backup.
+        :param backup_dir: The backup directory path
         :param backup_type: The backup type - Full/Inc
-        :param backup_size: The size of the backup in human readab
-        le format
-        :param backup_status: Status: OK or Status: Failed
+        :param backup_status: OK or FAILED
+        :param parent: The name of base backup for incremental backups
+        :param start_time: datetime when backup was started
         :return: True if no exception
         """
-        # skip tagging unless self.tag
-        if not self.tag:
-            logger.info("TAGGING SKIPPED")
-            return True
-
-        # Currently only support Inc and Full types, calculate name based on this
-        assert backup_type in ('Full', 'Inc'), "add_tag(): backup_type {}: must be 'Full' or 'Inc'".format(backup_type)
-        backup_name = self.recent_full_backup_file() if backup_type == 'Full' else self.recent_inc_backup_file()
-
-        # Calculate more tag fields, create string
-        backup_timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        backtag_str = "{bk_name}\t{bk_type}\t{bk_status}\t{bk_timestamp}\t{bk_size}\t'{bk_tag}'\n"
-
-        # Apply tag
-        with open('{}/backup_tags.txt'.format(self.backupdir), 'a') as backtags_file:
-            backtag_final = backtag_str.format(bk_name=backup_name,
-                                               bk_type=backup_type,
-                                               bk_status=backup_status,
-                                               bk_timestamp=backup_timestamp,
-                                               bk_size=backup_size,
-                                               bk_tag=self.tag)
-
-            backtags_file.write(backtag_final)
+        lsn_backup_dir = self.lsn_backup_directory(backup_dir)
+        fields = BackupCatalog.read_xtrabackup_info(lsn_backup_dir)
+        checkpoints = Checkpoints.read(lsn_backup_dir) or {}
+        for key in ('from_lsn', 'to_lsn'):
+            if key in checkpoints:
+                fields[key] = checkpoints[key]
+        fields.setdefault('compressed', 1 if hasattr(self, 'compress') else 0)
+        fields.setdefault('encrypted', 1 if hasattr(self, 'encrypt') else 0)
+
+        end_time = datetime.now()
+        # Scanned once here, the size is read from catalog afterwards
+        size_bytes = Sizing.directory_size(backup_dir)
+        if start_time is not None:
+            fields['start_time'] = start_time.strftime('%Y-%m-%d_%H-%M-%S')
+            fields['duration'] = (end_time - start_time).total_seconds()
+
+        self.catalog.add_backup(name=os.path.basename(backup_dir),
+                                backup_type=backup_type,
+                                status=backup_status,
+                                parent=parent,
+                                size_bytes=size_bytes,
+                                size=Sizing.human_size(size_bytes),
+                                end_time=end_time.strftime('%Y-%m-%d_%H-%M-%S'),
+                                stream=getattr(self, 'stream', None),
+                                tag=self.tag,
+                                **fields)
+        if self.tag:
+            logger.info("Backup {} tagged as '{}'".format(os.path.basename(backup_dir), self.tag))
         return True
 
     @staticmethod
     def get_folder_size(path):
         """
-        Static method to calculate given folder size. Using 'du' command here.
+        Static method to calculate given folder size.
         :param path: The full path to be calculated
-        :return: String with human readable size info, for eg, 5.3M
+        :return: String with human readable size info, for eg, 5.3 MiB
         """
-        du_cmd = 'du -hs {}'.format(path)
-        status, output = subprocess.getstatusoutput(du_cmd)
-        if status == 0:
-            return output.split()[0]
-        else:
-            logger.error("Failed to get the folder size")
-            return False
+        return Sizing.human_size(Sizing.directory_size(path))
 
     @staticmethod
     def show_tags(backup_dir):
-        if os.path.isfile("{}/backup_tags.txt".format(backup_dir)):
-            with open('{}/backup_tags.txt'.format(backup_dir), 'r') as bcktags:
-                from_file = bcktags.read()
+        if BackupCatalog.exists(backup_dir):
+            rows = BackupCatalog(backup_dir).tagged_backups()
+            from_catalog = "".join("{}\t{}\t{}\t{}\t{}\t'{}'\n".format(row['name'],
+                                                                         row['backup_type'],
+                                                                         row['status'],
+                                                                         row['end_time'],
+                                                                         row['size'],
+                                                                         row['tag']) for row in rows)
             column_names = "{0}\t{1}\t{2}\t{3}\t{4}\tTAG\n".format(
                 "Backup".ljust(19),
                 "Type".ljust(4),
@@ -94,11 +131,11 @@ class Backup(GeneralClass):
                 "Completion_time".ljust(19),
                 "Size")
             extra_str = "{}\n".format("-"*(len(column_names)+21))
-            print(column_names + extra_str + from_file)
-            logger.info(column_names + extra_str + from_file)
+            print(column_names + extra_str + from_catalog)
+            logger.info(column_names + extra_str + from_catalog)
         else:
-            logger.warning("Could not find backup_tags.txt inside given backup directory. Can't print tags.")
-            print("WARNING: Could not find backup_tags.txt inside given backup directory. Can't print tags.")
+            logger.warning("Could not find backup catalog inside given backup directory. Can't print tags.")
+            print("WARNING: Could not find backup catalog inside given backup directory. Can't print tags.")
 
     @staticmethod
     def sorted_ls(path):
@@ -117,12 +154,7 @@ class Backup(GeneralClass):
         :param path: Directory path
         :return: Total size of directory
         """
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(path):
-            for f in filenames:
-                fp = os.path.join(dirpath, f)
-                total_size += os.path.getsize(fp)
-        return total_size
+        return Sizing.directory_size(path)
 
     def last_full_backup_date(self):
         """
@@ -160,14 +192,20 @@ class Backup(GeneralClass):
 
     def recent_full_backup_file(self):
         # Return last full backup dir name
+        if BackupCatalog.exists(self.backupdir) and self.catalog.has_backups('Full'):
+            return self.catalog.recent_backup('Full') or 0
 
+        # Backups taken before backup catalog existed
         if len(os.listdir(self.full_dir)) > 0:
             return max(os.listdir(self.full_dir))
         return 0
 
     def recent_inc_backup_file(self):
         # Return last increment backup dir name
+        if BackupCatalog.exists(self.backupdir) and self.catalog.has_backups('Inc'):
+            return self.catalog.recent_backup('Inc') or 0
 
+        # Backups taken before backup catalog existed
         if len(os.listdir(self.inc_dir)) > 0:
             return max(os.listdir(self.inc_dir))
         return 0
@@ -218,93 +256,293 @@ class Backup(GeneralClass):
             logger.error(output)
             raise RuntimeError("FAILED: Log flushing -> {}".format(output))
 
+    def create_mysql_client_command(self, statement):
+        # mysql client command executing given statement, connection options are the same as for flush logs
+        command = "{} --defaults-file={} -u{} --password='{}'".format(self.mysql, self.mycnf, self.mysql_user,
+                                                                     self.mysql_password)
+        if hasattr(self, 'mysql_socket'):
+            command += " --socket={}".format(self.mysql_socket)
+        else:
+            command += " --host={} --port={}".format(self.mysql_host, self.mysql_port)
+        return command + ' -e "{}"'.format(statement)
+
+    def current_lsn(self):
+        """
+        Method for reading current InnoDB LSN of the server.
+        :return: LSN as integer or None if it can not be read.
+        """
+        command = self.create_mysql_client_command("SHOW ENGINE INNODB STATUS\\G")
+        status, output = subprocess.getstatusoutput(command)
+        if status != 0:
+            logger.warning("Could not read InnoDB status: {}".format(output))
+            return None
+        return Checkpoints.innodb_status_lsn(output)
+
+    def inc_backup_needed(self):
+        """
+        Method for checking if InnoDB LSN moved at least inc_min_lsn_delta since the recent backup.
+        Skipped incremental backup is recorded in backup catalog instead.
+        If LSN of server or of the recent backup can not be read, backup is always taken.
+        :return: True if incremental backup should be taken.
+        """
+        if self.inc_min_lsn_delta <= 0 or self.dry == 1:
+            return True
+        base = self.recent_inc_backup_file() or self.recent_full_backup_file()
+        base_lsn = Checkpoints.last_lsn(self.lsn_backup_directory(base)) if base else None
+        if base_lsn is None:
+            return True
+        current_lsn = self.current_lsn()
+        if current_lsn is None:
+            return True
+        if current_lsn - base_lsn >= self.inc_min_lsn_delta:
+            logger.info("InnoDB LSN moved from {} to {} since {}".format(base_lsn, current_lsn, base))
+            return True
+        logger.info("- - - - Skipping incremental backup: InnoDB LSN moved from {} to {} since {}, "
+                    "less than inc_min_lsn_delta={} - - - -".format(base_lsn, current_lsn, base,
+                                                                  self.inc_min_lsn_delta))
+        self.catalog.add_skip(datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), parent=base, base_lsn=base_lsn,
+                              current_lsn=current_lsn)
+        return False
+
+    def backup_sets(self):
+        """
+        Method for grouping backups into sets: full backup with incremental backups taken after it.
+        :return: List of (full backup name, list of incremental backup names), oldest first.
+        """
+        fulls = sorted(os.listdir(self.full_dir)) if os.path.isdir(self.full_dir) else []
+        incs = sorted(os.listdir(self.inc_dir)) if os.path.isdir(self.inc_dir) else []
+        sets = []
+        for number, full in enumerate(fulls):
+            next_full = fulls[number + 1] if number + 1 < len(fulls) else None
+            sets.append((full, [inc for inc in incs if inc > full and (next_full is None or inc < next_full)]))
+        return sets
+
+    @property
+    def dedup_store(self):
+        # Deduplicated chunk store in archive_dir, used with archive_backend = dedup
+        return DedupStore(self.archive_dir, level=self.archive_level, threads=self.archive_threads)
+
+    def archived_sets(self):
+        # Full backup names whose sets are already archived and the archive is still in archive_dir
+        if self.archive_backend == 'dedup':
+            return set(self.dedup_store.archives())
+        return {row['full_backup'] for row in self.catalog.archives()
+                if os.path.exists(join(self.archive_dir, row['name']))}
+
+    def backup_set_sources(self, full, incs):
+        # Directories of backup set, including LSN sidecars
+        sources = [join(self.full_dir, full)] + [join(self.inc_dir, inc) for inc in incs]
+        sources += [join(self.lsn_dir, name) for name in [full] + incs if os.path.isdir(join(self.lsn_dir, name))]
+        return sources
+
     def create_backup_archives(self):
-        # Creating .tar.gz archive files of taken backups
-        for i in os.listdir(self.full_dir):
-            if len(os.listdir(self.full_dir)) == 1 or i != max(os.listdir(self.full_dir)):
-                logger.info("Preparing backups prior archiving them...")
-
-                if hasattr(self, 'prepare_archive'):
-                    logger.info("Started to prepare backups, prior archiving!")
-                    prepare_obj = Prepare(config=self.conf, dry_run=self.dry, tag=self.tag)
-                    status = prepare_obj.prepare_inc_full_backups()
-                    if status:
-                        logger.info("Backups Prepared successfully...".format(status))
-
-                if hasattr(self, 'move_archive') and (int(self.move_archive) == 1):
-                    dir_name = self.archive_dir + '/' + i + '_archive'
-                    logger.info("move_archive enabled. Moving {} to {}".format(self.backupdir, dir_name))
-                    try:
-                        shutil.copytree(self.backupdir, dir_name)
-                    except Exception as err:
-                        logger.error("FAILED: Move Archive")
-                        logger.error(err)
-                        raise
-                    else:
-                        return True
-                else:
-                    logger.info("move_archive is disabled. archiving / compressing current_backup.")
-                    # Multi-core tar utilizing pigz.
-
-                    # Pigz default to number of cores available, or 8 if cannot be read.
-
-                    # Test if pigz is available.
-                    logger.info("testing for pigz...")
-                    status = ProcessRunner.run_command("pigz --version")
-                    archive_file = self.archive_dir + '/' + i + '.tar.gz'
-                    if status:
-                        logger.info("Found pigz...")
-                        # run_tar = "tar cvvf - {} {} | pigz -v > {}" \
-                        run_tar = "tar --use-compress-program=pigz -cvf {} {} {}" \
-                            .format(archive_file, self.full_dir, self.inc_dir)
-                    else:
-                        # handle file not found error.
-                        logger.warning("pigz executeable not available. Defaulting to singlecore tar")
-                        run_tar = "tar -zcf {} {} {}"\
-                            .format(archive_file, self.full_dir, self.inc_dir)
-                    status = ProcessRunner.run_command(run_tar)
-                    if status:
-                        logger.info("OK: Old full backup and incremental backups archived!")
-                        return True
+        """
+        Method for archiving backup sets. Every set is archived once and recorded in backup catalog,
+        so rotation never compresses already archived data again. Sets are archived by pool of processes.
+        :return: List of created archive names.
+        """
+        archived = self.archived_sets()
+        pending = [(full, incs) for full, incs in self.backup_sets() if full not in archived]
+        if not pending:
+            logger.info("All backup sets are already archived. Skipping!")
+            return []
+
+        if hasattr(self, 'prepare_archive'):
+            logger.info("Started to prepare backups, prior archiving!")
+            prepare_obj = Prepare(config=self.conf, dry_run=self.dry, tag=self.tag)
+            status = prepare_obj.prepare_inc_full_backups()
+            if status:
+                logger.info("Backups Prepared successfully...".format(status))
+
+        created = []
+        if hasattr(self, 'move_archive') and (int(self.move_archive) == 1):
+            for full, incs in pending:
+                dir_name = join(self.archive_dir, full + '_archive')
+                logger.info("move_archive enabled. Moving backup set {} to {}".format(full, dir_name))
+                try:
+                    for source in self.backup_set_sources(full, incs):
+                        shutil.copytree(source, join(dir_name, os.path.relpath(source, self.backupdir)))
+                except Exception as err:
+                    logger.error("FAILED: Move Archive")
+                    logger.error(err)
+                    raise
+                size = Sizing.directory_size(dir_name)
+                self.catalog.add_archive(os.path.basename(dir_name),
+                                         full_backup=full,
+                                         codec='none',
+                                         input_bytes=size,
+                                         output_bytes=size,
+                                         created=datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+                created.append(os.path.basename(dir_name))
+            return created
+
+        if self.archive_backend == 'dedup':
+            # Files of a set are already hashed and compressed in parallel by the store
+            store = self.dedup_store
+            for full, incs in pending:
+                metrics = store.add(full, self.backup_set_sources(full, incs))
+                self.catalog.add_archive(full,
+                                         full_backup=full,
+                                         codec=metrics['codec'],
+                                         level=metrics['level'],
+                                         input_bytes=metrics['input_bytes'],
+                                         output_bytes=metrics['output_bytes'],
+                                         duration=metrics['duration'],
+                                         created=datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+                created.append(full)
+            return created
+
+        logger.info("move_archive is disabled. archiving / compressing backup sets: {}".format(
+            ', '.join(full for full, incs in pending)))
+        engine = ArchiveEngine(codec=self.archive_codec, level=self.archive_level, threads=self.archive_threads)
+        workers = max(1, min(self.archive_workers, len(pending)))
+        # Compression threads are shared by worker processes
+        threads = self.archive_threads if self.archive_threads else max(1, engine.threads // workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [(full, full + engine.extension,
+                        executor.submit(archive_backup_set, engine.codec, engine.level, threads,
+                                        join(self.archive_dir, full + engine.extension),
+                                        self.backup_set_sources(full, incs), self.envelope))
+                       for full, incs in pending]
+            failed = []
+            for full, archive_name, future in futures:
+                try:
+                    metrics = future.result()
+                except RuntimeError as err:
+                    logger.error(err)
+                    failed.append(full)
+                    continue
+                # Compressors ran in worker process, their history is recorded here
+                started = datetime.fromtimestamp(metrics['started'])
+                ProcessRunner.summarize_process(engine.compress_command(), started,
+                                                started + timedelta(seconds=metrics['duration']), 0, metrics['cgroup'])
+                self.catalog.add_archive(archive_name,
+                                         full_backup=full,
+                                         codec=metrics['codec'],
+                                         level=metrics['level'],
+                                         input_bytes=metrics['input_bytes'],
+                                         output_bytes=metrics['output_bytes'],
+                                         duration=metrics['duration'],
+                                         created=datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
+                created.append(archive_name)
+        if failed:
+            logger.error("FAILED: Archiving backup sets {}".format(', '.join(failed)))
+            raise RuntimeError("FAILED: Archiving backup sets {}".format(', '.join(failed)))
+        logger.info("OK: Backup sets archived: {}".format(', '.join(created)))
+        return created
+
+    def archive_index(self):
+        """
+        Method for building index of archives inside archive_dir. Every archive is sized exactly once.
+        :return: List of (name, archive_date, size in bytes) tuples, oldest first.
+        """
+        index = []
+        with os.scandir(self.archive_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(ArchiveEngine.index_suffix):
+                    # Side index is sized and removed together with its archive
+                    continue
+                try:
+                    if '_archive' in entry.name:
+                        archive_date = datetime.strptime(entry.name, "%Y-%m-%d_%H-%M-%S_archive")
                     else:
-                        logger.error("FAILED: Archiving ")
-                        raise RuntimeError("FAILED: Archiving -> {}".format(run_tar))
+                        # .tar.gz, .tar.zst or .tar.lz4
+                        archive_date = datetime.strptime(entry.name.split('.')[0], "%Y-%m-%d_%H-%M-%S")
+                except ValueError:
+                    logger.warning("Skipping {}/{}, it is not an archive".format(self.archive_dir, entry.name))
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                size = Sizing.directory_size(entry.path) if entry.is_dir(follow_symlinks=False) else stat.st_size
+                if os.path.isfile(entry.path + ArchiveEngine.index_suffix):
+                    size += os.path.getsize(entry.path + ArchiveEngine.index_suffix)
+                index.append((stat.st_mtime, entry.name, archive_date, size))
+        return [(name, archive_date, size) for mtime, name, archive_date, size in sorted(index)]
+
+    def remove_archives(self, archives):
+        # Deleting evicted archives, runs in background thread
+        for archive in archives:
+            path = join(self.archive_dir, archive)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+            if os.path.exists(path + ArchiveEngine.index_suffix):
+                os.remove(path + ArchiveEngine.index_suffix)
 
     def clean_old_archives(self):
+        """
+        Method for evicting archives oldest first, until archive_max_duration and archive_max_size are met.
+        Sizes are computed once, then the budget is checked in single pass. Deletion runs in background.
+        :return: List of evicted archive names.
+        """
         logger.info("Starting cleaning of old archives")
-        for archive in self.sorted_ls(self.archive_dir):
-            if '_archive' in archive:
-                archive_date = datetime.strptime(
-                    archive, "%Y-%m-%d_%H-%M-%S_archive")
-            else:
-                archive_date = datetime.strptime(
-                    archive, "%Y-%m-%d_%H-%M-%S.tar.gz")
-
-            now = datetime.now()
+        if self.archive_backend == 'dedup':
+            return self.clean_old_dedup_archives()
+        index = self.archive_index()
+        total_size = sum(size for name, archive_date, size in index)
+        now = datetime.now()
 
-            # Finding if last full backup older than the interval or more from
-            # now!
-            cleanup_msg = "Removing archive {}/{} due to {}"
+        evicted = []
+        cleanup_msg = "Removing archive {}/{} due to {}"
+        for archive, archive_date, size in index:
+            # Finding if archive is older than the interval or more from now!
             if hasattr(self, 'archive_max_duration') and (now - archive_date).total_seconds() >= self.archive_max_duration:
                 logger.info(cleanup_msg.format(self.archive_dir, archive, 'archive_max_duration exceeded.'))
-                if os.path.isdir(self.archive_dir + "/" + archive):
-                    shutil.rmtree(self.archive_dir + "/" + archive)
-                else:
-                    os.remove(self.archive_dir + "/" + archive)
-            elif hasattr(self, 'archive_max_size') and self.get_directory_size(self.archive_dir) > self.archive_max_size:
+            elif hasattr(self, 'archive_max_size') and total_size > self.archive_max_size:
                 logger.info(cleanup_msg.format(self.archive_dir, archive, 'archive_max_size exceeded.'))
-                if os.path.isdir(self.archive_dir + "/" + archive):
-                    shutil.rmtree(self.archive_dir + "/" + archive)
-                else:
-                    os.remove(self.archive_dir + "/" + archive)
+            else:
+                continue
+            evicted.append(archive)
+            total_size -= size
+
+        if evicted:
+            if BackupCatalog.exists(self.backupdir):
+                for archive in evicted:
+                    self.catalog.remove_archive(archive)
+            threading.Thread(target=self.remove_archives, args=(evicted,), name='remove-archives').start()
+        return evicted
+
+    def clean_old_dedup_archives(self):
+        """
+        Method for evicting archives of deduplicated store oldest first, see clean_old_archives().
+        Only chunks not shared with newer archives are freed, so size budget is checked after every removal.
+        Chunks left by interrupted archiving are deleted first.
+        :return: List of evicted archive names.
+        """
+        store = self.dedup_store
+        store.collect_garbage()
+        total_size = store.total_size()
+        now = datetime.now()
+
+        evicted = []
+        cleanup_msg = "Removing archive {} from {} due to {}"
+        for archive in store.archives():
+            archive_date = datetime.strptime(archive, "%Y-%m-%d_%H-%M-%S")
+            if hasattr(self, 'archive_max_duration') and (now - archive_date).total_seconds() >= self.archive_max_duration:
+                logger.info(cleanup_msg.format(archive, self.archive_dir, 'archive_max_duration exceeded.'))
+            elif hasattr(self, 'archive_max_size') and total_size > self.archive_max_size:
+                logger.info(cleanup_msg.format(archive, self.archive_dir, 'archive_max_size exceeded.'))
+            else:
+                continue
+            total_size -= store.remove(archive)
+            if BackupCatalog.exists(self.backupdir):
+                self.catalog.remove_archive(archive)
+            evicted.append(archive)
+        return evicted
 
     def clean_full_backup_dir(self):
-        # Deleting old full backup after taking new full backup.
+        # Deleting old full backups after taking new full backup, newest full_retention of them are kept.
+        # Failed full backups are never kept, except the new one.
         logger.info("starting clean_full_backup_dir")
-        for i in os.listdir(self.full_dir):
+        fulls = sorted(os.listdir(self.full_dir))
+        keep = [i for i in fulls if self.catalog.get_backup(i) is None
+                or self.catalog.get_backup(i)['status'] != 'FAILED'][-self.full_retention:]
+        for i in fulls:
             rm_dir = self.full_dir + '/' + i
-            if i != max(os.listdir(self.full_dir)):
+            if i not in keep and i != fulls[-1]:
                 shutil.rmtree(rm_dir)
+                self.remove_lsn_backup_directory(i)
+                self.catalog.remove_backup(i)
                 logger.info("DELETING {}".format(rm_dir))
             else:
                 logger.info("KEEPING {}".format(rm_dir))
@@ -314,15 +552,27 @@ class Backup(GeneralClass):
         for i in os.listdir(self.inc_dir):
             rm_dir = self.inc_dir + '/' + i
             shutil.rmtree(rm_dir)
+            self.remove_lsn_backup_directory(i)
+            self.catalog.remove_backup(i)
 
     def copy_backup_to_remote_host(self):
-        # Copying backup directory to remote server
+        """
+        Method for shipping new backup sets to remote server.
+        Backups land in remote_dir/<backup_dir name>, the same place 'scp -r' used to copy them.
+        Without remote_conn, remote_dir is treated as mounted directory.
+        :return: List of shipped backup sets.
+        """
         logger.info("- - - - Copying backups to remote server - - - -")
+        remote_root = join(self.remote_dir, os.path.basename(self.backupdir.rstrip('/')))
+        if hasattr(self, 'remote_conn') and self.remote_conn:
+            transport = SshTransport(self.remote_conn, remote_root)
+        else:
+            transport = LocalTransport(remote_root)
 
-        copy_it = 'scp -r {} {}:{}'.format(self.backupdir, self.remote_conn, self.remote_dir)
-        copy_it = shlex.split(copy_it)
-        cp = subprocess.Popen(copy_it, stdout=subprocess.PIPE)
-        logger.info(str(cp.stdout.read()))
+        skip = []
+        if BackupCatalog.exists(self.backupdir):
+            skip = [row['name'] for row in self.catalog.backups(status='FAILED')]
+        return RemoteSync(transport, self.backupdir, threads=self.remote_threads, skip=skip).sync()
 
     def general_command_builder(self):
         """
@@ -383,8 +633,90 @@ class Backup(GeneralClass):
         except AttributeError:
             pass
 
+        # Share of resource budget, added last so it overrides the same options of xtra_options
+        if self.resource_grant is not None:
+            if self.resource_grant['threads']:
+                args += " --parallel={}".format(self.resource_grant['threads'])
+                if hasattr(self, 'compress'):
+                    args += " --compress-threads={}".format(self.resource_grant['threads'])
+                if hasattr(self, 'encrypt'):
+                    args += " --encrypt-threads={}".format(self.resource_grant['threads'])
+            if self.resource_grant['write_bandwidth']:
+                # xtrabackup --throttle counts 10MiB chunks per second
+                chunks = int(self.resource_grant['write_bandwidth'] // (10 * 1024 * 1024))
+                args += " --throttle={}".format(max(chunks, 1))
+
         return args
 
+    def stream_sinks(self, backup_dir, stream_file):
+        """
+        Method for building destinations of backup stream, see process_runner/stream_pipeline.py.
+        Local stream file is always written, remote host, upload command and checksum are optional.
+        :param backup_dir: Full path of backup directory
+        :param stream_file: full_backup.stream, full_backup.tar or inc_backup.stream
+        :return: List of StreamSink objects
+        """
+        backup_type = 'full' if os.path.dirname(backup_dir.rstrip('/')) == self.full_dir.rstrip('/') else 'inc'
+        backup_name = os.path.basename(backup_dir.rstrip('/'))
+        sinks = [FileSink(join(backup_dir, stream_file))]
+
+        if hasattr(self, 'remote_stream'):
+            # remote_stream = ssh root@xxx.xxx.xxx.xxx
+            remote_conn = self.remote_stream.split()[-1]
+            # Same layout as copy_backup_to_remote_host()
+            if hasattr(self, 'remote_dir'):
+                remote_dir = join(self.remote_dir, os.path.basename(self.backupdir.rstrip('/')))
+            else:
+                remote_dir = self.backupdir
+            sinks.append(RemoteSink(remote_conn, join(remote_dir, backup_type, backup_name, stream_file)))
+
+        if hasattr(self, 'stream_command'):
+            sinks.append(CommandSink(shlex.split(self.stream_command.format(backup_type=backup_type,
+                                                                            backup_name=backup_name,
+                                                                            stream_file=stream_file))))
+
+        if hasattr(self, 'stream_checksum'):
+            sinks.append(HashSink(path=join(backup_dir, '{}.{}'.format(stream_file, self.stream_checksum)),
+                                  file_name=stream_file,
+                                  algorithm=self.stream_checksum))
+        return sinks
+
+    def adaptive_throttle(self):
+        """
+        Method for creating controller pacing backup by server health, see master_backup_script/throttle.py.
+        :return: AdaptiveThrottle object or None if no throttle_* limit is configured.
+        """
+        options = {'threads_running': 'throttle_threads', 'replica_lag': 'throttle_lag',
+                   'row_latency': 'throttle_row_latency', 'disk_latency': 'throttle_disk_latency'}
+        limits = {name: getattr(self, option) for name, option in options.items() if hasattr(self, option)}
+        if not limits or self.dry == 1:
+            return None
+        return AdaptiveThrottle(ServerHealth(self.create_mysql_client_command, self.datadir), limits,
+                                min_rate=self.throttle_min_rate,
+                                max_rate=getattr(self, 'throttle_max_rate', None),
+                                interval=self.throttle_interval)
+
+    def run_backup_command(self, command, backup_dir, stream_file=None):
+        # Streamed backups are written by stream pipeline instead of shell redirect
+        throttle = self.adaptive_throttle()
+        if throttle is None:
+            if stream_file is None:
+                return ProcessRunner.run_command(command, envelope=self.envelope)
+            return ProcessRunner.run_streaming_command(command, self.stream_sinks(backup_dir, stream_file),
+                                                       envelope=self.envelope)
+
+        throttle.start()
+        try:
+            if stream_file is None:
+                # Only the stream can be paced, server health is still reported
+                logger.warning("Backup is not streamed, adaptive throttling only reports server health")
+                return ProcessRunner.run_command(command, envelope=self.envelope)
+            return ProcessRunner.run_streaming_command(command, self.stream_sinks(backup_dir, stream_file),
+                                                       pacer=throttle.pacer, envelope=self.envelope)
+        finally:
+            throttle.stop()
+            throttle.report(join(self.lsn_backup_directory(backup_dir), 'throttle_report.json'))
+
     def full_backup(self):
         """
         Method for taking full backups. It will construct the backup command based on config file.
@@ -393,24 +725,28 @@ class Backup(GeneralClass):
         """
         logger.info("starting full backup to {}".format(self.full_dir))
         full_backup_dir = self.create_backup_directory(self.full_dir)
+        lsn_backup_dir = self.lsn_backup_directory(full_backup_dir)
+        makedirs(lsn_backup_dir, exist_ok=True)
 
         # Taking Full backup
         xtrabackup_cmd = "{} --defaults-file={} --user={} --password={} " \
-               " --target-dir={} --backup".format(
+               " --target-dir={} --extra-lsndir={} --backup".format(
                 self.backup_tool,
                 self.mycnf,
                 self.mysql_user,
                 self.mysql_password,
-                full_backup_dir)
+                full_backup_dir,
+                lsn_backup_dir)
 
         # Calling general options/command builder to add extra options
         xtrabackup_cmd += self.general_command_builder()
 
         # Checking if streaming enabled for backups
+        stream_file = None
         if hasattr(self, 'stream') and self.stream == 'xbstream':
             xtrabackup_cmd += " "
             xtrabackup_cmd += '--stream="{}"'.format(self.stream)
-            xtrabackup_cmd += " > {}/full_backup.stream".format(full_backup_dir)
+            stream_file = 'full_backup.stream'
             logger.warning("Streaming xbstream is enabled!")
         elif hasattr(self, 'stream') and self.stream == 'tar' and \
                 (hasattr(self, 'encrypt') or hasattr(self, 'compress')):
@@ -421,7 +757,7 @@ class Backup(GeneralClass):
         elif hasattr(self, 'stream') and self.stream == 'tar':
             xtrabackup_cmd += " "
             xtrabackup_cmd += '--stream="{}"'.format(self.stream)
-            xtrabackup_cmd += " > {}/full_backup.tar".format(full_backup_dir)
+            stream_file = 'full_backup.tar'
             logger.warning("Streaming tar is enabled!")
 
         if self.dry == 1:
@@ -430,255 +766,348 @@ class Backup(GeneralClass):
 
         # do the xtrabackup
         logger.debug("Starting {}".format(self.backup_tool))
-        status = ProcessRunner.run_command(xtrabackup_cmd)
-        status_str = 'OK' if status is True else 'FAILED'
-        self.add_tag(backup_type='Full',
-                     backup_size=self.get_folder_size(full_backup_dir),
-                     backup_status=status_str)
+        start_time = datetime.now()
+        status = False
+        try:
+            status = self.run_backup_command(xtrabackup_cmd, full_backup_dir, stream_file)
+        finally:
+            self.register_backup(backup_dir=full_backup_dir,
+                                 backup_type='Full',
+                                 backup_status='OK' if status is True else 'FAILED',
+                                 start_time=start_time)
+        if status is True and self.full_dedup != 'none' and not hasattr(self, 'stream'):
+            self.dedup_full_backup(full_backup_dir)
         return status
 
+    def synthetic_full_backup(self):
+        """
+        Method for building new full backup from recent full backup and its restore chain on backup host,
+        instead of reading the whole database from the server.
+        The server is backed up directly if there is nothing to build from or the build fails.
+        :return: True on success.
+        """
+        recent_bck = self.recent_full_backup_file()
+        if not recent_bck or not BackupCatalog.exists(self.backupdir):
+            logger.info("No full backup to build synthetic full backup from, taking it from the server")
+            return self.full_backup()
+        try:
+            chain = self.restore_chain()
+        except RuntimeError as err:
+            logger.warning("Could not resolve incremental chain of {}, taking full backup from the server: {}".format(
+                recent_bck, err))
+            return self.full_backup()
+
+        name = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        newest = chain[-1] if chain else recent_bck
+        start_time = datetime.now()
+        try:
+            new_full_dir = SyntheticFull(config=self.conf, dry_run=self.dry).build(recent_bck, chain, name)
+        except RuntimeError as err:
+            logger.warning("Taking full backup from the server instead: {}".format(err))
+            return self.full_backup()
+        if self.dry == 1:
+            return True
+
+        # LSN sidecar: LSNs of the prepared result, binlog position of the newest backup applied
+        lsn_backup_dir = self.lsn_backup_directory(name)
+        makedirs(lsn_backup_dir, exist_ok=True)
+        for file_name, source_dir in (('xtrabackup_checkpoints', new_full_dir),
+                                      ('xtrabackup_info', self.lsn_backup_directory(newest))):
+            if isfile(join(source_dir, file_name)):
+                shutil.copy2(join(source_dir, file_name), lsn_backup_dir)
+        self.register_backup(backup_dir=new_full_dir,
+                             backup_type='Full',
+                             backup_status='OK',
+                             parent=newest,
+                             start_time=start_time)
+        # Synthetic full backup is stored unpacked whatever stream, compress and encrypt are
+        self.catalog.update_backup(name, stream=None, compressed=0, encrypted=0)
+        return True
+
+    def dedup_full_backup(self, full_backup_dir):
+        """
+        Method for linking files of new full backup to identical files of previous full backup.
+        Linked bytes and the previous backup are recorded in backup catalog(linked_bytes, linked_from).
+        Deduplication failure never fails the backup, files are just kept as they are.
+        :param full_backup_dir: New full backup directory
+        Skipped with full_retention = 1, as the previous backup is deleted by rotation.
+        :return: Dictionary of FullDedup.run() results or None if there was nothing to compare with
+        """
+        name = os.path.basename(full_backup_dir)
+        if self.full_retention < 2:
+            # Previous full backup is deleted by rotation right after, nothing would be saved
+            logger.info("Skipping deduplication of {}: full_retention = {} keeps no previous full backup".format(
+                full_backup_dir, self.full_retention))
+            return None
+        previous = [i for i in sorted(os.listdir(self.full_dir)) if i < name
+                    and (self.catalog.get_backup(i) is None or self.catalog.get_backup(i)['status'] != 'FAILED')]
+        if not previous:
+            return None
+        try:
+            result = FullDedup(self.full_dedup).run(join(self.full_dir, previous[-1]), full_backup_dir,
+                                                    self.lsn_backup_directory(previous[-1]),
+                                                    self.lsn_backup_directory(full_backup_dir))
+        except (OSError, RuntimeError) as err:
+            logger.warning("Skipping deduplication of {}: {}".format(full_backup_dir, err))
+            return None
+        self.catalog.update_backup(name, linked_from=previous[-1], linked_bytes=result['linked_bytes'])
+        return result
+
+    def lsn_backup_directory(self, backup_dir):
+        """
+        Method for getting LSN sidecar directory of given backup.
+        xtrabackup_checkpoints of every backup is kept there (--extra-lsndir),
+        so incremental backups never need to extract streamed backups to find the base LSN.
+        :param backup_dir: Backup directory path or name, for eg, 2017-11-09_19-37-16
+        :return: Sidecar directory path
+        """
+        return join(self.lsn_dir, os.path.basename(backup_dir.rstrip('/')))
+
+    def remove_lsn_backup_directory(self, backup_dir):
+        # Removing LSN sidecar directory of deleted backup
+        lsn_backup_dir = self.lsn_backup_directory(backup_dir)
+        if os.path.isdir(lsn_backup_dir):
+            shutil.rmtree(lsn_backup_dir)
+
+    def extract_incremental_basedir(self, base_dir, stream_file):
+        """
+        Method for making --incremental-basedir usable for backups taken without LSN sidecar.
+        Streamed base backup is extracted(and decrypted) and the encrypted xtrabackup_checkpoints is decrypted.
+        :param base_dir: The base backup directory path
+        :param stream_file: The stream file name inside base backup, full_backup.stream or inc_backup.stream
+        :return: True on success.
+        :raise: RuntimeError on error.
+        """
+        stream_path = join(base_dir, stream_file)
+
+        # Extract and decrypt streamed base backup prior to executing incremental backup
+        if hasattr(self, 'stream') and self.stream == 'xbstream' \
+                and hasattr(self, 'encrypt') and hasattr(self, 'xbs_decrypt'):
+            logger.info("Using xbstream to extract and decrypt from {}!".format(stream_file))
+            xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} -C {}".format(
+                                self.xbstream,
+                                self.xbstream_options,
+                                self.decrypt,
+                                self.encrypt_key,
+                                self.encrypt_threads,
+                                base_dir)
+        # Extract streamed base backup prior to executing incremental backup
+        elif hasattr(self, 'stream') and self.stream == 'xbstream':
+            logger.info("Using xbstream to extract from {}!".format(stream_file))
+            xbstream_command = "{} {} -C {}".format(
+                self.xbstream,
+                self.xbstream_options,
+                base_dir)
+        elif hasattr(self, 'encrypt'):
+            logger.info("Applying workaround for LP #1444255")
+            xbcrypt_command = "{} -d -k {} -a {} -i {}/xtrabackup_checkpoints.xbcrypt " \
+                              "-o {}/xtrabackup_checkpoints".format(
+                               self.xbcrypt,
+                               self.encrypt_key,
+                               self.encrypt,
+                               base_dir,
+                               base_dir)
+            logger.info("The following xbcrypt command will be executed {}".format(xbcrypt_command))
+
+            if self.dry == 0:
+                try:
+                    ProcessRunner.run_command(xbcrypt_command, envelope=self.envelope)
+                except ChildProcessError:
+                    logger.error("FAILED: XBCRYPT command")
+                    raise RuntimeError("FAILED: XBCRYPT command")
+                logger.info("OK: XBCRYPT command succeeded.")
+            return True
+        else:
+            return True
+
+        logger.info("The following xbstream command will be executed {} < {}".format(xbstream_command, stream_path))
+        if self.dry == 0 and isfile(stream_path):
+            try:
+                ProcessRunner.run_command(xbstream_command, envelope=self.envelope, stdin=stream_path)
+            except ChildProcessError:
+                logger.error("FAILED: XBSTREAM command.")
+                raise RuntimeError("FAILED: XBSTREAM command.")
+            logger.info("OK: XBSTREAM command succeeded.")
+        return True
+
+    def restore_chain(self):
+        """
+        Method for resolving incremental backups of recent full backup which restore would apply.
+        With cumulative incremental backups(inc_policy) superseded incremental backups are left out.
+        :return: List of incremental backup names in apply order.
+        :raise: RuntimeError if chain is broken.
+        """
+        full = self.recent_full_backup_file()
+        inc_backups = [row['name'] for row in self.catalog.backups(backup_type='Inc', status='OK')
+                       if row['name'] > full and os.path.isdir(join(self.inc_dir, row['name']))]
+        resolver = ChainResolver(full_dir=self.full_dir, inc_dir=self.inc_dir, lsn_dir=self.lsn_dir,
+                                 catalog=self.catalog, allow_forks=self.inc_policy != 'chain')
+        return resolver.resolve(full_backup=full, inc_backups=inc_backups)
+
+    def incremental_base(self):
+        """
+        Method for choosing base of the next incremental backup according to inc_policy.
+        Backups not recorded in backup catalog are always based on the recent backup.
+        :return: Base backup name
+        """
+        recent_bck = self.recent_full_backup_file()
+        recent_inc = self.recent_inc_backup_file()
+        policy = IncrementalPolicy(policy=self.inc_policy, max_chain=self.inc_max_chain)
+        if policy.policy == 'chain' or not BackupCatalog.exists(self.backupdir):
+            return recent_inc or recent_bck
+
+        full = self.catalog.get_backup(recent_bck)
+        try:
+            chain = [self.catalog.get_backup(name) for name in self.restore_chain()]
+        except RuntimeError as err:
+            logger.warning("Could not resolve restore chain, taking incremental backup on top of recent backup: "
+                           "{}".format(err))
+            return recent_inc or recent_bck
+        if full is None:
+            return recent_inc or recent_bck
+
+        policy.history = self.catalog.backups(backup_type='Inc', status='OK')
+        current_lsn = self.current_lsn() if policy.policy == 'cost' else None
+        return policy.choose(full, chain, current_lsn)
+
     def inc_backup(self):
         """
         Method for taking incremental backups.
+        The base LSN is read from LSN sidecar of the recent backup and passed via --incremental-lsn.
+        For backups taken before sidecars existed, falling back to --incremental-basedir.
         :return: True on success.
         :raise: RuntimeError on error.
         """
+        # Check here if stream=tar enabled.
+        # Because it is impossible to take incremental backup with streaming tar.
+        # raise RuntimeError.
+        if hasattr(self, 'stream') and self.stream == 'tar':
+            logger.error("xtrabackup: error: streaming incremental backups are incompatible with the "
+                         "'tar' streaming format. Use --stream=xbstream instead.")
+            raise RuntimeError("xtrabackup: error: streaming incremental backups are incompatible with the "
+                               "'tar' streaming format. Use --stream=xbstream instead.")
+
         # Get the recent full backup path
         recent_bck = self.recent_full_backup_file()
-        # Get the recent incremental backup path
-        recent_inc = self.recent_inc_backup_file()
+        # Get the base backup chosen by inc_policy
+        base = self.incremental_base()
+
+        # Checking if incremental backup is based on full backup
+        if base == recent_bck:
+            base_dir = join(self.full_dir, recent_bck)
+            stream_file = 'full_backup.stream'
+        else:  # If it is based on existing incremental backup
+            base_dir = join(self.inc_dir, base)
+            stream_file = 'inc_backup.stream'
 
         # Creating time-stamped incremental backup directory
         inc_backup_dir = self.create_backup_directory(self.inc_dir)
+        lsn_backup_dir = self.lsn_backup_directory(inc_backup_dir)
+        makedirs(lsn_backup_dir, exist_ok=True)
+
+        xtrabackup_inc_cmd = "{} --defaults-file={} --user={} --password={} " \
+                             "--target-dir={} --extra-lsndir={} --backup".format(
+                                self.backup_tool,
+                                self.mycnf,
+                                self.mysql_user,
+                                self.mysql_password,
+                                inc_backup_dir,
+                                lsn_backup_dir)
+
+        base_lsn = Checkpoints.to_lsn(self.lsn_backup_directory(base_dir))
+        if base_lsn is not None:
+            logger.info("Using to_lsn={} of {} as base for incremental backup".format(base_lsn, base_dir))
+            xtrabackup_inc_cmd += " --incremental-lsn={}".format(base_lsn)
+        else:
+            logger.warning("Could not find LSN sidecar for {}, using --incremental-basedir".format(base_dir))
+            self.extract_incremental_basedir(base_dir=base_dir, stream_file=stream_file)
+            xtrabackup_inc_cmd += " --incremental-basedir={}".format(base_dir)
 
-        # Checking if there is any incremental backup
-
-        if recent_inc == 0:  # If there is no incremental backup
-
-            # Taking incremental backup.
-            xtrabackup_inc_cmd = "{} --defaults-file={} --user={} --password={} " \
-                   "--target-dir={} --incremental-basedir={}/{} --backup".format(
-                    self.backup_tool,
-                    self.mycnf,
-                    self.mysql_user,
-                    self.mysql_password,
-                    inc_backup_dir,
-                    self.full_dir,
-                    recent_bck)
-
-            # Calling general options/command builder to add extra options
-            xtrabackup_inc_cmd += self.general_command_builder()
-
-            # Check here if stream=tar enabled.
-            # Because it is impossible to take incremental backup with streaming tar.
-            # raise RuntimeError.
-            if hasattr(self, 'stream') and self.stream == 'tar':
-                logger.error("xtrabackup: error: streaming incremental backups are incompatible with the "
-                             "'tar' streaming format. Use --stream=xbstream instead.")
-                raise RuntimeError("xtrabackup: error: streaming incremental backups are incompatible with the "
-                                   "'tar' streaming format. Use --stream=xbstream instead.")
-
-            # Extract and decrypt streamed full backup prior to executing incremental backup
-            if hasattr(self, 'stream') and self.stream == 'xbstream' \
-                    and hasattr(self, 'encrypt') and hasattr(self, 'xbs_decrypt'):
-                logger.info("Using xbstream to extract and decrypt from full_backup.stream!")
-                xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} " \
-                                   "< {}/{}/full_backup.stream -C {}/{}".format(
-                                    self.xbstream,
-                                    self.xbstream_options,
-                                    self.decrypt,
-                                    self.encrypt_key,
-                                    self.encrypt_threads,
-                                    self.full_dir,
-                                    recent_bck,
-                                    self.full_dir,
-                                    recent_bck)
-
-                logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-                if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(self.full_dir, recent_bck)):
-                    status, output = subprocess.getstatusoutput(xbstream_command)
-                    if status == 0:
-                        logger.info("OK: XBSTREAM command succeeded.")
-                    else:
-                        logger.error("FAILED: XBSTREAM COMMAND")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBSTREAM COMMAND")
-
-            # Extract streamed full backup prior to executing incremental backup
-            elif hasattr(self, 'stream') and self.stream == 'xbstream':
-                logger.info("Using xbstream to extract from full_backup.stream!")
-                xbstream_command = "{} {} < {}/{}/full_backup.stream -C {}/{}".format(
-                    self.xbstream,
-                    self.xbstream_options,
-                    self.full_dir,
-                    recent_bck,
-                    self.full_dir,
-                    recent_bck)
-
-                logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-
-                if self.dry == 0 and isfile("{}/{}/full_backup.stream".format(self.full_dir, recent_bck)):
-                    status, output = subprocess.getstatusoutput(xbstream_command)
-                    if status == 0:
-                        logger.info("OK: XBSTREAM command succeeded.")
-                    else:
-                        logger.error("FAILED: XBSTREAM command")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBSTREAM command")
-
-            elif 'encrypt' in xtrabackup_inc_cmd:
-                logger.info("Applying workaround for LP #1444255")
-                xbcrypt_command = "{} -d -k {} -a {} -i {}/{}/xtrabackup_checkpoints.xbcrypt " \
-                                  "-o {}/{}/xtrabackup_checkpoints".format(
-                                   self.xbcrypt,
-                                   self.encrypt_key,
-                                   self.encrypt,
-                                   self.full_dir,
-                                   recent_bck,
-                                   self.full_dir,
-                                   recent_bck)
-                logger.info("The following xbcrypt command will be executed {}".format(xbcrypt_command))
-
-                if self.dry == 0:
-                    status, output = subprocess.getstatusoutput(xbcrypt_command)
-                    if status == 0:
-                        logger.info(output[-27:])
-                    else:
-                        logger.error("FAILED: XBCRYPT command")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBCRYPT command")
-
-            # Checking if streaming enabled for backups
-            if hasattr(self, 'stream') and self.stream == 'xbstream':
-                xtrabackup_inc_cmd += " "
-                xtrabackup_inc_cmd += '--stream="{}"'.format(self.stream)
-                xtrabackup_inc_cmd += " > {}/inc_backup.stream".format(inc_backup_dir)
-                logger.warning("Streaming xbstream is enabled!")
-            elif hasattr(self, 'stream') and self.stream == 'tar':
-                logger.error("xtrabackup: error: streaming incremental backups are incompatible with the "
-                             "'tar' streaming format. Use --stream=xbstream instead.")
-                raise RuntimeError("xtrabackup: error: streaming incremental backups are incompatible with the "
-                                   "'tar' streaming format. Use --stream=xbstream instead.")
+        # Calling general options/command builder to add extra options
+        xtrabackup_inc_cmd += self.general_command_builder()
 
-            if self.dry == 0:
-                logger.info("Starting {}".format(self.backup_tool))
-                status = ProcessRunner.run_command(xtrabackup_inc_cmd)
-                status_str = 'OK' if status is True else 'FAILED'
-                self.add_tag(backup_type='Inc',
-                             backup_size=self.get_folder_size(inc_backup_dir),
-                             backup_status=status_str)
-                return status
-
-        else:  # If there is already existing incremental backup
-
-            xtrabackup_inc_cmd = "{} --defaults-file={} --user={} --password={}  " \
-                   "--target-dir={} --incremental-basedir={}/{} --backup".format(
-                    self.backup_tool,
-                    self.mycnf,
-                    self.mysql_user,
-                    self.mysql_password,
-                    inc_backup_dir,
-                    self.inc_dir,
-                    recent_inc)
-
-            # Calling general options/command builder to add extra options
-            xtrabackup_inc_cmd += self.general_command_builder()
-
-            # Check here if stream=tar enabled.
-            # Because it is impossible to take incremental backup with streaming tar.
-            # raise RuntimeError.
-            if hasattr(self, 'stream') and self.stream == 'tar':
-                logger.error("xtrabackup: error: streaming incremental backups are incompatible with the "
-                             "'tar' streaming format. Use --stream=xbstream instead.")
-                raise RuntimeError("xtrabackup: error: streaming incremental backups are incompatible with the "
-                                   "'tar' streaming format. Use --stream=xbstream instead.")
-
-            # Extract and decrypt streamed full backup prior to executing incremental backup
-            if hasattr(self, 'stream') \
-                    and hasattr(self, 'encrypt') \
-                    and hasattr(self, 'xbs_decrypt'):
-                logger.info("Using xbstream to extract and decrypt from inc_backup.stream!")
-                xbstream_command = "{} {} --decrypt={} --encrypt-key={} --encrypt-threads={} " \
-                                   "< {}/{}/inc_backup.stream -C {}/{}".format(
-                                       self.xbstream,
-                                       self.xbstream_options,
-                                       self.decrypt,
-                                       self.encrypt_key,
-                                       self.encrypt_threads,
-                                       self.inc_dir,
-                                       recent_inc,
-                                       self.inc_dir,
-                                       recent_inc)
-
-                logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-                if self.dry == 0 and isfile("{}/{}/inc_backup.stream".format(self.inc_dir, recent_inc)):
-                    status, output = subprocess.getstatusoutput(xbstream_command)
-                    if status == 0:
-                        logger.info("OK: XBSTREAM command succeeded.")
-                    else:
-                        logger.error("FAILED: XBSTREAM command.")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBSTREAM command.")
-
-            # Extracting streamed incremental backup prior to executing new incremental backup
-
-            elif hasattr(self, 'stream'):
-                logger.info("Using xbstream to extract from inc_backup.stream!")
-                xbstream_command = "{} {} < {}/{}/inc_backup.stream -C {}/{}".format(
-                    self.xbstream,
-                    self.xbstream_options,
-                    self.inc_dir,
-                    recent_inc,
-                    self.inc_dir,
-                    recent_inc)
-
-                logger.info("The following xbstream command will be executed {}".format(xbstream_command))
-
-                if self.dry == 0 and isfile("{}/{}/inc_backup.stream".format(self.full_dir, recent_bck)):
-                    status, output = subprocess.getstatusoutput(xbstream_command)
-                    if status == 0:
-                        logger.info("OK: XBSTREAM command succeeded.")
-                    else:
-                        logger.error("FAILED: XBSTREAM command.")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBSTREAM command.")
-
-            elif 'encrypt' in xtrabackup_inc_cmd:
-                logger.info("Applying workaround for LP #1444255")
-                xbcrypt_command = "{} -d -k {} -a {} -i {}/{}/xtrabackup_checkpoints.xbcrypt " \
-                                  "-o {}/{}/xtrabackup_checkpoints".format(
-                                   self.xbcrypt,
-                                   self.encrypt_key,
-                                   self.encrypt,
-                                   self.inc_dir,
-                                   recent_inc,
-                                   self.inc_dir,
-                                   recent_inc)
-                logger.info("The following xbcrypt command will be executed {}".format(xbcrypt_command))
-                if self.dry == 0:
-                    status, output = subprocess.getstatusoutput(xbcrypt_command)
-                    if status == 0:
-                        logger.info(output[-27:])
-                    else:
-                        logger.error("FAILED: XBCRYPT command")
-                        logger.error(output)
-                        raise RuntimeError("FAILED: XBCRYPT command")
+        # Checking if streaming enabled for backups
+        stream_file = None
+        if hasattr(self, 'stream') and self.stream == 'xbstream':
+            xtrabackup_inc_cmd += " "
+            xtrabackup_inc_cmd += '--stream="{}"'.format(self.stream)
+            stream_file = 'inc_backup.stream'
+            logger.warning("Streaming xbstream is enabled!")
 
-            # Checking if streaming enabled for backups
-            if hasattr(self, 'stream'):
-                xtrabackup_inc_cmd += " "
-                xtrabackup_inc_cmd += '--stream="{}"'.format(self.stream)
-                xtrabackup_inc_cmd += " > {}/inc_backup.stream".format(inc_backup_dir)
-                logger.warning("Streaming is enabled!")
+        if self.dry == 1:
+            # If it's a dry run, only show the command, skip running & tagging
+            logger.info("The following backup command will be executed {}".format(
+                re.sub(r"--password='?\w+'?", "--password='*'", xtrabackup_inc_cmd)))
+            return True
 
-            if self.dry == 0:
-                logger.debug("Starting {}".format(self.backup_tool))
-                status = ProcessRunner.run_command(xtrabackup_inc_cmd)
-                status_str = 'OK' if status is True else 'FAILED'
-                self.add_tag(backup_type='Inc',
-                             backup_size=self.get_folder_size(inc_backup_dir),
-                             backup_status=status_str)
-                return status
+        logger.info("Starting {}".format(self.backup_tool))
+        start_time = datetime.now()
+        status = False
+        try:
+            status = self.run_backup_command(xtrabackup_inc_cmd, inc_backup_dir, stream_file)
+        finally:
+            self.register_backup(backup_dir=inc_backup_dir,
+                                 backup_type='Inc',
+                                 backup_status='OK' if status is True else 'FAILED',
+                                 parent=os.path.basename(base_dir),
+                                 start_time=start_time)
+        return status
+
+    def rotate_full_backup(self):
+        """
+        Method for replacing expired full backup: old backup sets are archived, new full backup is taken
+        and old full and incremental backups are removed.
+        :return: True on success.
+        """
+        # Archiving backups
+        if hasattr(self, 'archive_dir'):
+            logger.info("Archiving enabled; cleaning archive_dir & archiving previous Full Backup")
+            if (hasattr(self, 'archive_max_duration') and self.archive_max_duration) \
+                    or (hasattr(self, 'archive_max_size') and self.archive_max_size):
+                self.clean_old_archives()
+            self.create_backup_archives()
+        else:
+            logger.info("Archiving disabled. Skipping!")
+
+        if self.synthetic_full != 'none':
+            # Built on backup host, the server is not touched
+            taken = self.synthetic_full_backup()
+        else:
+            # Flushing logs and taking fullbackup
+            taken = self.mysql_connection_flush_logs() and self.full_backup()
+
+        if taken:
+            # Removing full backups
+            self.clean_full_backup_dir()
+
+            # Removing inc backups
+            self.clean_inc_backup_dir()
+
+        # Copying backups to remote server, streamed backups are already written there by remote_stream
+        if hasattr(self, 'remote_dir') and self.remote_dir and not hasattr(self, 'remote_stream'):
+            self.copy_backup_to_remote_host()
+
+        return True
+
+    def take_inc_backup(self):
+        """
+        Method for taking incremental backup on top of recent backup, unless server did not change since then.
+        :return: True on success.
+        """
+        if not self.inc_backup_needed():
+            return True
+        self.inc_backup()
+
+        # Copying backups to remote server, streamed backups are already written there by remote_stream
+        if hasattr(self, 'remote_dir') and self.remote_dir and not hasattr(self, 'remote_stream'):
+            self.copy_backup_to_remote_host()
+
+        # Applying new incremental backup to shadow copy while still holding the backup lock,
+        # so next rotation can not remove incremental backups the refresh is reading
+        if hasattr(self, 'shadow_dir') and self.dry == 0:
+            ShadowCopy(config=self.conf).refresh_after_backup()
+
+        return True
 
     def all_backup(self):
         """
@@ -704,43 +1133,15 @@ class Backup(GeneralClass):
                     # Removing old inc backups
                     self.clean_inc_backup_dir()
 
-            # Copying backups to remote server
-            if hasattr(self, 'remote_conn') and hasattr(self, 'remote_dir') \
-                    and self.remote_conn and self.remote_dir:
+            # Copying backups to remote server, streamed backups are already written there by remote_stream
+            if hasattr(self, 'remote_dir') and self.remote_dir and not hasattr(self, 'remote_stream'):
                 self.copy_backup_to_remote_host()
 
             return True
 
         elif self.last_full_backup_date() == 1:
             logger.info("- - - - Your full backup is timeout : Taking new Full Backup! - - - -")
-
-            # Archiving backups
-            if hasattr(self, 'archive_dir'):
-                logger.info("Archiving enabled; cleaning archive_dir & archiving previous Full Backup")
-                if (hasattr(self, 'archive_max_duration') and self.archive_max_duration) \
-                        or (hasattr(self, 'archive_max_size') and self.archive_max_size):
-                    self.clean_old_archives()
-                self.create_backup_archives()
-            else:
-                logger.info("Archiving disabled. Skipping!")
-
-            # Flushing logs
-            if self.mysql_connection_flush_logs():
-
-                # Taking fullbackup
-                if self.full_backup():
-                    # Removing full backups
-                    self.clean_full_backup_dir()
-
-                    # Removing inc backups
-                    self.clean_inc_backup_dir()
-
-            # Copying backups to remote server
-            if hasattr(self, 'remote_conn') and hasattr(self, 'remote_dir') \
-                    and self.remote_conn and self.remote_dir:
-                self.copy_backup_to_remote_host()
-
-            return True
+            return self.rotate_full_backup()
         else:
 
             logger.info("- - - - You have a full backup that is less than {} seconds old. - - - -".format(
@@ -749,12 +1150,5 @@ class Backup(GeneralClass):
 
             time.sleep(3)
 
-            # Taking incremental backup
-            self.inc_backup()
-
-            # Copying backups to remote server
-            if hasattr(self, 'remote_conn') and hasattr(self, 'remote_dir') \
-                    and self.remote_conn and self.remote_dir:
-                self.copy_backup_to_remote_host()
-
-            return True
+            # Taking incremental backup, unless server did not change since recent backup
+            return self.take_inc_backup()
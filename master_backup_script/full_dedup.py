@@ -0,0 +1,136 @@
+# File level deduplication between consecutive full backups, in the spirit of rsync --link-dest.
+# Files of new full backup having the same size and sha256 as in previous full backup
+# are replaced with reflinks(or hardlinks) to the previous copy.
+# Hashes are cached in LSN sidecar of every full backup, so previous backup is hashed only once.
+
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+from backup_prepare.snapshot import Snapshot
+from master_backup_script.remote_sync import file_checksum
+
+logger = logging.getLogger(__name__)
+
+
+class FullDedup:
+
+    methods = ('auto', 'reflink', 'hardlink')
+
+    cache_file = 'dedup_hashes.json'
+
+    def __init__(self, method='auto', threads=4):
+        """
+        :param method: auto(reflink if filesystem supports it, otherwise hardlink), reflink or hardlink
+        :param threads: Number of files hashed in parallel
+        """
+        if method not in self.methods:
+            logger.error("Unknown full_dedup method {}, must be one of {}".format(method, ', '.join(self.methods)))
+            raise RuntimeError("Unknown full_dedup method {}".format(method))
+        self.method = method
+        self.threads = threads
+
+    @staticmethod
+    def read_cache(cache_dir):
+        # Dictionary of relative path -> [size, mtime_ns, sha256]
+        path = join(cache_dir, FullDedup.cache_file)
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as cache:
+            return json.load(cache)
+
+    @staticmethod
+    def write_cache(cache_dir, hashes):
+        os.makedirs(cache_dir, exist_ok=True)
+        path = join(cache_dir, FullDedup.cache_file)
+        with open(path + '.tmp', 'w') as cache:
+            json.dump(hashes, cache)
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def file_hash(path, cache, rel_path):
+        """
+        Static method for getting sha256 of file, cached hash is used if size and mtime are unchanged.
+        :return: List of [size, mtime_ns, sha256]
+        """
+        stat = os.stat(path)
+        cached = cache.get(rel_path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached
+        return [stat.st_size, stat.st_mtime_ns, file_checksum(path)]
+
+    @staticmethod
+    def backup_files(backup_dir):
+        """
+        :return: Dictionary of relative path -> os.stat_result of regular files
+        """
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(backup_dir):
+            for filename in filenames:
+                path = join(dirpath, filename)
+                if not os.path.islink(path):
+                    files[os.path.relpath(path, backup_dir)] = os.stat(path)
+        return files
+
+    def link(self, src, dst, method):
+        # Replace dst with link to src atomically, dst is kept if linking fails
+        tmp = dst + '.dedup'
+        if method == 'reflink':
+            Snapshot.reflink(src, tmp)
+        else:
+            os.link(src, tmp)
+        os.replace(tmp, dst)
+
+    def run(self, previous_dir, new_dir, previous_cache_dir, new_cache_dir):
+        """
+        Method for linking files of new full backup to identical files of previous full backup.
+        :param previous_dir: Previous full backup directory
+        :param new_dir: New full backup directory
+        :param previous_cache_dir: LSN sidecar of previous full backup, where its hashes are cached
+        :param new_cache_dir: LSN sidecar of new full backup
+        :return: Dictionary of method, linked(number of files), linked_bytes
+        """
+        method = self.method
+        if method == 'auto':
+            method = 'reflink' if Snapshot.supports_reflink(previous_dir, new_dir) else 'hardlink'
+        previous_files = self.backup_files(previous_dir)
+        new_files = self.backup_files(new_dir)
+        candidates = sorted(rel_path for rel_path, stat in new_files.items()
+                            if rel_path in previous_files and stat.st_size > 0
+                            and stat.st_size == previous_files[rel_path].st_size
+                            and (stat.st_dev, stat.st_ino) != (previous_files[rel_path].st_dev,
+                                                               previous_files[rel_path].st_ino))
+        logger.info("Comparing {} files of {} with {} using sha256".format(len(candidates), new_dir, previous_dir))
+
+        previous_cache = self.read_cache(previous_cache_dir)
+        new_cache = self.read_cache(new_cache_dir)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            previous_hashes = executor.map(lambda rel_path: self.file_hash(join(previous_dir, rel_path),
+                                                                           previous_cache, rel_path), candidates)
+            new_hashes = executor.map(lambda rel_path: self.file_hash(join(new_dir, rel_path),
+                                                                      new_cache, rel_path), candidates)
+            previous_hashes = dict(zip(candidates, previous_hashes))
+            new_hashes = dict(zip(candidates, new_hashes))
+
+        linked, linked_bytes = 0, 0
+        for rel_path in candidates:
+            if previous_hashes[rel_path][2] != new_hashes[rel_path][2]:
+                continue
+            try:
+                self.link(join(previous_dir, rel_path), join(new_dir, rel_path), method)
+            except OSError as err:
+                logger.warning("Could not {} {}: {}".format(method, join(new_dir, rel_path), err))
+                continue
+            stat = os.stat(join(new_dir, rel_path))
+            new_hashes[rel_path] = [stat.st_size, stat.st_mtime_ns, new_hashes[rel_path][2]]
+            linked += 1
+            linked_bytes += stat.st_size
+
+        previous_cache.update(previous_hashes)
+        new_cache.update(new_hashes)
+        self.write_cache(previous_cache_dir, previous_cache)
+        self.write_cache(new_cache_dir, new_cache)
+        logger.info("OK: {} files({} bytes) of {} are {}ed to {}".format(linked, linked_bytes, new_dir, method,
+                                                                        previous_dir))
+        return {'method': method, 'linked': linked, 'linked_bytes': linked_bytes}
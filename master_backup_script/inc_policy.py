@@ -0,0 +1,129 @@
+# Choosing base of the next incremental backup(inc_policy).
+#   chain      - always on top of the recent backup, restore applies every incremental backup.
+#   cumulative - always on top of full backup, restore applies only the newest incremental backup.
+#   cost       - on top of full backup or any incremental backup of the restore chain, whichever is
+#                cheapest in estimated backup time plus prepare time, keeping restore chain at most
+#                inc_max_chain deltas long. Rates are measured from history in backup catalog.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class IncrementalPolicy:
+
+    policies = ('chain', 'cumulative', 'cost')
+
+    # Used until there are enough measured backups and prepares in backup catalog
+    default_backup_rate = 100 * 1024 * 1024
+    default_prepare_rate = 100 * 1024 * 1024
+
+    def __init__(self, policy='chain', max_chain=3, history=()):
+        """
+        :param policy: chain, cumulative or cost
+        :param max_chain: Maximum number of incremental backups applied on restore, used by cost policy
+        :param history: Catalog rows of earlier OK incremental backups, for measuring rates
+        """
+        if policy not in self.policies:
+            logger.error("Unknown inc_policy {}, must be one of {}".format(policy, ', '.join(self.policies)))
+            raise RuntimeError("Unknown inc_policy {}".format(policy))
+        if max_chain < 1:
+            logger.error("inc_max_chain must be at least 1")
+            raise RuntimeError("inc_max_chain must be at least 1")
+        self.policy = policy
+        self.max_chain = max_chain
+        self.history = list(history)
+
+    def backup_rate(self):
+        # Bytes of incremental backup written per second
+        measured = [row for row in self.history if row['duration'] and row['size_bytes']]
+        duration = sum(row['duration'] for row in measured)
+        if not duration:
+            return self.default_backup_rate
+        return sum(row['size_bytes'] for row in measured) / duration
+
+    def prepare_model(self):
+        """
+        Method for fitting prepare time of incremental backup as overhead + size / rate,
+        by least squares over measured prepares.
+        Overhead(starting xtrabackup, redo scan) is what makes long chains slow to restore.
+        :return: Tuple of (overhead seconds, bytes per second)
+        """
+        measured = [(row['size_bytes'], row['prepare_duration']) for row in self.history
+                    if row['prepare_duration'] and row['size_bytes']]
+        if not measured:
+            return 0, self.default_prepare_rate
+        count = len(measured)
+        mean_size = sum(size for size, duration in measured) / count
+        mean_duration = sum(duration for size, duration in measured) / count
+        variance = sum((size - mean_size) ** 2 for size, duration in measured)
+        covariance = sum((size - mean_size) * (duration - mean_duration) for size, duration in measured)
+        if variance and covariance > 0:
+            seconds_per_byte = covariance / variance
+            overhead = max(mean_duration - seconds_per_byte * mean_size, 0)
+            return overhead, 1 / seconds_per_byte
+        # Every prepare had the same size or larger ones were not slower, use the average rate
+        return 0, mean_size / mean_duration
+
+    def bytes_per_lsn(self):
+        # Incremental backup size per LSN of redo, None if not measured yet
+        measured = [row for row in self.history if row['size_bytes'] and row['from_lsn'] is not None
+                    and row['to_lsn'] is not None and row['to_lsn'] > row['from_lsn']]
+        lsn_delta = sum(row['to_lsn'] - row['from_lsn'] for row in measured)
+        if not lsn_delta:
+            return None
+        return sum(row['size_bytes'] for row in measured) / lsn_delta
+
+    def estimates(self, full, chain, current_lsn=None):
+        """
+        Method for estimating cost of every possible base.
+        Size of incremental backup is estimated as sum of deltas of restore chain it replaces,
+        plus changes made since the newest backup.
+        :param full: Catalog row of full backup
+        :param chain: Catalog rows of restore chain in apply order
+        :param current_lsn: Server LSN, None if it can not be read
+        :return: List of dictionaries with base, chain_length, size, backup_time, prepare_time, cost
+        """
+        overhead, prepare_rate = self.prepare_model()
+        backup_rate = self.backup_rate()
+        bytes_per_lsn = self.bytes_per_lsn()
+        tip = chain[-1] if chain else full
+        new_bytes = 0
+        if current_lsn is not None and bytes_per_lsn is not None and tip['to_lsn'] is not None:
+            new_bytes = max(current_lsn - tip['to_lsn'], 0) * bytes_per_lsn
+
+        estimates = []
+        for position, base in enumerate([full] + list(chain)):
+            size = sum(row['size_bytes'] or 0 for row in chain[position:]) + new_bytes
+            prepare_time = sum(overhead + (row['size_bytes'] or 0) / prepare_rate for row in chain[:position]) + \
+                overhead + size / prepare_rate
+            backup_time = size / backup_rate
+            estimates.append({'base': base['name'],
+                              'chain_length': position + 1,
+                              'size': size,
+                              'backup_time': backup_time,
+                              'prepare_time': prepare_time,
+                              'cost': backup_time + prepare_time})
+        return estimates
+
+    def choose(self, full, chain, current_lsn=None):
+        """
+        Method for choosing base of the next incremental backup.
+        :param full: Catalog row of full backup
+        :param chain: Catalog rows of restore chain in apply order
+        :param current_lsn: Server LSN, None if it can not be read
+        :return: Base backup name
+        """
+        if self.policy == 'chain':
+            return chain[-1]['name'] if chain else full['name']
+        if self.policy == 'cumulative':
+            return full['name']
+
+        allowed = [i for i in self.estimates(full, chain, current_lsn) if i['chain_length'] <= self.max_chain]
+        # Cheapest first, on equal cost the newer base gives smaller backup
+        best = min(allowed, key=lambda i: (i['cost'], -i['chain_length']))
+        logger.info("Incremental backup based on {}: {} deltas to restore, estimated size {:.0f} bytes, "
+                    "backup {:.1f} seconds, prepare {:.1f} seconds".format(
+                        best['base'], best['chain_length'], best['size'], best['backup_time'],
+                        best['prepare_time']))
+        return best['base']
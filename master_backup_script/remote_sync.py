@@ -0,0 +1,263 @@
+# Remote replication of backup sets.
+# Only backup sets missing from remote manifest are shipped. Files are split into chunks sent by parallel streams,
+# finished chunks are recorded in manifest, so dropped transfer resumes where it stopped.
+# Every file is verified by sha256 on arrival before backup set is marked as complete.
+
+import os
+import json
+import time
+import shlex
+import hashlib
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join
+
+logger = logging.getLogger(__name__)
+
+
+def file_checksum(path, algorithm='sha256', buffer_size=4 * 1024 * 1024):
+    checksum = hashlib.new(algorithm)
+    with open(path, 'rb') as local_file:
+        for chunk in iter(lambda: local_file.read(buffer_size), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def read_range(local_path, offset, length, buffer_size=4 * 1024 * 1024):
+    # Generator for reading length bytes of file starting from offset
+    with open(local_path, 'rb') as local_file:
+        local_file.seek(offset)
+        while length > 0:
+            chunk = local_file.read(min(buffer_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+class LocalTransport:
+    """
+    Transport for directory on mounted filesystem(NFS and etc.), also used as stand-in for remote host in tests.
+    :param root: Directory where backup sets are stored
+    """
+
+    manifest_file = 'manifest.json'
+
+    def __init__(self, root):
+        self.root = root
+        self.name = root
+
+    def read_manifest(self):
+        path = join(self.root, self.manifest_file)
+        if not os.path.isfile(path):
+            return {}
+        with open(path, 'r') as manifest:
+            return json.load(manifest)
+
+    def write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        path = join(self.root, self.manifest_file)
+        with open(path + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def prepare_file(self, rel_path, size):
+        # Create file of final size, chunks are written into it at their offsets
+        path = join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as remote_file:
+            remote_file.truncate(size)
+
+    def write_range(self, local_path, rel_path, offset, length):
+        with open(join(self.root, rel_path), 'r+b') as remote_file:
+            remote_file.seek(offset)
+            for chunk in read_range(local_path, offset, length):
+                remote_file.write(chunk)
+
+    def checksum(self, rel_path):
+        return file_checksum(join(self.root, rel_path))
+
+
+class SshTransport(LocalTransport):
+    """
+    Transport for remote host over ssh. Needs coreutils(dd, truncate, sha256sum) on remote host.
+    :param remote_conn: For eg, root@xxx.xxx.xxx.xxx
+    :param root: Directory on remote host
+    """
+
+    def __init__(self, remote_conn, root):
+        LocalTransport.__init__(self, root)
+        self.remote_conn = remote_conn
+        self.name = '{}:{}'.format(remote_conn, root)
+
+    def ssh(self, command, stdin=None):
+        """
+        Method for running command on remote host.
+        :param stdin: Iterable of bytes written to stdin of the command
+        :return: stdout of command
+        :raise: ChildProcessError on error.
+        """
+        process = subprocess.Popen(['ssh', self.remote_conn, command], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if stdin is not None:
+            # stdout/stderr of these commands is tiny, so they can not block the writer
+            for chunk in stdin:
+                process.stdin.write(chunk)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise ChildProcessError("FAILED: ssh {} {}: {}".format(self.remote_conn, command,
+                                                                   error.decode('utf-8', 'replace').strip()))
+        return output.decode('utf-8')
+
+    def read_manifest(self):
+        output = self.ssh("cat {} 2>/dev/null || true".format(shlex.quote(join(self.root, self.manifest_file))))
+        return json.loads(output) if output.strip() else {}
+
+    def write_manifest(self, manifest):
+        path = shlex.quote(join(self.root, self.manifest_file))
+        data = json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8')
+        self.ssh("mkdir -p {} && cat > {}.tmp && mv {}.tmp {}".format(shlex.quote(self.root), path, path, path),
+                 stdin=[data])
+
+    def prepare_file(self, rel_path, size):
+        path = join(self.root, rel_path)
+        self.ssh("mkdir -p {} && touch {} && truncate -s {} {}".format(
+            shlex.quote(os.path.dirname(path)), shlex.quote(path), size, shlex.quote(path)))
+
+    def write_range(self, local_path, rel_path, offset, length):
+        self.ssh("dd of={} bs=4M seek={} oflag=seek_bytes conv=notrunc status=none".format(
+            shlex.quote(join(self.root, rel_path)), offset), stdin=read_range(local_path, offset, length))
+
+    def checksum(self, rel_path):
+        return self.ssh("sha256sum {}".format(shlex.quote(join(self.root, rel_path)))).split()[0]
+
+
+class RemoteSync:
+
+    def __init__(self, transport, backup_dir, threads=4, chunk_size=256 * 1024 * 1024, skip=()):
+        """
+        :param transport: LocalTransport or SshTransport
+        :param backup_dir: Local backup directory, containing full, inc and lsn directories
+        :param threads: Number of parallel transfer streams
+        :param chunk_size: Files are sent in chunks of this size, it is also the granularity of resume
+        :param skip: Backup names which must not be shipped(failed backups)
+        """
+        self.transport = transport
+        self.backup_dir = backup_dir
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.skip = set(skip)
+        self.lock = threading.Lock()
+        self.manifest = {}
+        self.manifest_written = 0
+
+    def backup_sets(self):
+        """
+        Method for listing local backup sets, full backups first.
+        :return: List of set names, for eg, ['full/2017-11-09_19-37-16', 'inc/2017-11-09_20-37-16']
+        """
+        sets = []
+        for backup_type in ('full', 'inc'):
+            type_dir = join(self.backup_dir, backup_type)
+            if os.path.isdir(type_dir):
+                sets.extend("{}/{}".format(backup_type, name) for name in sorted(os.listdir(type_dir))
+                            if name not in self.skip)
+        return sets
+
+    def set_files(self, backup_set):
+        """
+        Method for listing files of backup set: the backup itself and its LSN sidecar.
+        :return: Dictionary of relative path -> size
+        """
+        files = {}
+        name = backup_set.split('/')[1]
+        for top in (backup_set, 'lsn/{}'.format(name)):
+            for dirpath, dirnames, filenames in os.walk(join(self.backup_dir, top)):
+                for filename in filenames:
+                    path = join(dirpath, filename)
+                    files[os.path.relpath(path, self.backup_dir)] = os.path.getsize(path)
+        return files
+
+    def save_manifest(self, force=False):
+        # Manifest is written at most every 10 seconds while files are transferred, and always at the end of set
+        with self.lock:
+            if force or time.time() - self.manifest_written > 10:
+                self.transport.write_manifest(self.manifest)
+                self.manifest_written = time.time()
+
+    def transfer_chunk(self, entry, rel_path, offset, length):
+        self.transport.write_range(join(self.backup_dir, rel_path), rel_path, offset, length)
+        with self.lock:
+            entry['chunks'].append(offset)
+        self.save_manifest()
+
+    def transfer_file(self, executor, backup_set, rel_path, size):
+        """
+        Method for sending missing chunks of file and verifying it.
+        :return: True when file arrived with the same checksum.
+        :raise: RuntimeError if checksums differ.
+        """
+        local_path = join(self.backup_dir, rel_path)
+        with self.lock:
+            files = self.manifest['sets'][backup_set]['files']
+            entry = files.get(rel_path)
+            if entry is None or entry['size'] != size:
+                entry = files[rel_path] = {'size': size, 'chunks': [], 'sha256': None}
+        if entry['sha256'] is not None:
+            return True
+
+        checksum = executor.submit(file_checksum, local_path)
+        if not entry['chunks']:
+            self.transport.prepare_file(rel_path, size)
+        offsets = [offset for offset in range(0, size, self.chunk_size) if offset not in entry['chunks']]
+        if offsets and len(offsets) < len(range(0, size, self.chunk_size)):
+            logger.info("Resuming {} from {} chunks".format(rel_path, len(entry['chunks'])))
+        for future in [executor.submit(self.transfer_chunk, entry, rel_path, offset,
+                                       min(self.chunk_size, size - offset)) for offset in offsets]:
+            future.result()
+
+        if self.transport.checksum(rel_path) != checksum.result():
+            # Send the whole file again on next sync
+            with self.lock:
+                entry['chunks'] = []
+            self.save_manifest(force=True)
+            logger.error("FAILED: checksum of {} on {} does not match".format(rel_path, self.transport.name))
+            raise RuntimeError("FAILED: checksum of {} on {} does not match".format(rel_path, self.transport.name))
+        with self.lock:
+            entry['sha256'] = checksum.result()
+        return True
+
+    def sync(self):
+        """
+        Method for shipping all backup sets missing from remote.
+        :return: List of shipped backup sets.
+        :raise: RuntimeError or ChildProcessError on error, already shipped chunks are kept in manifest.
+        """
+        self.manifest = self.transport.read_manifest()
+        self.manifest.setdefault('sets', {})
+        shipped = []
+        # Files are sent by a pool, chunks and checksums by another one, so file tasks never wait for themselves
+        with ThreadPoolExecutor(max_workers=self.threads) as file_executor, \
+                ThreadPoolExecutor(max_workers=self.threads) as chunk_executor:
+            for backup_set in self.backup_sets():
+                state = self.manifest['sets'].setdefault(backup_set, {'complete': False, 'files': {}})
+                if state['complete']:
+                    continue
+                files = self.set_files(backup_set)
+                logger.info("Shipping {} ({} files, {} bytes) to {}".format(backup_set, len(files),
+                                                                             sum(files.values()),
+                                                                             self.transport.name))
+                try:
+                    for future in [file_executor.submit(self.transfer_file, chunk_executor, backup_set, rel_path,
+                                                        size) for rel_path, size in sorted(files.items())]:
+                        future.result()
+                finally:
+                    self.save_manifest(force=True)
+                state['complete'] = True
+                self.save_manifest(force=True)
+                shipped.append(backup_set)
+        logger.info("Remote {} is up to date, shipped: {}".format(self.transport.name,
+                                                                  ', '.join(shipped) if shipped else 'nothing'))
+        return shipped
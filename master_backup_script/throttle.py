@@ -0,0 +1,248 @@
+# Adaptive throttling of backups by live server health.
+# While backup runs, server is sampled every throttle_sample_interval: Threads_running, replication lag,
+# latency of InnoDB row operations(performance_schema table I/O waits) and latency of datadir device
+# (/proc/diskstats). Read rate of backup stream is halved while any of them is over its limit and raised
+# again while all are fine, so backup runs at full speed on idle server and backs off when production suffers.
+# Every throttled backup leaves impact report(throttle_report.json) in its LSN sidecar directory.
+
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+from datetime import datetime
+from process_runner.stream_pipeline import RatePacer
+
+logger = logging.getLogger(__name__)
+
+
+class DiskStats:
+    """
+    Latency of block device holding given path, read from /proc/diskstats.
+    :param path: For eg, datadir
+    :param diskstats: For tests
+    """
+
+    def __init__(self, path, diskstats='/proc/diskstats'):
+        self.diskstats = diskstats
+        try:
+            device = os.stat(path).st_dev
+            self.device = (os.major(device), os.minor(device))
+        except OSError:
+            self.device = None
+        self.last = None
+
+    def counters(self):
+        # Completed reads+writes and milliseconds spent on them, None if device is not listed(for eg, NFS)
+        if self.device is None:
+            return None
+        try:
+            with open(self.diskstats) as diskstats:
+                for line in diskstats:
+                    fields = line.split()
+                    if len(fields) >= 11 and (int(fields[0]), int(fields[1])) == self.device:
+                        return int(fields[3]) + int(fields[7]), int(fields[6]) + int(fields[10])
+        except OSError:
+            pass
+        return None
+
+    def latency(self):
+        """
+        Method for getting average latency of I/O completed since previous call.
+        :return: Seconds or None if unknown or no I/O completed
+        """
+        current = self.counters()
+        last, self.last = self.last, current
+        if current is None or last is None or current[0] <= last[0]:
+            return None
+        return (current[1] - last[1]) / (current[0] - last[0]) / 1000
+
+
+class ServerHealth:
+    """
+    Sampler of server health metrics, every one of them is None if it can not be read.
+    :param client_command: Function returning mysql client command executing given statement
+    :param datadir: Datadir of the server, for device latency
+    """
+
+    def __init__(self, client_command, datadir, diskstats='/proc/diskstats'):
+        self.client_command = client_command
+        self.disk = DiskStats(datadir, diskstats=diskstats)
+        self.last_row_ops = None
+
+    def query(self, statement):
+        status, output = subprocess.getstatusoutput(self.client_command(statement))
+        if status != 0:
+            logger.debug("Could not sample server health: {}".format(output))
+            return None
+        return output
+
+    def threads_running(self):
+        output = self.query("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+        if not output:
+            return None
+        fields = output.splitlines()[-1].split('\t')
+        return int(fields[1]) if len(fields) == 2 and fields[1].isdigit() else None
+
+    def replica_lag(self):
+        # None also if the server is not replica or replication is stopped
+        output = self.query("SHOW SLAVE STATUS\\G")
+        match = re.search(r'Seconds_Behind_(?:Master|Source):\s*(\d+)', output or '')
+        return int(match.group(1)) if match else None
+
+    def row_latency(self):
+        """
+        Method for getting average latency of InnoDB row operations since previous call.
+        :return: Seconds or None, for eg, if performance_schema is disabled
+        """
+        output = self.query("SELECT SUM(COUNT_STAR), SUM(SUM_TIMER_WAIT) "
+                            "FROM performance_schema.table_io_waits_summary_by_table "
+                            "WHERE OBJECT_SCHEMA NOT IN ('mysql', 'performance_schema', 'sys')")
+        current = None
+        if output:
+            fields = output.splitlines()[-1].split('\t')
+            if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                current = int(fields[0]), int(fields[1])
+        last, self.last_row_ops = self.last_row_ops, current
+        if current is None or last is None or current[0] <= last[0]:
+            return None
+        # Timers are in picoseconds
+        return (current[1] - last[1]) / (current[0] - last[0]) / 1e12
+
+    def sample(self):
+        return {'threads_running': self.threads_running(),
+                'replica_lag': self.replica_lag(),
+                'row_latency': self.row_latency(),
+                'disk_latency': self.disk.latency()}
+
+
+class AdaptiveThrottle:
+    """
+    Controller pacing backup stream by server health(additive increase, multiplicative decrease).
+    :param health: ServerHealth object
+    :param limits: Dictionary of metric name and its limit, latencies and lag in seconds
+    :param min_rate: Read rate is never limited below this, bytes per second
+    :param max_rate: Read rate while server is healthy, None for no limit
+    :param interval: Seconds between samples
+    """
+    metrics = ('threads_running', 'replica_lag', 'row_latency', 'disk_latency')
+
+    def __init__(self, health, limits, min_rate, max_rate=None, interval=5):
+        self.health = health
+        self.limits = limits
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.interval = interval
+        self.pacer = RatePacer(max_rate)
+        self.samples = []
+        self.backoffs = 0
+        self.throttled_time = 0.0
+        self.stopping = threading.Event()
+        self.thread = None
+        self.started = None
+        self.last_time = None
+        self.last_bytes = 0
+
+    def adjust(self, metrics, elapsed):
+        """
+        Method for setting new read rate by sampled metrics.
+        :param metrics: Dictionary returned by ServerHealth.sample()
+        :param elapsed: Seconds since previous sample
+        :return: New rate, None for no limit
+        """
+        throughput = (self.pacer.bytes - self.last_bytes) / elapsed if elapsed > 0 else 0
+        self.last_bytes = self.pacer.bytes
+        if self.pacer.rate is not None:
+            self.throttled_time += elapsed
+        over = sorted(name for name, limit in self.limits.items()
+                      if metrics.get(name) is not None and metrics[name] > limit)
+        rate = self.pacer.rate
+        if over:
+            new_rate = max((rate or max(throughput, self.min_rate)) / 2, self.min_rate)
+            if rate is None or new_rate < rate:
+                self.backoffs += 1
+        elif rate is None:
+            new_rate = None
+        elif self.max_rate is None and throughput < rate / 2:
+            # Backup is slower than the limit anyway
+            new_rate = None
+        else:
+            new_rate = rate + max(rate / 4, self.min_rate)
+            if self.max_rate is not None:
+                new_rate = min(new_rate, self.max_rate)
+
+        if new_rate != rate:
+            logger.info("Backup read rate {} -> {}{}".format(self.format_rate(rate), self.format_rate(new_rate),
+                                                              ", over limit: " + ', '.join(over) if over else ''))
+            self.pacer.set_rate(new_rate)
+        self.samples.append(dict(metrics, time=round(time.time() - self.started, 1) if self.started else None,
+                                 throughput=int(throughput), rate=new_rate, over=over))
+        return new_rate
+
+    @staticmethod
+    def format_rate(rate):
+        return 'unlimited' if rate is None else '{}B/s'.format(int(rate))
+
+    def sample_once(self):
+        now = time.monotonic()
+        elapsed, self.last_time = now - self.last_time, now
+        return self.adjust(self.health.sample(), elapsed)
+
+    def worker(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.sample_once()
+            except Exception as err:
+                # Sampling must never fail the backup
+                logger.warning("Server health sampling FAILED: {}".format(err))
+
+    def start(self):
+        self.started = time.time()
+        self.last_time = time.monotonic()
+        # Baseline of counters, latencies are measured between samples
+        self.health.sample()
+        self.thread = threading.Thread(target=self.worker, name='adaptive-throttle')
+        self.thread.start()
+        return True
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        return True
+
+    def report(self, path=None):
+        """
+        Method for summarizing impact of backup on the server.
+        :param path: JSON file the report is written to, if given
+        :return: Dictionary of report
+        """
+        finished = time.time()
+        metrics = {}
+        for name in self.metrics:
+            values = [sample[name] for sample in self.samples if sample.get(name) is not None]
+            metrics[name] = {'max': max(values) if values else None,
+                             'avg': sum(values) / len(values) if values else None,
+                             'limit': self.limits.get(name),
+                             'samples_over_limit': sum(1 for sample in self.samples if name in sample['over'])}
+        report = {'started': datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+                  'finished': datetime.fromtimestamp(finished).isoformat(),
+                  'duration': round(finished - self.started, 1) if self.started else None,
+                  'bytes': self.pacer.bytes,
+                  'min_rate': self.min_rate,
+                  'max_rate': self.max_rate,
+                  'backoffs': self.backoffs,
+                  'throttled_time': round(self.throttled_time, 1),
+                  'paused_time': round(self.pacer.paused, 1),
+                  'metrics': metrics,
+                  'samples': self.samples}
+        logger.info("Backup impact: {} samples, {} back-offs, throttled for {} seconds, peak {}".format(
+            len(self.samples), self.backoffs, report['throttled_time'],
+            ', '.join('{}={}'.format(name, value['max']) for name, value in metrics.items()
+                      if value['max'] is not None) or 'unknown'))
+        if path is not None:
+            with open(path, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        return report
@@ -3,8 +3,12 @@ import shutil
 import subprocess
 from general_conf.generalops import GeneralClass
 import re
+import tempfile
+from backup_archive.archive import ArchiveEngine
+from backup_archive.dedup import DedupStore
 from general_conf import check_env
 from general_conf import path_config
+from process_runner.cgroup import CgroupEnvelope
 
 import logging
 logger = logging.getLogger(__name__)
@@ -256,6 +260,42 @@ class PartialRecovery(GeneralClass):
             raise RuntimeError("Sorry, There is no such Database or Table in backup directory "
                                "Or maybe table storage engine is not InnoDB ")
 
+    def get_table_ibd_file_from_archive(self, database_name, table_name):
+        """
+            Locate table in indexed archives or deduplicated store of archive_dir, newest archive first.
+             Only .ibd and .frm files of table are extracted, into temporary directory inside archive_dir.
+             Archives should be prepared(prepare_archive) for the table to be importable.
+        :param database_name: Specified database name
+        :param table_name: Specified table name
+        :return .ibd file full path of extracted table
+        """
+        if self.archive_backend == 'dedup':
+            store = DedupStore(self.archive_dir)
+            archives = [(i, store) for i in reversed(store.archives())]
+        elif os.path.isdir(self.archive_dir):
+            archives = [(os.path.join(self.archive_dir, i), ArchiveEngine)
+                        for i in sorted(os.listdir(self.archive_dir), reverse=True)
+                        if os.path.isfile(os.path.join(self.archive_dir, i + ArchiveEngine.index_suffix))]
+        else:
+            archives = []
+        full_dir = self.full_dir.strip('/') + '/'
+        table_files = ('/{}/{}.ibd'.format(database_name, table_name), '/{}/{}.frm'.format(database_name, table_name))
+
+        for archive, reader in archives:
+            # Indexed tar archives and deduplicated store have the same find_members() and extract()
+            members = reader.find_members(
+                archive, lambda name: name.startswith(full_dir) and name.endswith(table_files))
+            ibd_members = [i for i in members if i.endswith('.ibd')]
+            if not ibd_members:
+                continue
+            logger.info("Found {} in archive {}".format(ibd_members[0], archive))
+            target_dir = tempfile.mkdtemp(prefix='partial_', dir=self.archive_dir)
+            reader.extract(archive, members, target_dir, envelope=CgroupEnvelope.from_config(self))
+            return os.path.join(target_dir, ibd_members[0])
+
+        logger.error("Sorry, There is no such Database or Table in archives")
+        raise RuntimeError("Sorry, There is no such Database or Table in archives")
+
     def lock_table(self, database_name, table_name):
         # Executing lock tables write on specified table
         statement = "LOCK TABLES %s.%s WRITE" % (database_name, table_name)
@@ -343,9 +383,17 @@ class PartialRecovery(GeneralClass):
         database_name = input("Type Database name: ")
         # Type name of table which you want to restore
         table_name = input("Type Table name: ")
-        path = self.get_table_ibd_file(
-            database_name=database_name,
-            table_name=table_name)
+        try:
+            path = self.get_table_ibd_file(
+                database_name=database_name,
+                table_name=table_name)
+        except (RuntimeError, OSError):
+            if not hasattr(self, 'archive_dir'):
+                raise
+            logger.info("Looking for table in archives")
+            path = self.get_table_ibd_file_from_archive(
+                database_name=database_name,
+                table_name=table_name)
         path_to_mysql_datadir = self.datadir + "/" + database_name
 
         if path:
@@ -377,3 +425,8 @@ class PartialRecovery(GeneralClass):
             else:
                 logger.info("OK: Table Recovered! ...")
                 return True
+            finally:
+                if hasattr(self, 'archive_dir') and path.startswith(os.path.join(self.archive_dir, 'partial_')):
+                    # Remove table files extracted from archive
+                    extract_dir = os.path.relpath(path, self.archive_dir).split(os.sep)[0]
+                    shutil.rmtree(os.path.join(self.archive_dir, extract_dir), ignore_errors=True)
@@ -0,0 +1,267 @@
+# cgroup v2 resource envelopes of spawned processes.
+# Every xtrabackup, xbstream, tar, etc. process started by ProcessHandler joins its own cgroup
+# under cgroup_dir before exec, with cpu.max, memory.high and io.max of datadir and backup_dir devices from [Cgroup] section,
+# so backup and prepare do not compete with mysqld for CPU and block I/O.
+# Limits follow the config file while the process runs: edit [Cgroup] and they are applied within a second.
+# Effect(CPU throttling, memory.high events, peak memory, I/O) is recorded in xtrabackup history log.
+
+import os
+import time
+import logging
+import humanfriendly
+from os.path import join, exists, realpath
+from general_conf.generalops import GeneralClass
+
+logger = logging.getLogger(__name__)
+
+
+class CgroupEnvelope:
+    """
+    cgroup of one spawned process.
+    :param parent: Delegated cgroup v2 directory, for eg, /sys/fs/cgroup/autoxtrabackup.slice
+    :param limits: Dictionary of cgroup file and value, io.max value is dictionary of device and its limits
+    :param config: Config file the limits are read from, they are reloaded when it changes
+    """
+
+    controllers = {'cpu.max': 'cpu', 'memory.high': 'memory', 'io.max': 'io'}
+    io_keys = ('rbps', 'wbps', 'riops', 'wiops')
+
+    def __init__(self, parent, limits, config=None):
+        self.parent = parent
+        self.limits = {}
+        self.pending = limits
+        self.config = config
+        self.config_mtime = os.stat(config).st_mtime if config else None
+        self.path = None
+        self.procs = None
+        self.created = None
+        self.changes = []
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: GeneralClass object
+        :return: CgroupEnvelope object or None if cgroup_dir is not configured
+        """
+        if not hasattr(config, 'cgroup_dir'):
+            return None
+        return cls(config.cgroup_dir, cls.limits_from_config(config), config=config.conf)
+
+    @classmethod
+    def limits_from_config(cls, config):
+        limits = {}
+        if hasattr(config, 'cgroup_cpu_max'):
+            limits['cpu.max'] = cls.cpu_max(config.cgroup_cpu_max)
+        if hasattr(config, 'cgroup_memory_high'):
+            limits['memory.high'] = config.cgroup_memory_high
+        io_max = {}
+        for path, option in ((config.datadir, 'cgroup_datadir_io_max'), (config.backupdir, 'cgroup_backup_io_max')):
+            if not hasattr(config, option):
+                continue
+            device = cls.block_device(path)
+            if device is None:
+                logger.warning("{} is not on block device, {} is not applied".format(path, option))
+                continue
+            # Datadir and backup_dir on the same device get the stricter limit
+            device_limits = io_max.setdefault(device, {})
+            for key, value in cls.io_limits(getattr(config, option)).items():
+                device_limits[key] = cls.stricter(device_limits.get(key), value)
+        if io_max:
+            limits['io.max'] = io_max
+        return limits
+
+    @staticmethod
+    def cpu_max(value):
+        # Number of CPUs, for eg, 1.5, or cpu.max format: "$MAX $PERIOD"
+        try:
+            return "{} 100000".format(int(float(value) * 100000))
+        except ValueError:
+            return value
+
+    @staticmethod
+    def stricter(limit, other):
+        if limit is None or limit == 'max':
+            return other
+        if other == 'max':
+            return limit
+        return str(min(int(limit), int(other)))
+
+    @classmethod
+    def io_limits(cls, value):
+        # rbps=200MiB wiops=1000 -> {'rbps': '209715200', 'wiops': '1000'}
+        limits = {}
+        for item in value.split():
+            key, _, limit = item.partition('=')
+            if key not in cls.io_keys or not limit:
+                logger.error("Invalid io.max limit {}, expected one of {} with value".format(item, cls.io_keys))
+                raise RuntimeError("Invalid io.max limit {}, expected one of {} with value".format(item, cls.io_keys))
+            if limit != 'max' and key.endswith('bps'):
+                limit = str(humanfriendly.parse_size(limit))
+            limits[key] = limit
+        return limits
+
+    @staticmethod
+    def block_device(path, sys_block='/sys/dev/block'):
+        """
+        Method for finding disk holding given path, io.max accepts whole disks only.
+        :return: MAJ:MIN or None if path is not on block device(for eg, tmpfs)
+        """
+        try:
+            device = os.stat(path).st_dev
+        except OSError:
+            return None
+        device = "{}:{}".format(os.major(device), os.minor(device))
+        sysfs = join(sys_block, device)
+        if not exists(sysfs):
+            return None
+        if exists(join(sysfs, 'partition')):
+            with open(join(realpath(sysfs), '..', 'dev')) as dev:
+                device = dev.read().strip()
+        return device
+
+    def write(self, name, value):
+        with open(join(self.path, name), 'w') as cgroup_file:
+            cgroup_file.write(value)
+
+    def read(self, name):
+        try:
+            with open(join(self.path, name)) as cgroup_file:
+                return cgroup_file.read()
+        except OSError:
+            return None
+
+    def create(self, name):
+        """
+        Method for creating cgroup with configured limits, controllers are enabled in parent if needed.
+        :param name: Name of cgroup directory, for eg, xtrabackup-12345
+        :return: Path of cgroup
+        :raise: RuntimeError if cgroup can not be created
+        """
+        try:
+            os.makedirs(self.parent, exist_ok=True)
+            subtree = join(self.parent, 'cgroup.subtree_control')
+            enabled = []
+            if exists(subtree):
+                with open(subtree) as subtree_control:
+                    enabled = subtree_control.read().split()
+            for controller in sorted(set(self.controllers[limit] for limit in self.pending)):
+                if controller not in enabled:
+                    with open(subtree, 'w') as subtree_control:
+                        subtree_control.write('+' + controller)
+            self.path = join(self.parent, name)
+            os.mkdir(self.path)
+            # Opened by parent, so joining processes only write their pid into it, see joiner()
+            self.procs = os.open(join(self.path, 'cgroup.procs'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            self.created = time.time()
+            self.apply(self.pending)
+        except OSError as err:
+            logger.error("FAILED: Creating cgroup {} in {}: {}".format(name, self.parent, err))
+            raise RuntimeError("FAILED: Creating cgroup {} in {}: {}".format(name, self.parent, err))
+        return self.path
+
+    def joiner(self):
+        """
+        Method for joining the cgroup from spawned process, between fork and exec.
+        Passed as preexec_fn to Popen, so no part of the process runs outside of the limits.
+        The child only writes its pid to cgroup.procs opened by create(), which is safe with threads.
+        :return: Function for preexec_fn
+        """
+        procs = self.procs
+
+        def join_cgroup():
+            os.write(procs, str(os.getpid()).encode())
+        return join_cgroup
+
+    def apply(self, limits):
+        """
+        Method for changing limits of the cgroup, limits missing from given ones are reset to max.
+        :param limits: Dictionary in the same format as limits_from_config()
+        :return: List of changed cgroup files
+        """
+        changed = []
+        for name in sorted(set(self.limits) | set(limits)):
+            old, new = self.limits.get(name), limits.get(name)
+            if old == new:
+                continue
+            if name == 'io.max':
+                old, new = old or {}, new or {}
+                for device in sorted(set(old) | set(new)):
+                    if old.get(device) == new.get(device):
+                        continue
+                    device_limits = dict((key, 'max') for key in old.get(device, {}))
+                    device_limits.update(new.get(device, {}))
+                    self.write(name, ' '.join([device] + ['{}={}'.format(key, value)
+                                                          for key, value in sorted(device_limits.items())]))
+            else:
+                self.write(name, new if new is not None else 'max')
+            changed.append(name)
+            self.changes.append({'time': round(time.time() - self.created, 1), 'file': name, 'value': new})
+            logger.info("cgroup {}: {} = {}".format(os.path.basename(self.path), name, new))
+        self.limits = dict(limits)
+        return changed
+
+    def reload_if_changed(self):
+        """
+        Method for applying limits of modified config file to running process.
+        Config which can not be read is ignored, current limits are kept.
+        :return: List of changed cgroup files
+        """
+        if self.config is None:
+            return []
+        try:
+            mtime = os.stat(self.config).st_mtime
+            if mtime == self.config_mtime:
+                return []
+            self.config_mtime = mtime
+            config = GeneralClass(self.config)
+            limits = self.limits_from_config(config) if hasattr(config, 'cgroup_dir') else {}
+            return self.apply(limits)
+        except Exception as err:
+            logger.warning("Could not apply changed cgroup limits of {}: {}".format(self.config, err))
+            return []
+
+    def stats(self):
+        """
+        Method for reading effect of the limits, call it before remove().
+        :return: Dictionary of counters, None where the controller is not available
+        """
+        stats = {'cpu_usage': None, 'cpu_throttled': None, 'nr_throttled': None, 'memory_peak': None,
+                 'memory_high_events': None, 'read_bytes': None, 'written_bytes': None}
+        fields = dict(line.split() for line in (self.read('cpu.stat') or '').splitlines() if len(line.split()) == 2)
+        if 'usage_usec' in fields:
+            stats['cpu_usage'] = int(fields['usage_usec']) / 1e6
+        if 'throttled_usec' in fields:
+            stats['cpu_throttled'] = int(fields['throttled_usec']) / 1e6
+            stats['nr_throttled'] = int(fields['nr_throttled'])
+        # memory.peak is available since Linux 5.19
+        peak = self.read('memory.peak') or self.read('memory.current')
+        if peak and peak.strip().isdigit():
+            stats['memory_peak'] = int(peak)
+        fields = dict(line.split() for line in (self.read('memory.events') or '').splitlines()
+                      if len(line.split()) == 2)
+        if 'high' in fields:
+            stats['memory_high_events'] = int(fields['high'])
+        io_stat = self.read('io.stat')
+        if io_stat is not None:
+            stats['read_bytes'] = stats['written_bytes'] = 0
+            for line in io_stat.splitlines():
+                fields = dict(item.split('=') for item in line.split()[1:] if '=' in item)
+                stats['read_bytes'] += int(fields.get('rbytes', 0))
+                stats['written_bytes'] += int(fields.get('wbytes', 0))
+        return stats
+
+    def summary(self):
+        # Limits, their changes and effect, for xtrabackup history log
+        return dict(self.stats(), limits=self.limits, changes=self.changes)
+
+    def remove(self):
+        # cgroup can be removed only after the process exited
+        if self.procs is not None:
+            os.close(self.procs)
+            self.procs = None
+        try:
+            os.rmdir(self.path)
+        except OSError as err:
+            logger.warning("Could not remove cgroup {}: {}".format(self.path, err))
+            return False
+        return True
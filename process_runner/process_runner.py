@@ -1,13 +1,18 @@
 import datetime
+import itertools
 import logging
+import os
 import re
 import subprocess
 import shlex
+import threading
 
 from subprocess import PIPE, STDOUT
 
 from general_conf.generalops import GeneralClass
 from general_conf import path_config
+from process_runner.stream_pipeline import StreamPipeline
+from process_runner.cgroup import CgroupEnvelope
 
 
 logger = logging.getLogger(__name__)
@@ -19,16 +24,20 @@ class ProcessHandler(GeneralClass):
 
     centralizes logic for subprocess calls, and is available to all other classes (Prepare, Backup, etc)
     """
+    # Numbers cgroups of this process, processes join their cgroup before their pid is known
+    cgroup_ids = itertools.count(1)
+
     def __init__(self, config=path_config.config_path_file):
         self.conf = config
         GeneralClass.__init__(self, self.conf)
-        self._xtrabackup_history_log = [['command', 'xtrabackup_function', 'start time', 'end time', 'duration', 'exit code']]
+        self._xtrabackup_history_log = [['command', 'xtrabackup_function', 'start time', 'end time', 'duration',
+                                         'exit code', 'cgroup']]
 
     @property
     def xtrabackup_history_log(self):
         return self._xtrabackup_history_log
 
-    def run_command(self, command):
+    def run_command(self, command, envelope=None, stdin=None):
         """
         executes a prepared command, enables real-time console & log output.
 
@@ -36,24 +45,42 @@ class ProcessHandler(GeneralClass):
 
         :param command: bash command to be executed
         :type command: str
+        :param envelope: CgroupEnvelope the process is run in, see cgroup.py, None for no limits
+        :param stdin: path of file the command reads from, instead of shell redirect(for eg, xbstream -x)
         :return: True if success, False if failure
         :rtype: bool
         """
         # filter out password from argument list, print command to execute
 
         filtered_command = re.sub("--password='?\w+'?", "--password='*'", command)
-        logger.info("SUBPROCESS STARTING: {}".format(filtered_command))
+        logger.info("SUBPROCESS STARTING: {}{}".format(filtered_command, ' < {}'.format(stdin) if stdin else ''))
         subprocess_args = self.command_to_args(command_str=command)
         # start the command subprocess
         cmd_start = datetime.datetime.now()
-        with subprocess.Popen(subprocess_args, stdout=PIPE, stderr=STDOUT) as process:
-            for line in process.stdout:
-                logger.debug("[{}:{}] {}".format(subprocess_args[0], process.pid, line.decode("utf-8").strip("\n")))
-        logger.info("SUBPROCESS {} COMPLETED with exit code: {}".format(subprocess_args[0], process.returncode))
-        cmd_end = datetime.datetime.now()
-        self.summarize_process(subprocess_args, cmd_start, cmd_end, process.returncode)
+        watcher, join_cgroup = self.enter_envelope(envelope, subprocess_args)
+        return_code = None
+        try:
+            input_file = open(stdin, 'rb') if stdin else None
+            try:
+                process = self.start_process(subprocess_args, join_cgroup, stdin=input_file, stdout=PIPE,
+                                             stderr=STDOUT)
+            finally:
+                if input_file is not None:
+                    # The process has its own copy of the descriptor
+                    input_file.close()
+            with process:
+                for line in process.stdout:
+                    logger.debug("[{}:{}] {}".format(subprocess_args[0], process.pid,
+                                                     line.decode("utf-8").strip("\n")))
+            return_code = process.returncode
+            logger.info("SUBPROCESS {} COMPLETED with exit code: {}".format(subprocess_args[0], return_code))
+        finally:
+            # Also when the process could not be started or reading its output failed, cgroup is not left behind
+            cmd_end = datetime.datetime.now()
+            self.summarize_process(subprocess_args, cmd_start, cmd_end, return_code,
+                                   self.leave_envelope(envelope, watcher))
         # return True or False.
-        if process.returncode == 0:
+        if return_code == 0:
             return True
         else:
             # todo: optionally raise error instead of return false
@@ -61,6 +88,121 @@ class ProcessHandler(GeneralClass):
             raise ChildProcessError("SUBPROCESS FAILED! >> {}".format(filtered_command))
             return False
 
+    def run_streaming_command(self, command, sinks, pacer=None, envelope=None):
+        """
+        executes a command which writes backup stream to stdout (xtrabackup --stream), the stream is
+        written to all given sinks in one pass. stderr is logged in real-time as with run_command().
+
+        :param command: bash command to be executed, without output redirect
+        :type command: str
+        :param sinks: list of StreamSink objects, see stream_pipeline.py
+        :param pacer: RatePacer object limiting read rate of the stream, None for no limit
+        :param envelope: CgroupEnvelope the process is run in, see cgroup.py, None for no limits
+        :return: True if success
+        :rtype: bool
+        """
+        filtered_command = re.sub("--password='?\w+'?", "--password='*'", command)
+        logger.info("SUBPROCESS STARTING: {} | {}".format(filtered_command, ', '.join(sink.name for sink in sinks)))
+        subprocess_args = self.command_to_args(command_str=command)
+        cmd_start = datetime.datetime.now()
+        watcher, join_cgroup = self.enter_envelope(envelope, subprocess_args)
+        try:
+            process = self.start_process(subprocess_args, join_cgroup, stdout=PIPE, stderr=PIPE)
+        except (OSError, RuntimeError):
+            self.leave_envelope(envelope, watcher)
+            raise
+        with process:
+
+            def log_stderr():
+                for line in process.stderr:
+                    logger.debug("[{}:{}] {}".format(subprocess_args[0], process.pid,
+                                                     line.decode("utf-8").strip("\n")))
+            stderr_logger = threading.Thread(target=log_stderr, name='stderr-{}'.format(process.pid))
+            stderr_logger.start()
+            try:
+                StreamPipeline(sinks, pacer=pacer).run(process.stdout)
+            except RuntimeError:
+                # Sink failed, there is no reason to continue backup
+                process.kill()
+                raise
+            finally:
+                process.wait()
+                stderr_logger.join()
+                cmd_end = datetime.datetime.now()
+                logger.info("SUBPROCESS {} COMPLETED with exit code: {}".format(subprocess_args[0],
+                                                                                process.returncode))
+                self.summarize_process(subprocess_args, cmd_start, cmd_end, process.returncode,
+                                       self.leave_envelope(envelope, watcher))
+        if process.returncode == 0:
+            return True
+        else:
+            raise ChildProcessError("SUBPROCESS FAILED! >> {}".format(filtered_command))
+
+    @staticmethod
+    def enter_envelope(envelope, args):
+        """
+        Method for creating cgroup of process about to start, the process joins it between fork and exec.
+        Limits follow changes of config file, checked every second while the process runs.
+
+        :return: Tuple of (watcher, preexec_fn for Popen), (None, None) without envelope
+        :raise: RuntimeError if cgroup can not be created
+        """
+        if envelope is None:
+            return None, None
+        watcher = ProcessHandler.open_envelope(envelope, '{}-{}-{}'.format(args[0].split("/")[-1], os.getpid(),
+                                                                           next(ProcessHandler.cgroup_ids)))
+        return watcher, envelope.joiner()
+
+    @staticmethod
+    def start_process(args, join_cgroup=None, **popen_args):
+        """
+        Method for starting process, joined to cgroup before it executes the command.
+
+        :param join_cgroup: preexec_fn returned by enter_envelope() or CgroupEnvelope.joiner(), None for no cgroup
+        :return: Popen object
+        :raise: RuntimeError if the process could not join cgroup
+        """
+        try:
+            return subprocess.Popen(args, preexec_fn=join_cgroup, **popen_args)
+        except subprocess.SubprocessError as err:
+            # Raised by Popen only if preexec_fn failed in the child
+            logger.error("FAILED: Moving {} into cgroup: {}".format(args[0], err))
+            raise RuntimeError("FAILED: Moving {} into cgroup: {}".format(args[0], err))
+
+    @staticmethod
+    def open_envelope(envelope, name):
+        """
+        Method for creating cgroup, processes join it with preexec_fn=envelope.joiner().
+        Used directly where one cgroup holds several processes, for eg, compressor of every archive frame.
+
+        :param name: Name of cgroup directory
+        :return: Event and thread watching config file, None without envelope
+        :raise: RuntimeError if cgroup can not be created
+        """
+        if envelope is None:
+            return None
+        envelope.create(name)
+        stopping = threading.Event()
+
+        def watch():
+            while not stopping.wait(1):
+                envelope.reload_if_changed()
+        watcher = threading.Thread(target=watch, name='cgroup-{}'.format(name))
+        watcher.start()
+        return stopping, watcher
+
+    @staticmethod
+    def leave_envelope(envelope, watcher):
+        # Limits, their changes and effect for history log, cgroup is removed
+        if envelope is None:
+            return None
+        stopping, thread = watcher
+        stopping.set()
+        thread.join()
+        summary = envelope.summary()
+        envelope.remove()
+        return summary
+
     @staticmethod
     def command_to_args(command_str):
         """
@@ -104,7 +246,7 @@ class ProcessHandler(GeneralClass):
         else:
             return '%ds' % (seconds,)
 
-    def summarize_process(self, args, cmd_start, cmd_end, return_code):
+    def summarize_process(self, args, cmd_start, cmd_end, return_code, cgroup=None):
         cmd_root = args[0].split("/")[-1:][0]
         xtrabackup_function = None
         if cmd_root == "xtrabackup":
@@ -121,14 +263,15 @@ class ProcessHandler(GeneralClass):
                 elif re.search(r'(--decompress)=?[\w]*', arg):
                     xtrabackup_function = "decompress"
 
-        if cmd_root != "pigz":
+        if cmd_root != "pigz" or "--version" not in args:
             # this will be just the pigz --version call
             self._xtrabackup_history_log.append([cmd_root,
                                                  xtrabackup_function,
                                                  cmd_start.strftime('%Y-%m-%d %H:%M:%S'),
                                                  cmd_end.strftime('%Y-%m-%d %H:%M:%S'),
                                                  self.represent_duration(cmd_start, cmd_end),
-                                                 return_code])
+                                                 return_code,
+                                                 cgroup])
         return True
 
 
@@ -0,0 +1,248 @@
+# Streaming backup pipeline.
+# Reads xtrabackup --stream output once, in large buffers, and fans it out to several sinks at the same time:
+# local file, remote host over ssh, object store upload command, checksum.
+# Every sink has its own bounded queue, so the slowest sink throttles reading(backpressure)
+# instead of buffering the whole backup in memory.
+# Optional RatePacer limits the read rate, xtrabackup blocks on full stdout pipe and slows down reading datadir.
+
+import os
+import time
+import queue
+import hashlib
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+class StreamSink:
+    """
+    Base class of stream sinks. open() and close() are called from the sink thread, as well as write().
+    """
+    name = 'sink'
+
+    def open(self):
+        pass
+
+    def write(self, chunk):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def abort(self):
+        # Called instead of close() if pipeline failed
+        self.close()
+
+
+class FileSink(StreamSink):
+
+    def __init__(self, path):
+        self.path = path
+        self.name = 'file:{}'.format(path)
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, 'wb')
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class HashSink(StreamSink):
+    """
+    Sink for calculating checksum of stream.
+    With path given, checksum is written in sha256sum format, so it can be checked with 'sha256sum -c'.
+    """
+
+    def __init__(self, path=None, file_name=None, algorithm='sha256'):
+        self.path = path
+        self.file_name = file_name
+        self.algorithm = algorithm
+        self.name = algorithm
+        self.hash = hashlib.new(algorithm)
+        self.hexdigest = None
+
+    def write(self, chunk):
+        self.hash.update(chunk)
+
+    def close(self):
+        self.hexdigest = self.hash.hexdigest()
+        if self.path is not None:
+            with open(self.path, 'w') as hash_file:
+                hash_file.write("{}  {}\n".format(self.hexdigest, self.file_name))
+
+    def abort(self):
+        pass
+
+
+class CommandSink(StreamSink):
+    """
+    Sink for piping stream into stdin of command, for eg, object store upload: aws s3 cp - s3://bucket/key
+    :param command: List of arguments
+    """
+
+    def __init__(self, command, name=None):
+        self.command = command
+        self.name = name if name is not None else 'command:{}'.format(command[0])
+        self.process = None
+
+    def open(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        # Drain output, so command never blocks on full stdout pipe
+        self.output = []
+        self.reader = threading.Thread(target=lambda: self.output.extend(self.process.stdout),
+                                       name='{}-output'.format(self.name))
+        self.reader.start()
+
+    def write(self, chunk):
+        self.process.stdin.write(chunk)
+
+    def close(self):
+        self.process.stdin.close()
+        returncode = self.process.wait()
+        self.reader.join()
+        for line in self.output:
+            logger.debug("[{}] {}".format(self.name, line.decode("utf-8", "replace").rstrip("\n")))
+        if returncode != 0:
+            raise ChildProcessError("Stream sink {} FAILED with exit code {}".format(self.name, returncode))
+
+    def abort(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.reader.join()
+
+
+class RemoteSink(CommandSink):
+    """
+    Sink for writing stream to file on remote host over ssh.
+    :param remote_conn: For eg, root@192.168.1.10
+    :param remote_path: Full path of file on remote host
+    """
+
+    def __init__(self, remote_conn, remote_path):
+        remote_command = "mkdir -p '{}' && cat > '{}'".format(os.path.dirname(remote_path), remote_path)
+        CommandSink.__init__(self, ['ssh', remote_conn, remote_command],
+                             name='remote:{}:{}'.format(remote_conn, remote_path))
+
+
+class RatePacer:
+    """
+    Read rate limit of stream pipeline, it can be changed from another thread while streaming.
+    :param rate: Bytes per second, None for no limit
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self.bytes = 0
+        self.paused = 0.0
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def set_rate(self, rate):
+        # New rate is counted from now, bytes read under previous rate are not paid back
+        with self.lock:
+            self.rate = rate
+            self.window_start = time.monotonic()
+            self.window_bytes = 0
+
+    def pace(self, nbytes):
+        """
+        Method called by reader after every chunk, sleeps as long as reading is ahead of the rate.
+        :param nbytes: Size of chunk
+        :return: Seconds slept
+        """
+        with self.lock:
+            self.bytes += nbytes
+            self.window_bytes += nbytes
+            if not self.rate:
+                return 0
+            delay = self.window_start + self.window_bytes / self.rate - time.monotonic()
+        if delay <= 0:
+            return 0
+        time.sleep(delay)
+        with self.lock:
+            self.paused += delay
+        return delay
+
+
+class StreamPipeline:
+
+    def __init__(self, sinks, buffer_size=4 * 1024 * 1024, queue_size=8, pacer=None):
+        """
+        :param sinks: List of StreamSink objects
+        :param buffer_size: Size of chunks read from stream
+        :param queue_size: Number of chunks every sink may lag behind the reader
+        :param pacer: RatePacer object limiting read rate, None for no limit
+        """
+        self.sinks = sinks
+        self.buffer_size = buffer_size
+        self.queue_size = queue_size
+        self.pacer = pacer
+        self.errors = []
+        self.bytes = 0
+
+    def sink_worker(self, sink, chunks):
+        finished = False
+        try:
+            sink.open()
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    finished = True
+                    break
+                sink.write(chunk)
+            sink.close()
+        except Exception as err:
+            logger.error("Stream sink {} FAILED: {}".format(sink.name, err))
+            self.errors.append((sink.name, err))
+            try:
+                sink.abort()
+            except Exception:
+                pass
+            # Keep consuming, so the reader is never blocked by failed sink
+            while not finished and chunks.get() is not None:
+                pass
+
+    def run(self, source):
+        """
+        Method for reading source until EOF and writing every chunk to all sinks.
+        :param source: Binary file object, for eg, stdout of xtrabackup process
+        :return: Number of bytes streamed.
+        :raise: RuntimeError if any of the sinks failed.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for sink in self.sinks]
+        workers = [threading.Thread(target=self.sink_worker, args=(sink, chunks), name='stream-{}'.format(sink.name))
+                   for sink, chunks in zip(self.sinks, queues)]
+        for worker in workers:
+            worker.start()
+        try:
+            while not self.errors:
+                chunk = source.read(self.buffer_size)
+                if not chunk:
+                    break
+                self.bytes += len(chunk)
+                for chunks in queues:
+                    # Blocks while the sink is queue_size chunks behind
+                    chunks.put(chunk)
+                if self.pacer is not None:
+                    self.pacer.pace(len(chunk))
+        finally:
+            for chunks in queues:
+                chunks.put(None)
+            for worker in workers:
+                worker.join()
+
+        if self.errors:
+            raise RuntimeError("Streaming FAILED: {}".format(
+                '; '.join("{}: {}".format(name, err) for name, err in self.errors)))
+        logger.info("Streamed {} bytes to {}".format(self.bytes, ', '.join(sink.name for sink in self.sinks)))
+        return self.bytes
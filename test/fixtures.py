@@ -0,0 +1,68 @@
+# Config template and factories shared by PyTest files of backup, archiving and scheduling tests
+from py.path import local
+from master_backup_script.backuper import Backup
+from backup_scheduler.redo_scheduler import RedoScheduler
+from backup_scheduler.daemon import BackupDaemon
+
+CONFIG = """
+[MySQL]
+mysql = /usr/bin/mysql
+mycnf =
+mysqladmin = /usr/bin/mysqladmin
+mysql_user = root
+mysql_password =
+datadir = /var/lib/mysql
+
+[Logging]
+log = DEBUG
+
+[Backup]
+tmp_dir = {tmpdir}/tmp
+backup_dir = {tmpdir}/backup_dir
+backup_tool = /usr/bin/xtrabackup
+xtra_prepare = --apply-log-only
+{backup_options}
+
+[Compress]
+
+[Encrypt]
+
+[Xbstream]
+
+[Commands]
+start_mysql_command = true
+stop_mysql_command = true
+chown_command = true
+"""
+
+
+def write_config(tmpdir, **backup_options):
+    # Config file with given [Backup] options and empty backup_dir
+    config = tmpdir.join('autoxtrabackup.cnf')
+    config.write(CONFIG.format(tmpdir=tmpdir, backup_options='\n'.join(
+        '{} = {}'.format(key, value) for key, value in backup_options.items())))
+    for directory in ('full', 'inc', 'lsn'):
+        tmpdir.join('backup_dir', directory).ensure(dir=True)
+    return config
+
+
+def make_backup(tmpdir, **backup_options):
+    return Backup(config=str(write_config(tmpdir, **backup_options)))
+
+
+def make_scheduler(tmpdir, **backup_options):
+    return RedoScheduler(config=str(write_config(tmpdir, **backup_options)))
+
+
+def make_daemon(tmpdir, **backup_options):
+    return BackupDaemon(config=str(write_config(tmpdir, **backup_options)))
+
+
+def add_backup(backup, name, backup_type, last_lsn, from_lsn=0, **fields):
+    # Catalog row, backup directory and LSN sidecar of taken backup
+    directory = backup.full_dir if backup_type == 'Full' else backup.inc_dir
+    backup.catalog.add_backup(name, backup_type, 'OK', **fields)
+    local(directory).join(name).ensure(dir=True)
+    local(backup.lsn_backup_directory(name)).join('xtrabackup_checkpoints').write(
+        "backup_type = incremental\nfrom_lsn = {}\nto_lsn = {}\nlast_lsn = {}\n".format(from_lsn, last_lsn, last_lsn),
+        ensure=True)
@@ -0,0 +1,159 @@
+# PyTest file for testing ArchiveEngine class
+import os
+import shutil
+import tarfile
+import threading
+import subprocess
+import pytest
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from test.fixtures import make_backup
+from backup_archive.archive import ArchiveEngine, archive_backup_set
+from process_runner.process_runner import ProcessHandler
+
+
+def make_backups(tmpdir):
+    for path in ('full/full1/ibdata1', 'full/full1/test/t1.ibd', 'inc/inc1/test/t1.ibd.delta'):
+        tmpdir.join('backup_dir', path).write_binary(path.encode() * 1000, ensure=True)
+    return [str(tmpdir.join('backup_dir', 'full')), str(tmpdir.join('backup_dir', 'inc'))]
+
+
+class TestArchiveEngine:
+
+    @pytest.mark.parametrize('codec', [codec for codec in ArchiveEngine.codecs if shutil.which(codec)])
+    def test_create(self, tmpdir, codec):
+        engine = ArchiveEngine(codec=codec, threads=2)
+        archive_file = str(tmpdir.join('full1' + engine.extension))
+        metrics = engine.create(archive_file, make_backups(tmpdir))
+        assert metrics['codec'] == codec
+        assert metrics['input_bytes'] > metrics['output_bytes']
+        assert metrics['ratio'] > 1
+
+        tar = subprocess.Popen(ArchiveEngine(codec=codec).decompress_command() + [archive_file],
+                               stdout=subprocess.PIPE)
+        with tarfile.open(fileobj=tar.stdout, mode='r|') as archive:
+            names = [member.name for member in archive]
+        tar.wait()
+        assert any(name.endswith('full/full1/test/t1.ibd') for name in names)
+        assert any(name.endswith('inc/inc1/test/t1.ibd.delta') for name in names)
+
+    @pytest.mark.parametrize('codec', [codec for codec in ArchiveEngine.codecs if shutil.which(codec)])
+    def test_extract(self, tmpdir, codec, monkeypatch):
+        # Every file gets a frame of its own
+        monkeypatch.setattr(ArchiveEngine, 'frame_size', 1)
+        engine = ArchiveEngine(codec=codec)
+        archive_file = str(tmpdir.join('full1' + engine.extension))
+        sources = make_backups(tmpdir)
+        engine.create(archive_file, sources)
+        index = ArchiveEngine.read_index(archive_file)
+        assert len(index['frames']) > 3
+
+        members = ArchiveEngine.find_members(archive_file, lambda name: name.endswith('/test/t1.ibd'))
+        assert len(members) == 1
+        target = tmpdir.join('target')
+        assert ArchiveEngine.extract(archive_file, members, str(target)) == members
+        assert target.join(members[0]).read_binary() == b'full/full1/test/t1.ibd' * 1000
+        assert not target.join(members[0]).dirpath().dirpath().join('ibdata1').check()
+
+        # Directory extracts everything under it
+        inc = sources[1].lstrip('/')
+        assert ArchiveEngine.extract(archive_file, [inc], str(target)) == [inc, inc + '/inc1', inc + '/inc1/test',
+                                                                          inc + '/inc1/test/t1.ibd.delta']
+
+    def test_one_compressor_per_frame(self, tmpdir, monkeypatch):
+        started = []
+        start_process = ProcessHandler.start_process
+
+        def record_start(args, join_cgroup=None, **popen_args):
+            started.append(args[0])
+            return start_process(args, join_cgroup, **popen_args)
+        monkeypatch.setattr(ProcessHandler, 'start_process', staticmethod(record_start))
+        archive_file = str(tmpdir.join('full1.tar.gz'))
+        ArchiveEngine(codec='gzip').create(archive_file, make_backups(tmpdir))
+        # Everything fits into one frame, end of archive marker included
+        index = ArchiveEngine.read_index(archive_file)
+        assert index['frame_size'] == ArchiveEngine.frame_size
+        assert len(index['frames']) == 1
+        assert started == ['gzip']
+        with tarfile.open(archive_file) as archive:
+            assert len(archive.getnames()) == 9
+
+    def test_archive_backup_set_in_pool(self, tmpdir):
+        full, inc = make_backups(tmpdir)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(archive_backup_set, 'gzip', None, 1, str(tmpdir.join(name + '.tar.gz')), [path])
+                       for name, path in (('full', full), ('inc', inc))]
+            assert [future.result()['codec'] for future in futures] == ['gzip', 'gzip']
+        assert ArchiveEngine.find_members(str(tmpdir.join('inc.tar.gz')), lambda name: name.endswith('.delta'))
+
+    def test_failing_source(self, tmpdir):
+        archive_file = tmpdir.join('full1.tar.gz')
+        with pytest.raises(RuntimeError):
+            ArchiveEngine(codec='gzip').create(str(archive_file), [str(tmpdir.join('missing'))])
+        assert not archive_file.check()
+
+    def test_unknown_codec(self):
+        with pytest.raises(RuntimeError):
+            ArchiveEngine(codec='bzip2')
+        assert ArchiveEngine.codec_of('/archives/2019-01-20_13-52-07.tar.zst') == 'zstd'
+
+
+def make_archives(tmpdir, **backup_options):
+    # Archives of 1000 bytes taken 30, 20 and 10 days ago, all recorded in backup catalog
+    backup = make_backup(tmpdir, archive_dir=tmpdir.join('archive'), **backup_options)
+    names = []
+    for days in (30, 20, 10):
+        taken = datetime.now() - timedelta(days=days)
+        name = taken.strftime('%Y-%m-%d_%H-%M-%S') + '.tar.zst'
+        tmpdir.join('archive', name).write_binary(b'0' * 1000, ensure=True)
+        os.utime(str(tmpdir.join('archive', name)), (taken.timestamp(), taken.timestamp()))
+        backup.catalog.add_archive(name, output_bytes=1000)
+        names.append(name)
+    return backup, names
+
+
+def wait_for_removal():
+    for thread in threading.enumerate():
+        if thread.name == 'remove-archives':
+            thread.join()
+
+
+class TestArchiveRetention:
+
+    def test_archive_index(self, tmpdir):
+        backup, names = make_archives(tmpdir)
+        tmpdir.join('archive', names[0] + ArchiveEngine.index_suffix).write_binary(b'0' * 100)
+        tmpdir.join('archive', 'notes.txt').write('not an archive')
+        index = backup.archive_index()
+        assert [name for name, archive_date, size in index] == names
+        # Side index is sized with its archive
+        assert [size for name, archive_date, size in index] == [1100, 1000, 1000]
+        assert index[0][1] == datetime.strptime(names[0].split('.')[0], '%Y-%m-%d_%H-%M-%S')
+
+    def test_size_budget(self, tmpdir):
+        backup, names = make_archives(tmpdir, archive_max_size=2500)
+        assert backup.clean_old_archives() == names[:1]
+        wait_for_removal()
+        assert sorted(os.listdir(str(tmpdir.join('archive')))) == names[1:]
+        assert [row['name'] for row in backup.catalog.archives()] == names[1:]
+
+    def test_max_duration(self, tmpdir):
+        backup, names = make_archives(tmpdir, archive_max_duration='15 days', archive_max_size='1GiB')
+        assert backup.clean_old_archives() == names[:2]
+        wait_for_removal()
+        assert os.listdir(str(tmpdir.join('archive'))) == names[2:]
+
+    def test_catalog_updated_before_removal(self, tmpdir, monkeypatch):
+        backup, names = make_archives(tmpdir, archive_max_size=1000)
+        seen = []
+        remove_archives = backup.remove_archives
+
+        def record_and_remove(archives):
+            # Catalog already forgot the archives which are still on disk
+            seen.append(([row['name'] for row in backup.catalog.archives()],
+                         [name for name in archives if tmpdir.join('archive', name).check()]))
+            remove_archives(archives)
+        monkeypatch.setattr(backup, 'remove_archives', record_and_remove)
+        assert backup.clean_old_archives() == names[:2]
+        wait_for_removal()
+        assert seen == [(names[2:], names[:2])]
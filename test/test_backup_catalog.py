@@ -0,0 +1,81 @@
+# PyTest file for testing BackupCatalog class
+import os
+import sqlite3
+import pytest
+from backup_catalog.catalog import BackupCatalog
+
+
+class TestBackupCatalog:
+
+    def test_recent_backup(self, tmpdir):
+        catalog = BackupCatalog(str(tmpdir))
+        catalog.add_backup(name='2019-01-20_13-52-07', backup_type='Full', status='OK', to_lsn=100)
+        catalog.add_backup(name='2019-01-21_13-52-07', backup_type='Full', status='FAILED')
+        catalog.add_backup(name='2019-01-20_14-52-07', backup_type='Inc', status='OK',
+                           parent='2019-01-20_13-52-07', from_lsn=100, to_lsn=200)
+        assert catalog.recent_backup('Full') == '2019-01-20_13-52-07'
+        assert catalog.recent_backup('Inc') == '2019-01-20_14-52-07'
+        assert catalog.has_backups('Inc')
+
+    def test_chain(self, tmpdir):
+        catalog = BackupCatalog(str(tmpdir))
+        catalog.add_backup(name='f1', backup_type='Full', status='OK')
+        catalog.add_backup(name='i1', backup_type='Inc', status='OK', parent='f1')
+        catalog.add_backup(name='i2', backup_type='Inc', status='OK', parent='i1')
+        assert [row['name'] for row in catalog.chain('i2')] == ['f1', 'i1', 'i2']
+        catalog.remove_backup('i1')
+        with pytest.raises(RuntimeError):
+            catalog.chain('i2')
+
+    def test_unknown_column(self, tmpdir):
+        catalog = BackupCatalog(str(tmpdir))
+        with pytest.raises(ValueError):
+            catalog.add_backup(name='f1', backup_type='Full', status='OK', no_such_column=1)
+
+    def test_import_backup_tags(self, tmpdir):
+        os.makedirs(str(tmpdir.join('full', '2017-12-14_12-01-11')))
+        tmpdir.join('backup_tags.txt').write(
+            "2017-12-14_12-01-11\tFull\tOK\t2017-12-14_12-01-11\t4,0K\t'My Full backup'\n"
+            "2017-12-13_12-01-11\tFull\tOK\t2017-12-13_12-01-11\t4,0K\t'Deleted backup'\n")
+        assert BackupCatalog.exists(str(tmpdir))
+        catalog = BackupCatalog(str(tmpdir))
+        assert catalog.find_by_tag('My Full backup')['name'] == '2017-12-14_12-01-11'
+        assert catalog.find_by_tag('Deleted backup') is None
+        assert tmpdir.join('backup_tags.txt.imported').check()
+
+    def test_read_xtrabackup_info(self, tmpdir):
+        tmpdir.join('xtrabackup_info').write(
+            "tool_version = 2.4.12\n"
+            "binlog_pos = filename 'mysql-bin.000003', position '154', "
+            "GTID of the last change 'a1b2:1-5'\n"
+            "innodb_from_lsn = 0\n"
+            "innodb_to_lsn = 2503656\n"
+            "compressed = compressed\n"
+            "encrypted = N\n")
+        fields = BackupCatalog.read_xtrabackup_info(str(tmpdir))
+        assert fields['tool_version'] == '2.4.12'
+        assert fields['gtid'] == 'a1b2:1-5'
+        assert fields['to_lsn'] == 2503656
+        assert fields['compressed'] == 1
+        assert fields['encrypted'] == 0
+
+    def test_linked_backups(self, tmpdir):
+        # Catalog created before linked_* columns existed is upgraded on open
+        conn = sqlite3.connect(str(tmpdir.join(BackupCatalog.file_name)))
+        conn.execute("CREATE TABLE backups (name TEXT PRIMARY KEY, backup_type TEXT NOT NULL, parent TEXT, "
+                     "status TEXT NOT NULL, from_lsn INTEGER, to_lsn INTEGER, size_bytes INTEGER, size TEXT, "
+                     "start_time TEXT, end_time TEXT, duration REAL, tool_version TEXT, binlog_pos TEXT, "
+                     "gtid TEXT, stream TEXT, compressed INTEGER, encrypted INTEGER, tag TEXT)")
+        conn.close()
+        catalog = BackupCatalog(str(tmpdir))
+        catalog.add_backup('full1', 'Full', 'OK')
+        catalog.add_backup('full2', 'Full', 'OK', linked_from='full1', linked_bytes=11000)
+        catalog.remove_backup('full1')
+        assert catalog.get_backup('full2')['linked_from'] is None
+
+    def test_skipped_backups(self, tmpdir):
+        catalog = BackupCatalog(str(tmpdir))
+        catalog.add_skip('2019-01-20_14-52-07', parent='2019-01-20_13-52-07', base_lsn=100, current_lsn=100)
+        catalog.add_skip('2019-01-20_15-52-07', parent='2019-01-20_13-52-07', base_lsn=100, current_lsn=110)
+        assert [row['current_lsn'] for row in catalog.skipped_backups(parent='2019-01-20_13-52-07')] == [100, 110]
+        assert not catalog.skipped_backups(parent='other')
@@ -0,0 +1,164 @@
+# PyTest file for testing CgroupEnvelope class
+import os
+import threading
+import pytest
+from test.fixtures import CONFIG
+from general_conf.generalops import GeneralClass
+from backup_prepare.prepare import Prepare
+from master_backup_script.backuper import Backup
+from backup_archive.archive import ArchiveEngine
+from process_runner.cgroup import CgroupEnvelope
+from process_runner.process_runner import ProcessHandler, ProcessRunner
+
+
+def write_config(tmpdir, cgroup_options, backup_options=''):
+    config = tmpdir.join('autoxtrabackup.cnf')
+    config.write(CONFIG.format(tmpdir=tmpdir, backup_options=backup_options) + '\n[Cgroup]\ncgroup_dir = {}\n{}\n'.format(
+        tmpdir.join('cgroup'), cgroup_options))
+    return config
+
+
+def make_envelope(tmpdir, monkeypatch, cgroup_options):
+    monkeypatch.setattr(CgroupEnvelope, 'block_device', staticmethod(
+        lambda path: '8:0' if 'backup_dir' in path else '259:0'))
+    config = write_config(tmpdir, cgroup_options)
+    return Prepare(config=str(config)).envelope, config
+
+
+class TestCgroupEnvelope:
+
+    def test_not_configured(self, tmpdir):
+        config = tmpdir.join('autoxtrabackup.cnf')
+        config.write(CONFIG.format(tmpdir=tmpdir, backup_options=''))
+        assert CgroupEnvelope.from_config(GeneralClass(str(config))) is None
+
+    def test_limits(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1.5\nmemory_high = 1GiB\n"
+                                                              "datadir_io_max = rbps=100MiB riops=max\n"
+                                                              "backup_io_max = wbps=1MiB")
+        assert envelope.pending == {'cpu.max': '150000 100000', 'memory.high': '1073741824',
+                                    'io.max': {'259:0': {'rbps': '104857600', 'riops': 'max'},
+                                               '8:0': {'wbps': '1048576'}}}
+        # Both on the same disk
+        monkeypatch.setattr(CgroupEnvelope, 'block_device', staticmethod(lambda path: '8:0'))
+        config.write(config.read().replace('backup_io_max = wbps=1MiB', 'backup_io_max = rbps=10MiB riops=100'))
+        assert CgroupEnvelope.limits_from_config(GeneralClass(str(config)))['io.max'] == {
+            '8:0': {'rbps': '10485760', 'riops': '100'}}
+
+    def test_invalid_io_limit(self):
+        with pytest.raises(RuntimeError):
+            CgroupEnvelope.io_limits('bps=100MiB')
+
+    def test_block_device(self, tmpdir):
+        device = os.stat(str(tmpdir)).st_dev
+        disk = tmpdir.join('devices', 'sda').ensure(dir=True)
+        disk.join('dev').write('8:0\n')
+        disk.join('sda1', 'partition').write('1', ensure=True)
+        tmpdir.join('block').ensure(dir=True).join('{}:{}'.format(os.major(device), os.minor(device))).mksymlinkto(
+            disk.join('sda1'))
+        assert CgroupEnvelope.block_device(str(tmpdir), sys_block=str(tmpdir.join('block'))) == '8:0'
+        assert CgroupEnvelope.block_device(str(tmpdir), sys_block=str(tmpdir.join('missing'))) is None
+
+    def test_create_and_reload(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 2\ndatadir_io_max = rbps=100MiB")
+        path = tmpdir.join('cgroup', 'xtrabackup-1')
+        tmpdir.join('cgroup', 'cgroup.subtree_control').write('cpu memory', ensure=True)
+        assert envelope.create('xtrabackup-1') == str(path)
+        assert tmpdir.join('cgroup', 'cgroup.subtree_control').read() == '+io'
+        assert path.join('cpu.max').read() == '200000 100000'
+        assert path.join('io.max').read() == '259:0 rbps=104857600'
+        assert envelope.reload_if_changed() == []
+
+        config.write(config.read().replace('cpu_max = 2', 'memory_high = 2GiB').replace('rbps', 'wbps'))
+        os.utime(str(config), (0, 0))
+        assert envelope.reload_if_changed() == ['cpu.max', 'io.max', 'memory.high']
+        # Removed limits are reset
+        assert path.join('cpu.max').read() == 'max'
+        assert path.join('io.max').read() == '259:0 rbps=max wbps=104857600'
+        assert path.join('memory.high').read() == '2147483648'
+        assert [change['file'] for change in envelope.changes] == ['cpu.max', 'io.max', 'cpu.max', 'io.max',
+                                                                   'memory.high']
+
+    def test_stats(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")
+        path = tmpdir.join('cgroup', 'tar-1')
+        envelope.create('tar-1')
+        path.join('cpu.stat').write("usage_usec 3000000\nuser_usec 2000000\nnr_periods 50\n"
+                                    "nr_throttled 20\nthrottled_usec 1500000\n")
+        path.join('memory.current').write("4096\n")
+        path.join('memory.events').write("low 0\nhigh 7\nmax 0\noom 0\n")
+        path.join('io.stat').write("8:0 rbytes=100 wbytes=200 rios=1 wios=2 dbytes=0 dios=0\n"
+                                   "259:0 rbytes=1000 wbytes=0 rios=10 wios=0 dbytes=0 dios=0\n")
+        summary = envelope.summary()
+        assert summary == {'cpu_usage': 3.0, 'cpu_throttled': 1.5, 'nr_throttled': 20, 'memory_peak': 4096,
+                           'memory_high_events': 7, 'read_bytes': 1100, 'written_bytes': 200,
+                           'limits': {'cpu.max': '100000 100000'},
+                           'changes': [{'time': summary['changes'][0]['time'], 'file': 'cpu.max',
+                                        'value': '100000 100000'}]}
+
+    def test_run_command(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")
+        runner = ProcessHandler(config=str(config))
+        assert runner.run_command('true', envelope=envelope) is True
+        # The process joined its cgroup itself, before running the command
+        assert int(envelope.read('cgroup.procs')) != os.getpid()
+        assert os.path.basename(envelope.path).startswith('true-{}-'.format(os.getpid()))
+        assert runner.xtrabackup_history_log[-1][-1]['limits'] == {'cpu.max': '100000 100000'}
+        assert runner.xtrabackup_history_log[0][-1] == 'cgroup'
+
+    def test_run_command_not_started(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")
+        runner = ProcessHandler(config=str(config))
+        with pytest.raises(FileNotFoundError):
+            runner.run_command('/nonexistent/xtrabackup --prepare', envelope=envelope)
+        # Watcher of config file is stopped and cgroup.procs closed
+        assert not [thread for thread in threading.enumerate() if thread.name.startswith('cgroup-')]
+        assert envelope.procs is None
+        assert runner.xtrabackup_history_log[-1][-2] is None
+
+        def join_cgroup():
+            raise OSError('No space left on device')
+        monkeypatch.setattr(envelope, 'joiner', lambda: join_cgroup)
+        with pytest.raises(RuntimeError):
+            runner.run_command('true', envelope=envelope)
+        assert not [thread for thread in threading.enumerate() if thread.name.startswith('cgroup-')]
+
+    def test_run_command_stdin(self, tmpdir, monkeypatch):
+        # Stream is fed to xbstream without shell redirect
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")
+        tmpdir.join('full_backup.stream').write('stream')
+        runner = ProcessHandler(config=str(config))
+        assert runner.run_command("sh -c 'cat > {}'".format(tmpdir.join('extracted')), envelope=envelope,
+                                  stdin=str(tmpdir.join('full_backup.stream'))) is True
+        assert tmpdir.join('extracted').read() == 'stream'
+        assert runner.xtrabackup_history_log[-1][0] == 'sh'
+
+    def test_archive_compressors(self, tmpdir, monkeypatch):
+        envelope, config = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")
+        tmpdir.join('full', 'test', 't1.ibd').write_binary(b'1' * 100000, ensure=True)
+        archive = str(tmpdir.join('full.tar.gz'))
+        metrics = ArchiveEngine(codec='gzip', envelope=envelope).create(archive, [str(tmpdir.join('full'))])
+        # Compressors of every frame share cgroup of the archive
+        assert os.path.basename(envelope.path) == 'gzip-{}'.format(os.getpid())
+        assert int(envelope.read('cgroup.procs')) != os.getpid()
+        assert metrics['cgroup']['limits'] == {'cpu.max': '100000 100000'}
+
+        envelope = make_envelope(tmpdir, monkeypatch, "cpu_max = 1")[0]
+        members = ArchiveEngine.find_members(archive, lambda name: name.endswith('t1.ibd'))
+        assert ArchiveEngine.extract(archive, members, str(tmpdir.join('target')), envelope=envelope) == members
+        assert int(envelope.read('cgroup.procs')) != os.getpid()
+        assert os.path.basename(envelope.path).startswith('gzip-{}-'.format(os.getpid()))
+        assert ProcessRunner.xtrabackup_history_log[-1][0] == 'gzip'
+        assert ProcessRunner.xtrabackup_history_log[-1][-1]['limits'] == {'cpu.max': '100000 100000'}
+
+    def test_archive_history(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(CgroupEnvelope, 'block_device', staticmethod(lambda path: None))
+        config = write_config(tmpdir, "cpu_max = 1", "archive_dir = {}\narchive_codec = gzip".format(
+            tmpdir.join('archive')))
+        tmpdir.join('backup_dir', 'full', '2019-01-01_00-00-00', 'ibdata1').write('1', ensure=True)
+        tmpdir.join('archive').ensure(dir=True)
+        backup = Backup(config=str(config))
+        assert backup.create_backup_archives() == ['2019-01-01_00-00-00.tar.gz']
+        # Archived by worker process, recorded in history log of this one
+        assert ProcessRunner.xtrabackup_history_log[-1][0] == 'gzip'
+        assert ProcessRunner.xtrabackup_history_log[-1][-1]['limits'] == {'cpu.max': '100000 100000'}
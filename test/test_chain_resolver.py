@@ -0,0 +1,71 @@
+# PyTest file for testing ChainResolver class
+import pytest
+from backup_prepare.chain import ChainResolver
+
+
+def write_checkpoints(tmpdir, name, from_lsn, to_lsn):
+    tmpdir.join('lsn', name, 'xtrabackup_checkpoints').write(
+        "backup_type = incremental\nfrom_lsn = {}\nto_lsn = {}\nlast_lsn = {}\n".format(from_lsn, to_lsn, to_lsn),
+        ensure=True)
+
+
+class TestChainResolver:
+
+    def resolver(self, tmpdir):
+        return ChainResolver(full_dir=str(tmpdir.join('full')),
+                             inc_dir=str(tmpdir.join('inc')),
+                             lsn_dir=str(tmpdir.join('lsn')))
+
+    def test_resolve_by_lsn(self, tmpdir):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        # Directory names are deliberately out of LSN order
+        write_checkpoints(tmpdir, 'inc_b', 100, 200)
+        write_checkpoints(tmpdir, 'inc_a', 200, 300)
+        write_checkpoints(tmpdir, 'inc_c', 300, 300)
+        chain = self.resolver(tmpdir).resolve('full1', ['inc_a', 'inc_c', 'inc_b'])
+        assert chain == ['inc_b', 'inc_a', 'inc_c']
+
+    def test_resolve_until(self, tmpdir):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        write_checkpoints(tmpdir, 'inc1', 100, 200)
+        write_checkpoints(tmpdir, 'inc2', 200, 300)
+        write_checkpoints(tmpdir, 'inc3', 350, 400)
+        assert self.resolver(tmpdir).resolve('full1', ['inc1', 'inc2', 'inc3'], until='inc2') == ['inc1', 'inc2']
+
+    @pytest.mark.parametrize('from_lsn, to_lsn, error', [(250, 400, 'gap'),
+                                                          (50, 150, 'orphan'),
+                                                          (150, 250, 'overlap')])
+    def test_broken_chain(self, tmpdir, from_lsn, to_lsn, error):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        write_checkpoints(tmpdir, 'inc1', 100, 200)
+        write_checkpoints(tmpdir, 'inc2', from_lsn, to_lsn)
+        with pytest.raises(RuntimeError, match=error):
+            self.resolver(tmpdir).resolve('full1', ['inc1', 'inc2'])
+
+    def test_fork(self, tmpdir):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        write_checkpoints(tmpdir, 'inc1', 100, 200)
+        write_checkpoints(tmpdir, 'inc2', 100, 250)
+        with pytest.raises(RuntimeError, match='Overlapping'):
+            self.resolver(tmpdir).resolve('full1', ['inc1', 'inc2'])
+
+    def test_missing_lsn_fallback(self, tmpdir):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        assert self.resolver(tmpdir).resolve('full1', ['inc2', 'inc1']) == ['inc1', 'inc2']
+
+    def test_cumulative_forks(self, tmpdir):
+        write_checkpoints(tmpdir, 'full1', 0, 100)
+        write_checkpoints(tmpdir, 'inc1', 100, 200)
+        write_checkpoints(tmpdir, 'inc2', 200, 300)
+        # Cumulative backup on top of full backup supersedes inc1 and inc2
+        write_checkpoints(tmpdir, 'inc3', 100, 350)
+        write_checkpoints(tmpdir, 'inc4', 350, 400)
+        resolver = ChainResolver(full_dir=str(tmpdir.join('full')), inc_dir=str(tmpdir.join('inc')),
+                                 lsn_dir=str(tmpdir.join('lsn')), allow_forks=True)
+        incs = ['inc1', 'inc2', 'inc3', 'inc4']
+        assert resolver.resolve('full1', incs) == ['inc3', 'inc4']
+        assert resolver.resolve('full1', incs, until='inc2') == ['inc1', 'inc2']
+
+        write_checkpoints(tmpdir, 'inc5', 250, 450)
+        with pytest.raises(RuntimeError, match='overlap'):
+            resolver.resolve('full1', incs + ['inc5'])
@@ -0,0 +1,26 @@
+# PyTest file for testing Checkpoints class
+from backup_prepare.checkpoints import Checkpoints
+
+INNODB_STATUS = """
+---
+LOG
+---
+Log sequence number          2503689
+Log buffer assigned up to    2503689
+Log flushed up to            2503689
+Last checkpoint at           2503680
+"""
+
+
+class TestCheckpoints:
+
+    def test_last_lsn(self, tmpdir):
+        tmpdir.join('xtrabackup_checkpoints').write("backup_type = full-backuped\nfrom_lsn = 0\n"
+                                                    "to_lsn = 2503656\nlast_lsn = 2503665\n")
+        assert Checkpoints.to_lsn(str(tmpdir)) == 2503656
+        assert Checkpoints.last_lsn(str(tmpdir)) == 2503665
+        assert Checkpoints.last_lsn(str(tmpdir.join('missing'))) is None
+
+    def test_innodb_status_lsn(self):
+        assert Checkpoints.innodb_status_lsn(INNODB_STATUS) == 2503689
+        assert Checkpoints.innodb_status_lsn("ERROR 1045 (28000): Access denied") is None
@@ -0,0 +1,92 @@
+# PyTest file for testing BackupDaemon and JobQueue classes
+import os
+from test.fixtures import make_daemon, add_backup
+from backup_scheduler.job_queue import JobQueue
+
+
+class TestJobQueue:
+
+    def test_merge_and_supersede(self, tmpdir):
+        queue = JobQueue(str(tmpdir))
+        inc = queue.enqueue('inc', 'redo')
+        assert queue.enqueue('inc', 'interval') == inc
+        full = queue.enqueue('full', 'full_backup_interval')
+        # Queued incremental backup is superseded by full backup, later one is merged into it
+        assert queue.enqueue('inc', 'redo') == full
+        assert [job['action'] for job in queue.jobs('queued')] == ['full']
+        assert [job['id'] for job in queue.jobs('superseded')] == [inc]
+
+    def test_survives_restart(self, tmpdir):
+        queue = JobQueue(str(tmpdir))
+        job_id = queue.enqueue('full')
+        assert queue.next_job()['id'] == job_id
+        assert queue.next_job() is None
+
+        # Daemon was killed while the job was running
+        queue = JobQueue(str(tmpdir))
+        assert queue.recover() == 1
+        assert queue.next_job()['id'] == job_id
+        queue.finish(job_id, 'done')
+        assert queue.recover() == 0
+        assert queue.jobs('done')[0]['finished'] is not None
+
+    def test_prune(self, tmpdir):
+        queue = JobQueue(str(tmpdir))
+        for i in range(5):
+            queue.finish(queue.enqueue('inc'), 'done')
+        queued = queue.enqueue('inc')
+        queue.prune(keep=2)
+        assert [job['id'] for job in queue.jobs()] == [5, queued]
+
+
+class TestBackupDaemon:
+
+    def test_interval_slots(self, tmpdir, monkeypatch):
+        daemon = make_daemon(tmpdir, inc_backup_interval='1 hour', full_backup_interval='1000 days')
+        add_backup(daemon.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        monkeypatch.setattr(daemon.backup, 'current_lsn', lambda: 1000)
+        # First start only records the slot
+        assert daemon.schedule_jobs(now=10 * 3600 + 5) is None
+        assert daemon.schedule_jobs(now=10 * 3600 + 3599) is None
+        assert daemon.schedule_jobs(now=11 * 3600) is not None
+        # Missed slots are caught up by one backup
+        daemon.queue.finish(daemon.queue.next_job()['id'], 'done')
+        assert daemon.schedule_jobs(now=15 * 3600) is not None
+        assert daemon.schedule_jobs(now=15 * 3600 + 10) is None
+        assert len(daemon.queue.jobs()) == 2
+
+    def test_run_once(self, tmpdir, monkeypatch):
+        daemon = make_daemon(tmpdir, redo_inc_size='1MiB', full_backup_interval='1000 days')
+        add_backup(daemon.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        monkeypatch.setattr(daemon.backup, 'current_lsn', lambda: 1000 + 1024 * 1024)
+        taken = []
+        monkeypatch.setattr(daemon.backup, 'take_inc_backup', lambda: taken.append('inc'))
+        assert daemon.run_once() == ['inc']
+        assert taken == ['inc']
+
+        def failing():
+            raise RuntimeError("FAILED: XtraBackup")
+        monkeypatch.setattr(daemon.backup, 'take_inc_backup', failing)
+        assert daemon.run_once() == []
+        assert daemon.queue.jobs('failed')[0]['error'] == "FAILED: XtraBackup"
+
+    def test_reload(self, tmpdir, monkeypatch):
+        monkeypatch.setattr('backup_scheduler.daemon.CheckEnv.check_all_env', lambda self: True)
+        daemon = make_daemon(tmpdir, inc_backup_interval='1 hour', redo_inc_size='1MiB')
+        monkeypatch.setattr(daemon, 'take', lambda action: True)
+        assert not daemon.config_changed()
+
+        config = tmpdir.join('autoxtrabackup.cnf')
+        config.write(config.read().replace('inc_backup_interval = 1 hour\n', '').replace('1MiB', '2MiB'))
+        os.utime(str(config), (0, 0))
+        assert daemon.config_changed()
+        daemon.run_once()
+        assert daemon.redo_inc_size == 2 * 1024 * 1024
+        assert not hasattr(daemon, 'inc_backup_interval')
+        assert daemon.backup.redo_inc_size == 2 * 1024 * 1024
+
+        # Broken config is not used
+        config.write('[MySQL]\n')
+        os.utime(str(config), (1, 1))
+        assert daemon.reload() is False
+        assert daemon.redo_inc_size == 2 * 1024 * 1024
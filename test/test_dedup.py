@@ -0,0 +1,100 @@
+# PyTest file for testing DedupStore class
+import os
+import random
+import pytest
+from test.fixtures import make_backup
+from backup_archive.dedup import DedupStore
+
+
+def random_bytes(size, seed):
+    # Seeded, so chunk boundaries are the same on every run
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def make_full(tmpdir, name, changed_page=None):
+    # 2MiB tablespace of random pages, optionally with one page changed
+    data = bytearray(random_bytes(2 * 1024 * 1024, 0)) if not tmpdir.join('pages').check() \
+        else bytearray(tmpdir.join('pages').read_binary())
+    tmpdir.join('pages').write_binary(bytes(data))
+    if changed_page is not None:
+        data[changed_page * 16384:(changed_page + 1) * 16384] = random_bytes(16384, changed_page)
+    full = tmpdir.join('backup_dir', 'full', name)
+    full.join('test', 't1.ibd').write_binary(bytes(data), ensure=True)
+    full.join('xtrabackup_checkpoints').write('to_lsn = {}\n'.format(name), ensure=True)
+    return str(full)
+
+
+class TestDedupStore:
+
+    def test_split(self, tmpdir):
+        store = DedupStore(str(tmpdir.join('store')))
+        path = make_full(tmpdir, 'full1')
+        data = open(os.path.join(path, 'test', 't1.ibd'), 'rb').read()
+        chunks = list(store.split(os.path.join(path, 'test', 't1.ibd'), len(data)))
+        assert b''.join(chunks) == data
+        assert all(len(chunk) % store.align == 0 for chunk in chunks)
+        assert all(store.min_chunk <= len(chunk) <= store.max_chunk for chunk in chunks[:-1])
+        assert list(store.split(str(tmpdir.join('pages')), 0)) == []
+
+    def test_dedup_and_refcounts(self, tmpdir):
+        store = DedupStore(str(tmpdir.join('store')), threads=2)
+        metrics = store.add('2019-01-01_00-00-00', [make_full(tmpdir, 'full1')])
+        first_size = store.total_size()
+        assert metrics['output_bytes'] == first_size
+
+        # Second full differs by a single page, only chunks around it are stored
+        metrics = store.add('2019-01-02_00-00-00', [make_full(tmpdir, 'full2', changed_page=50)])
+        assert 0 < metrics['output_bytes'] < first_size / 2
+        assert store.archives() == ['2019-01-01_00-00-00', '2019-01-02_00-00-00']
+        with pytest.raises(RuntimeError):
+            store.add('2019-01-02_00-00-00', [str(tmpdir.join('pages'))])
+
+        # Shared chunks stay until the last archive using them is removed
+        freed = store.remove('2019-01-01_00-00-00')
+        assert 0 < freed < first_size / 2
+        target = tmpdir.join('target')
+        members = store.find_members('2019-01-02_00-00-00', lambda name: name.endswith('/test/t1.ibd'))
+        assert store.extract('2019-01-02_00-00-00', members, str(target)) == members
+        assert target.join(members[0]).read_binary() == \
+            tmpdir.join('backup_dir', 'full', 'full2', 'test', 't1.ibd').read_binary()
+
+        store.remove('2019-01-02_00-00-00')
+        assert store.total_size() == 0
+        assert store.collect_garbage() == 0
+        assert not os.listdir(str(tmpdir.join('store', 'manifests')))
+
+    def test_collect_garbage(self, tmpdir):
+        store = DedupStore(str(tmpdir.join('store')))
+        store.store_chunk(b'orphan' * 1000)
+        assert store.collect_garbage() == 1
+
+    def test_failed_add(self, tmpdir, monkeypatch):
+        store = DedupStore(str(tmpdir.join('store')), threads=1)
+        path = make_full(tmpdir, 'full1')
+        store_file = store.store_file
+
+        def failing_store_file(path, info):
+            # Chunks of t1.ibd are stored before xtrabackup_checkpoints fails
+            if info.name.endswith('xtrabackup_checkpoints'):
+                raise OSError('No space left on device')
+            return store_file(path, info)
+        monkeypatch.setattr(store, 'store_file', failing_store_file)
+        collect_garbage = store.collect_garbage
+        deleted = []
+        monkeypatch.setattr(store, 'collect_garbage', lambda: deleted.append(collect_garbage()))
+        with pytest.raises(RuntimeError):
+            store.add('2019-01-01_00-00-00', [path])
+        assert store.archives() == []
+        assert deleted[0] > 0
+        assert [files for dirpath, dirnames, files in os.walk(store.chunk_dir) if files] == []
+
+    def test_clean_old_dedup_archives(self, tmpdir):
+        backup = make_backup(tmpdir, archive_dir=tmpdir.join('store'), archive_backend='dedup',
+                             archive_max_size='1GiB')
+        store = backup.dedup_store
+        store.add('2019-01-01_00-00-00', [make_full(tmpdir, 'full1')])
+        store.store_chunk(b'orphan' * 1000)
+        # Nothing to evict, chunk left by interrupted archiving is deleted anyway
+        assert backup.clean_old_dedup_archives() == []
+        assert store.collect_garbage() == 0
+        assert store.archives() == ['2019-01-01_00-00-00']
@@ -0,0 +1,72 @@
+# PyTest file for testing FullDedup class
+import os
+import pytest
+from test.fixtures import make_backup, add_backup
+from backup_prepare.snapshot import Snapshot
+from master_backup_script.full_dedup import FullDedup
+
+
+def make_fulls(tmpdir):
+    for name in ('full1', 'full2'):
+        full = tmpdir.join('full', name)
+        full.join('audit', 'log.ibd').write_binary(b'a' * 10000, ensure=True)
+        full.join('test', 't1.ibd').write_binary(name.encode() * 1000, ensure=True)
+        full.join('ibdata1').write_binary(b'i' * 1000, ensure=True)
+        tmpdir.join('lsn', name).ensure(dir=True)
+    return str(tmpdir.join('full', 'full1')), str(tmpdir.join('full', 'full2'))
+
+
+class TestFullDedup:
+
+    def test_hardlink(self, tmpdir):
+        full1, full2 = make_fulls(tmpdir)
+        dedup = FullDedup('hardlink', threads=2)
+        result = dedup.run(full1, full2, str(tmpdir.join('lsn', 'full1')), str(tmpdir.join('lsn', 'full2')))
+        assert result == {'method': 'hardlink', 'linked': 2, 'linked_bytes': 11000}
+        assert os.path.samefile(os.path.join(full1, 'audit', 'log.ibd'), os.path.join(full2, 'audit', 'log.ibd'))
+        assert not os.path.samefile(os.path.join(full1, 'test', 't1.ibd'), os.path.join(full2, 'test', 't1.ibd'))
+        assert set(FullDedup.read_cache(str(tmpdir.join('lsn', 'full2')))) == {'audit/log.ibd', 'ibdata1',
+                                                                               'test/t1.ibd'}
+
+        # Already linked files are not compared again
+        assert dedup.run(full1, full2, str(tmpdir.join('lsn', 'full1')),
+                         str(tmpdir.join('lsn', 'full2')))['linked'] == 0
+
+        # In place prepare gets its own copy
+        assert Snapshot.unshare_tree(full2) == 2
+        assert not os.path.samefile(os.path.join(full1, 'ibdata1'), os.path.join(full2, 'ibdata1'))
+        assert tmpdir.join('full', 'full2', 'ibdata1').read_binary() == b'i' * 1000
+
+    def test_unknown_method(self):
+        with pytest.raises(RuntimeError):
+            FullDedup('copy')
+
+
+class TestFullRetention:
+
+    def test_clean_full_backup_dir(self, tmpdir):
+        backup = make_backup(tmpdir, full_retention=2)
+        for name in ('full1', 'full2', 'full3', 'full4'):
+            add_backup(backup, name, 'Full', 1000)
+        backup.catalog.update_backup('full3', status='FAILED')
+        backup.clean_full_backup_dir()
+        # Failed backup does not count
+        assert sorted(os.listdir(backup.full_dir)) == ['full2', 'full4']
+        assert sorted(os.listdir(backup.lsn_dir)) == ['full2', 'full4']
+        assert backup.catalog.get_backup('full1') is None
+
+        backup.full_retention = 1
+        backup.clean_full_backup_dir()
+        assert os.listdir(backup.full_dir) == ['full4']
+
+    def test_dedup_needs_previous_full(self, tmpdir):
+        backup = make_backup(tmpdir, full_dedup='hardlink')
+        make_fulls(tmpdir.join('backup_dir'))
+        for name in ('full1', 'full2'):
+            backup.catalog.add_backup(name, 'Full', 'OK')
+        full2 = os.path.join(backup.full_dir, 'full2')
+        # full1 is deleted by rotation right after, linking to it saves nothing
+        assert backup.dedup_full_backup(full2) is None
+        backup.full_retention = 2
+        assert backup.dedup_full_backup(full2)['linked_bytes'] == 11000
+        assert backup.catalog.get_backup('full2')['linked_from'] == 'full1'
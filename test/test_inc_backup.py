@@ -0,0 +1,132 @@
+# PyTest file for testing incremental backups of Backup class
+import logging
+from test.fixtures import make_backup, add_backup, write_config
+from master_backup_script.backuper import Backup
+from backup_prepare.prepare import Prepare
+
+FULL = '2100-01-01_00-00-00'
+INC = '2100-01-01_01-00-00'
+MiB = 1024 * 1024
+
+
+def make_inc_backup(tmpdir, monkeypatch, current_lsn, **backup_options):
+    # Full backup at LSN 1000, inc_backup() only records that it was called
+    backup = make_backup(tmpdir, **backup_options)
+    add_backup(backup, FULL, 'Full', 1000)
+    monkeypatch.setattr(backup, 'current_lsn', lambda: current_lsn)
+    taken = []
+    monkeypatch.setattr(backup, 'inc_backup', lambda: taken.append('inc'))
+    return backup, taken
+
+
+class TestIncBackupNeeded:
+
+    def test_below_threshold(self, tmpdir, monkeypatch):
+        backup, taken = make_inc_backup(tmpdir, monkeypatch, 1000 + MiB - 1, inc_min_lsn_delta='1MiB')
+        assert backup.inc_backup_needed() is False
+        skip = backup.catalog.skipped_backups(parent=FULL)
+        assert [(row['base_lsn'], row['current_lsn']) for row in skip] == [(1000, 1000 + MiB - 1)]
+        assert backup.take_inc_backup() is True
+        assert taken == []
+
+    def test_above_threshold(self, tmpdir, monkeypatch):
+        backup, taken = make_inc_backup(tmpdir, monkeypatch, 1000 + MiB, inc_min_lsn_delta='1MiB')
+        assert backup.inc_backup_needed() is True
+        assert backup.take_inc_backup() is True
+        assert taken == ['inc']
+        assert backup.catalog.skipped_backups() == []
+
+    def test_based_on_recent_incremental(self, tmpdir, monkeypatch):
+        backup, taken = make_inc_backup(tmpdir, monkeypatch, 5000)
+        add_backup(backup, INC, 'Inc', 5000, from_lsn=1000)
+        # Default inc_min_lsn_delta = 1 skips only if nothing changed since the recent backup
+        assert backup.inc_backup_needed() is False
+        assert backup.catalog.skipped_backups()[0]['parent'] == INC
+
+    def test_check_disabled(self, tmpdir, monkeypatch):
+        backup, taken = make_inc_backup(tmpdir, monkeypatch, 1000, inc_min_lsn_delta=0)
+
+        def current_lsn():
+            raise AssertionError("server is not asked for LSN")
+        monkeypatch.setattr(backup, 'current_lsn', current_lsn)
+        assert backup.inc_backup_needed() is True
+        assert backup.take_inc_backup() is True
+        assert taken == ['inc']
+        backup.inc_min_lsn_delta = -1
+        assert backup.inc_backup_needed() is True
+
+    def test_unknown_lsn(self, tmpdir, monkeypatch):
+        # Server LSN could not be read, backup is taken anyway
+        backup, taken = make_inc_backup(tmpdir, monkeypatch, None)
+        assert backup.inc_backup_needed() is True
+        assert backup.catalog.skipped_backups() == []
+
+
+def make_dry_run(tmpdir, cls=Backup):
+    # Dry run with streamed backups, commands are only logged
+    config = write_config(tmpdir)
+    config.write(config.read().replace('[MySQL]\n', '[MySQL]\nmysql_socket = /tmp/mysql.sock\n').replace(
+        '[Xbstream]\n', '[Xbstream]\nxbstream = xbstream\nstream = xbstream\nxbstream_options = -x\n'))
+    return cls(config=str(config), dry_run=1)
+
+
+def logged_commands(caplog, prefix):
+    return [record.getMessage()[len(prefix):] for record in caplog.records if record.getMessage().startswith(prefix)]
+
+
+class TestIncBackupCommand:
+
+    def test_incremental_lsn_from_sidecar(self, tmpdir, caplog):
+        backup = make_dry_run(tmpdir)
+        add_backup(backup, FULL, 'Full', 1000)
+        caplog.set_level(logging.INFO)
+        assert backup.inc_backup() is True
+        command, = logged_commands(caplog, 'The following backup command will be executed ')
+        assert '--extra-lsndir={}/'.format(backup.lsn_dir) in command
+        assert '--incremental-lsn=1000' in command
+        assert '--incremental-basedir' not in command
+        assert '--stream="xbstream"' in command
+        # Streamed base backup is not extracted
+        assert logged_commands(caplog, 'The following xbstream command will be executed ') == []
+
+    def test_based_on_recent_incremental(self, tmpdir, caplog):
+        backup = make_dry_run(tmpdir)
+        add_backup(backup, FULL, 'Full', 1000)
+        add_backup(backup, INC, 'Inc', 2000, from_lsn=1000)
+        caplog.set_level(logging.INFO)
+        backup.inc_backup()
+        command, = logged_commands(caplog, 'The following backup command will be executed ')
+        assert '--incremental-lsn=2000' in command
+
+    def test_incremental_basedir_fallback(self, tmpdir, caplog):
+        # Full backup taken before LSN sidecars existed
+        backup = make_dry_run(tmpdir)
+        add_backup(backup, FULL, 'Full', 1000)
+        tmpdir.join('backup_dir', 'lsn', FULL).remove()
+        caplog.set_level(logging.INFO)
+        backup.inc_backup()
+        command, = logged_commands(caplog, 'The following backup command will be executed ')
+        assert '--incremental-basedir={}/{}'.format(backup.full_dir, FULL) in command
+        assert '--incremental-lsn' not in command
+        xbstream, = logged_commands(caplog, 'The following xbstream command will be executed ')
+        assert xbstream == 'xbstream -x -C {0}/{1} < {0}/{1}/full_backup.stream'.format(backup.full_dir, FULL)
+
+
+class TestExtractXbstream:
+
+    def test_extract(self, tmpdir, caplog):
+        prepare = make_dry_run(tmpdir, cls=Prepare)
+        inc = tmpdir.join('backup_dir', 'inc', INC).ensure(dir=True)
+        caplog.set_level(logging.INFO)
+        assert prepare.extract_xbstream(str(inc), 'inc_backup.stream') is True
+        assert logged_commands(caplog, 'The following xbstream command will be executed ') == [
+            'xbstream -x -C {0} < {0}/inc_backup.stream'.format(inc)]
+
+    def test_skip_extracted(self, tmpdir, caplog):
+        prepare = make_dry_run(tmpdir, cls=Prepare)
+        inc = tmpdir.join('backup_dir', 'inc', INC)
+        inc.join('xtrabackup_checkpoints').write('backup_type = incremental\n', ensure=True)
+        caplog.set_level(logging.INFO)
+        assert prepare.extract_xbstream(str(inc), 'inc_backup.stream') is True
+        assert logged_commands(caplog, 'The following xbstream command will be executed ') == []
+        assert '{} is already extracted, skipping xbstream'.format(inc) in caplog.messages
@@ -0,0 +1,52 @@
+# PyTest file for testing IncrementalPolicy class
+import pytest
+from master_backup_script.inc_policy import IncrementalPolicy
+
+MiB = 1024 * 1024
+
+
+def backup(name, from_lsn, to_lsn, size_bytes=None, duration=None, prepare_duration=None):
+    return {'name': name, 'from_lsn': from_lsn, 'to_lsn': to_lsn, 'size_bytes': size_bytes,
+            'duration': duration, 'prepare_duration': prepare_duration}
+
+
+FULL = backup('full', 0, 1000)
+CHAIN = [backup('inc1', 1000, 2000, 10 * MiB), backup('inc2', 2000, 3000, 10 * MiB),
+         backup('inc3', 3000, 4000, 10 * MiB)]
+
+
+class TestIncrementalPolicy:
+
+    def test_unknown_policy(self):
+        with pytest.raises(RuntimeError):
+            IncrementalPolicy(policy='weekly')
+
+    def test_chain_and_cumulative(self):
+        assert IncrementalPolicy('chain').choose(FULL, CHAIN) == 'inc3'
+        assert IncrementalPolicy('chain').choose(FULL, []) == 'full'
+        assert IncrementalPolicy('cumulative').choose(FULL, CHAIN) == 'full'
+
+    def test_prepare_model(self):
+        # 2 seconds of overhead plus 1MiB/s
+        history = [backup('inc{}'.format(i), 0, 1, size * MiB, prepare_duration=2 + size) for i, size in
+                   enumerate((1, 5, 10))]
+        overhead, rate = IncrementalPolicy(history=history).prepare_model()
+        assert overhead == pytest.approx(2)
+        assert rate == pytest.approx(MiB)
+        assert IncrementalPolicy().prepare_model() == (0, IncrementalPolicy.default_prepare_rate)
+
+    def test_cost_bounds_chain(self):
+        # Without measured overhead, the newest base allowed by inc_max_chain is the cheapest
+        assert IncrementalPolicy('cost', max_chain=4).choose(FULL, CHAIN) == 'inc3'
+        assert IncrementalPolicy('cost', max_chain=3).choose(FULL, CHAIN) == 'inc2'
+        assert IncrementalPolicy('cost', max_chain=1).choose(FULL, CHAIN) == 'full'
+
+    def test_cost_prefers_cumulative_on_prepare_overhead(self):
+        # Applying each delta costs 60 seconds regardless of size, backing up 20MiB more costs far less
+        history = [backup('old{}'.format(i), 0, 1000, size * MiB, duration=size, prepare_duration=60 + size / 100)
+                   for i, size in enumerate((1, 100, 1000))]
+        policy = IncrementalPolicy('cost', max_chain=4, history=history)
+        estimates = {i['base']: i for i in policy.estimates(FULL, CHAIN, current_lsn=4000)}
+        assert estimates['full']['size'] == 30 * MiB
+        assert estimates['inc3']['chain_length'] == 4
+        assert policy.choose(FULL, CHAIN, current_lsn=4000) == 'full'
@@ -0,0 +1,71 @@
+# PyTest file for testing unpacking of incremental backups ahead of prepare
+import time
+import shutil
+import threading
+from collections import namedtuple
+from test.fixtures import write_config
+from backup_prepare.prepare import Prepare
+
+INCS = ['inc{}'.format(i) for i in range(6)]
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+
+def make_prepare(tmpdir, monkeypatch, lookahead, free, duration=0.02):
+    # unpack_inc_backup is replaced with sleeping stub, every incremental backup needs 100 bytes to unpack
+    prepare = Prepare(config=str(write_config(tmpdir, prepare_lookahead=lookahead)))
+    lock = threading.Lock()
+    state = {'started': [], 'yielded': [], 'running': 0, 'max_running': 0, 'max_ahead': 0}
+
+    def unpack_inc_backup(inc_backup_dir):
+        with lock:
+            state['started'].append(inc_backup_dir)
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+            state['max_ahead'] = max(state['max_ahead'], len(state['started']) - len(state['yielded']))
+        # Later incremental backups unpack faster, so they finish out of order
+        time.sleep(duration * (len(INCS) - INCS.index(inc_backup_dir)))
+        with lock:
+            state['running'] -= 1
+        return inc_backup_dir
+    monkeypatch.setattr(prepare, 'unpack_inc_backup', unpack_inc_backup)
+    monkeypatch.setattr(prepare, 'estimate_unpack_size', lambda inc_backup_dir: 100)
+    monkeypatch.setattr(shutil, 'disk_usage', lambda path: DiskUsage(free, 0, free))
+    return prepare, state
+
+
+def apply_all(prepare, state):
+    for inc_backup_dir in prepare.unpacked_inc_backups(INCS):
+        state['yielded'].append(inc_backup_dir)
+        # Applying takes a while, look-ahead unpacks next ones meanwhile
+        time.sleep(0.01)
+    return state['yielded']
+
+
+class TestLookahead:
+
+    def test_in_order(self, tmpdir, monkeypatch):
+        prepare, state = make_prepare(tmpdir, monkeypatch, lookahead=3, free=10 ** 6)
+        assert apply_all(prepare, state) == INCS
+        assert state['max_running'] > 1
+
+    def test_bounded_by_lookahead(self, tmpdir, monkeypatch):
+        prepare, state = make_prepare(tmpdir, monkeypatch, lookahead=2, free=10 ** 6)
+        assert apply_all(prepare, state) == INCS
+        # Current incremental backup plus at most 2 ahead of it
+        assert state['max_ahead'] == 3
+        assert state['max_running'] <= 2
+
+    def test_bounded_by_free_space(self, tmpdir, monkeypatch):
+        # Free space is enough for only one unpacked incremental backup at a time
+        prepare, state = make_prepare(tmpdir, monkeypatch, lookahead=3, free=150)
+        assert apply_all(prepare, state) == INCS
+        assert state['max_running'] == 1
+
+    def test_disabled(self, tmpdir, monkeypatch):
+        prepare, state = make_prepare(tmpdir, monkeypatch, lookahead=0, free=10 ** 6, duration=0)
+        generator = prepare.unpacked_inc_backups(INCS)
+        assert next(generator) == INCS[0]
+        # Nothing is unpacked before it is asked for
+        assert state['started'] == INCS[:1]
+        assert list(generator) == INCS[1:]
@@ -0,0 +1,75 @@
+# PyTest file for testing ResourceBudget and MultiInstanceScheduler classes
+import threading
+from test.fixtures import make_daemon
+from backup_scheduler.budget import ResourceBudget
+from backup_scheduler.multi_instance import MultiInstanceScheduler
+
+
+def make_scheduler(tmpdir, names, budget):
+    instances = tmpdir.join('instances.cnf')
+    lines = ['[Instances]']
+    for name in names:
+        daemon = make_daemon(tmpdir.mkdir(name))
+        lines.append('{} = {}'.format(name, daemon.conf))
+    lines.append('[Budget]')
+    lines += ['{} = {}'.format(key, value) for key, value in budget.items()]
+    instances.write('\n'.join(lines) + '\n')
+    return MultiInstanceScheduler(config=str(instances))
+
+
+class TestResourceBudget:
+
+    def test_acquire(self):
+        budget = ResourceBudget(max_backups=2, max_full_backups=1, cpu_threads=9, write_bandwidth=100)
+        full = budget.acquire('full')
+        assert full == {'action': 'full', 'threads': 4, 'write_bandwidth': 50}
+        assert budget.acquire('full') is None
+        inc = budget.acquire('inc')
+        assert inc is not None
+        assert budget.acquire('inc') is None
+        budget.release(full)
+        assert budget.acquire('full') is not None
+        budget.release(inc)
+        assert budget.acquire('inc')['threads'] == 4
+
+    def test_unlimited(self):
+        assert ResourceBudget().share() == {'threads': None, 'write_bandwidth': None}
+
+
+class TestMultiInstanceScheduler:
+
+    def test_grant_options(self, tmpdir):
+        scheduler = make_scheduler(tmpdir, ['db1'], {'cpu_threads': 4, 'write_bandwidth': '40MiB'})
+        backup = scheduler.daemons['db1'].backup
+        backup.mysql_socket = '/tmp/db1.sock'
+        assert '--parallel' not in backup.general_command_builder()
+        backup.resource_grant = scheduler.budget.acquire('inc')
+        assert backup.general_command_builder().endswith(" --parallel=4 --throttle=4")
+
+    def test_dispatch(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, ['db1', 'db2', 'db3'], {'max_backups': 2, 'max_full_backups': 1})
+        proceed = threading.Event()
+        taken = []
+
+        def take(name, action):
+            taken.append((name, action, scheduler.daemons[name].backup.resource_grant['action']))
+            proceed.wait(10)
+        for name, daemon in scheduler.daemons.items():
+            monkeypatch.setattr(daemon, 'take', lambda action, name=name: take(name, action))
+        scheduler.daemons['db1'].queue.enqueue('full')
+        scheduler.daemons['db2'].queue.enqueue('full')
+        scheduler.daemons['db3'].queue.enqueue('inc')
+
+        # Second full backup waits for the first one, the younger incremental backup goes on
+        assert scheduler.dispatch() == ['db1', 'db3']
+        assert scheduler.dispatch() == []
+        proceed.set()
+        for thread in list(scheduler.running.values()):
+            thread.join()
+        scheduler.collect()
+        assert scheduler.dispatch() == ['db2']
+        scheduler.running['db2'].join()
+        assert sorted(taken) == [('db1', 'full', 'full'), ('db2', 'full', 'full'), ('db3', 'inc', 'inc')]
+        assert scheduler.daemons['db2'].backup.resource_grant is None
+        assert scheduler.budget.running == {'full': 0, 'inc': 0}
+        assert all(daemon.queue.jobs('done') for daemon in scheduler.daemons.values())
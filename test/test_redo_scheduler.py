@@ -0,0 +1,75 @@
+# PyTest file for testing RedoScheduler class
+from test.fixtures import make_scheduler, add_backup
+
+
+class TestRedoScheduler:
+
+    def test_no_full_backup(self, tmpdir):
+        scheduler = make_scheduler(tmpdir)
+        assert scheduler.decide()[0] == 'full'
+
+    def test_redo_volume(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, redo_inc_size='1MiB', full_backup_interval='1000 days')
+        add_backup(scheduler.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 1000 + 1024 * 1024 - 1)
+        assert scheduler.decide()[0] is None
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 1000 + 1024 * 1024)
+        assert scheduler.decide()[0] == 'inc'
+
+        # Redo is counted from the recent incremental backup
+        add_backup(scheduler.backup, '2100-01-01_01-00-00', 'Inc', 1000 + 1024 * 1024)
+        assert scheduler.decide()[0] is None
+
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: None)
+        assert scheduler.decide()[0] is None
+
+    def test_full_backup_interval(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, full_backup_interval='1 hour')
+        add_backup(scheduler.backup, '2000-01-01_00-00-00', 'Full', 1000)
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 1000)
+        assert scheduler.decide()[0] == 'full'
+
+    def test_full_max_inc_size(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, full_backup_interval='1000 days', full_max_inc_size='10MiB')
+        add_backup(scheduler.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        add_backup(scheduler.backup, '2100-01-01_01-00-00', 'Inc', 2000, size_bytes=6 * 1024 * 1024)
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 2000)
+        assert scheduler.decide()[0] is None
+        add_backup(scheduler.backup, '2100-01-01_02-00-00', 'Inc', 3000, size_bytes=4 * 1024 * 1024)
+        assert scheduler.decide()[0] == 'full'
+
+    def test_full_max_prepare_time(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, full_backup_interval='1000 days', full_max_prepare_time='1 minute')
+        add_backup(scheduler.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        # Measured rate is 1MiB/s, so 60MiB of incremental backups takes a minute to apply
+        add_backup(scheduler.backup, '2100-01-01_01-00-00', 'Inc', 2000, from_lsn=1000, size_bytes=30 * 1024 * 1024,
+                   prepare_duration=30)
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 2000)
+        assert scheduler.prepare_rate() == 1024 * 1024
+        assert scheduler.decide()[0] is None
+        add_backup(scheduler.backup, '2100-01-01_02-00-00', 'Inc', 3000, from_lsn=2000, size_bytes=30 * 1024 * 1024)
+        assert scheduler.projected_prepare_time(scheduler.restore_chain()) == 60
+        assert scheduler.decide()[0] == 'full'
+
+    def test_cumulative_restore_chain(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, full_backup_interval='1000 days', full_max_prepare_time='1 minute',
+                                   inc_policy='cumulative')
+        add_backup(scheduler.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        add_backup(scheduler.backup, '2100-01-01_01-00-00', 'Inc', 2000, from_lsn=1000, size_bytes=30 * 1024 * 1024,
+                   prepare_duration=30)
+        # Cumulative backup supersedes the first one, restore applies only 40MiB
+        add_backup(scheduler.backup, '2100-01-01_02-00-00', 'Inc', 3000, from_lsn=1000, size_bytes=40 * 1024 * 1024)
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 3000)
+        assert [row['name'] for row in scheduler.restore_chain()] == ['2100-01-01_02-00-00']
+        assert scheduler.decide()[0] is None
+
+    def test_run_once(self, tmpdir, monkeypatch):
+        scheduler = make_scheduler(tmpdir, redo_inc_size='1MiB', full_backup_interval='1000 days')
+        add_backup(scheduler.backup, '2100-01-01_00-00-00', 'Full', 1000)
+        taken = []
+        monkeypatch.setattr(scheduler.backup, 'take_inc_backup', lambda: taken.append('inc'))
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 1000)
+        assert scheduler.run_once() is None
+        monkeypatch.setattr(scheduler.backup, 'current_lsn', lambda: 1000 + 1024 * 1024)
+        assert scheduler.run_once() == 'inc'
+        assert taken == ['inc']
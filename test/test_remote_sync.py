@@ -0,0 +1,73 @@
+# PyTest file for testing RemoteSync class against local directory stand-in
+import json
+import pytest
+from master_backup_script.remote_sync import RemoteSync, LocalTransport
+
+
+def make_backups(tmpdir):
+    backup_dir = tmpdir.join('backup_dir')
+    backup_dir.join('full', 'full1', 'full_backup.stream').write_binary(b'f' * 1000, ensure=True)
+    backup_dir.join('lsn', 'full1', 'xtrabackup_checkpoints').write('to_lsn = 100\n', ensure=True)
+    backup_dir.join('inc', 'inc1', 'inc_backup.stream').write_binary(b'i' * 300, ensure=True)
+    backup_dir.join('lsn', 'inc1', 'xtrabackup_checkpoints').write('to_lsn = 200\n', ensure=True)
+    return backup_dir
+
+
+class FlakyTransport(LocalTransport):
+    # Drops the link after given number of chunks
+
+    def __init__(self, root, chunks):
+        LocalTransport.__init__(self, root)
+        self.chunks = chunks
+
+    def write_range(self, local_path, rel_path, offset, length):
+        if self.chunks == 0:
+            raise ChildProcessError("Connection reset by peer")
+        self.chunks -= 1
+        LocalTransport.write_range(self, local_path, rel_path, offset, length)
+
+
+class TestRemoteSync:
+
+    def test_ship_only_new_sets(self, tmpdir):
+        backup_dir = make_backups(tmpdir)
+        remote = tmpdir.join('remote')
+        sync = RemoteSync(LocalTransport(str(remote)), str(backup_dir), threads=2, chunk_size=128)
+        assert sync.sync() == ['full/full1', 'inc/inc1']
+        assert remote.join('full', 'full1', 'full_backup.stream').read_binary() == b'f' * 1000
+        assert remote.join('lsn', 'inc1', 'xtrabackup_checkpoints').read() == 'to_lsn = 200\n'
+
+        backup_dir.join('inc', 'inc2', 'inc_backup.stream').write_binary(b'j' * 10, ensure=True)
+        sync = RemoteSync(LocalTransport(str(remote)), str(backup_dir), threads=2, chunk_size=128)
+        assert sync.sync() == ['inc/inc2']
+
+    def test_resume(self, tmpdir):
+        backup_dir = make_backups(tmpdir)
+        remote = tmpdir.join('remote')
+        with pytest.raises(ChildProcessError):
+            RemoteSync(FlakyTransport(str(remote), chunks=3), str(backup_dir), threads=1, chunk_size=128).sync()
+        manifest = json.loads(remote.join('manifest.json').read())
+        assert len(manifest['sets']['full/full1']['files']['full/full1/full_backup.stream']['chunks']) == 3
+
+        transport = FlakyTransport(str(remote), chunks=100)
+        assert RemoteSync(transport, str(backup_dir), threads=1, chunk_size=128).sync() == ['full/full1', 'inc/inc1']
+        # 8 chunks of full backup stream minus 3 already sent, 3 chunks of inc, 2 sidecars
+        assert transport.chunks == 100 - 5 - 3 - 2
+        assert remote.join('full', 'full1', 'full_backup.stream').read_binary() == b'f' * 1000
+
+    def test_checksum_mismatch(self, tmpdir):
+        backup_dir = make_backups(tmpdir)
+        remote = tmpdir.join('remote')
+
+        class CorruptingTransport(LocalTransport):
+            def checksum(self, rel_path):
+                return 'bad'
+
+        with pytest.raises(RuntimeError):
+            RemoteSync(CorruptingTransport(str(remote)), str(backup_dir), chunk_size=128).sync()
+        assert not json.loads(remote.join('manifest.json').read())['sets']['full/full1']['complete']
+
+    def test_skip_failed(self, tmpdir):
+        backup_dir = make_backups(tmpdir)
+        sync = RemoteSync(LocalTransport(str(tmpdir.join('remote'))), str(backup_dir), skip=['inc1'])
+        assert sync.sync() == ['full/full1']
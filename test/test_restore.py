@@ -0,0 +1,132 @@
+# PyTest file for testing Restore class
+import os
+import pytest
+from test.fixtures import write_config
+from backup_prepare.prepare import Prepare
+from backup_prepare.restore import Restore
+from backup_prepare.snapshot import Snapshot
+
+
+def make_prepared_backup(tmpdir):
+    backup = tmpdir.join('snapshot', 'backup1')
+    for path in ('ibdata1', 'ib_logfile0', 'xtrabackup_checkpoints', 'backup-my.cnf',
+                 'test/t1.ibd', 'test/t1.frm', 'mysql/user.MYD'):
+        backup.join(path).write(path, ensure=True)
+    datadir = tmpdir.join('datadir')
+    datadir.ensure(dir=True)
+    return backup, datadir
+
+
+class TestRestore:
+
+    @pytest.mark.parametrize('method', ['copy', 'reflink', 'move-back'])
+    def test_restore_tree(self, tmpdir, method):
+        backup, datadir = make_prepared_backup(tmpdir)
+        owner = (os.getuid(), os.getgid())
+        restore = Restore(str(backup), str(datadir), method=method, threads=2, owner=owner)
+        with restore.phase('copy-back'):
+            restore.restore_tree(restore.choose_method())
+        for path in ('ibdata1', 'ib_logfile0', 'test/t1.ibd', 'test/t1.frm', 'mysql/user.MYD'):
+            assert datadir.join(path).read() == path
+            assert (datadir.join(path).stat().uid, datadir.join(path).stat().gid) == owner
+        assert not datadir.join('xtrabackup_checkpoints').check()
+        assert not datadir.join('backup-my.cnf').check()
+        assert backup.join('test/t1.ibd').check() is (method != 'move-back')
+        assert [name for name, seconds in restore.report()] == ['copy-back']
+
+    def test_auto_disposable(self, tmpdir):
+        backup, datadir = make_prepared_backup(tmpdir)
+        assert Restore(str(backup), str(datadir), method='auto', disposable=True).choose_method() == 'move-back'
+        assert Restore(str(backup), str(datadir), method='auto').choose_method() in ('reflink', 'copy')
+
+    def test_move_back_hardlink_snapshot(self, tmpdir):
+        full, datadir = make_prepared_backup(tmpdir)
+        snapshot = tmpdir.join('snapshot', 'prepared')
+        Snapshot('hardlink').clone_tree(str(full), str(snapshot))
+        before = {path: full.join(path).stat() for path in ('test/t1.frm', 'mysql/user.MYD', 'test/t1.ibd')}
+        assert snapshot.join('test/t1.frm').stat().ino == before['test/t1.frm'].ino
+
+        restore = Restore(str(snapshot), str(datadir), method='auto', owner=(os.getuid(), os.getgid()),
+                          disposable=True)
+        assert restore.choose_method() == 'move-back'
+        restore.restore_tree('move-back')
+        for path, stat in before.items():
+            after = full.join(path).stat()
+            assert (after.ino, after.uid, after.gid, after.mtime) == (stat.ino, stat.uid, stat.gid, stat.mtime)
+            assert datadir.join(path).stat().ino != stat.ino
+            assert datadir.join(path).read() == path
+        # Files owned by snapshot alone are moved
+        assert not snapshot.join('test/t1.ibd').check()
+        assert snapshot.join('test/t1.frm').check()
+
+    def test_parse_owner(self):
+        assert Restore.parse_owner('chown -R 0:0') == (0, 0)
+        assert Restore.parse_owner('chown -R root:root') == (0, 0)
+        assert Restore.parse_owner('chown -R nosuchuser1:nosuchgroup1') is None
+
+    def test_unknown_method(self, tmpdir):
+        with pytest.raises(RuntimeError):
+            Restore(str(tmpdir), str(tmpdir), method='rsync')
+
+    def test_copy_preserving_owner(self, tmpdir):
+        backup, datadir = make_prepared_backup(tmpdir)
+        restore = Restore(str(backup), str(datadir), method='copy', owner='preserve', skip_metadata=False)
+        restore.restore_tree('copy')
+        assert datadir.join('xtrabackup_checkpoints').check()
+        assert datadir.join('test/t1.ibd').stat().uid == backup.join('test/t1.ibd').stat().uid
+
+
+def make_prepare(tmpdir):
+    # Prepare with datadir holding some files, tmp_dir of config is tmpdir/tmp
+    prepare = Prepare(config=str(write_config(tmpdir)))
+    prepare.datadir = str(tmpdir.join('datadir'))
+    for path in ('ibdata1', 'test/t1.ibd'):
+        tmpdir.join('datadir', path).write(path, ensure=True)
+    return prepare
+
+
+class TestMoveDatadir:
+
+    def test_same_filesystem(self, tmpdir):
+        prepare = make_prepare(tmpdir)
+        tmpdir.join('tmp', 'old').write('old', ensure=True)
+        inode = tmpdir.join('datadir', 'ibdata1').stat().ino
+        assert prepare.move_datadir() is True
+        # Renamed, not copied
+        assert tmpdir.join('tmp', 'ibdata1').stat().ino == inode
+        assert not tmpdir.join('tmp', 'old').check()
+        assert tmpdir.join('datadir').listdir() == []
+
+    def test_other_filesystem(self, tmpdir, monkeypatch):
+        prepare = make_prepare(tmpdir)
+        monkeypatch.setattr(Restore, 'same_device', staticmethod(lambda src_dir, dst_dir: False))
+        assert prepare.move_datadir() is True
+        assert tmpdir.join('tmp', 'test', 't1.ibd').read() == 'test/t1.ibd'
+        assert tmpdir.join('datadir').listdir() == []
+
+    def test_mount_point(self, tmpdir, monkeypatch):
+        prepare = make_prepare(tmpdir)
+        datadir = tmpdir.join('datadir')
+        inode = datadir.stat().ino
+        monkeypatch.setattr(os.path, 'ismount', lambda path: path.rstrip('/') == str(datadir))
+        assert prepare.move_datadir() is True
+        assert tmpdir.join('tmp', 'ibdata1').read() == 'ibdata1'
+        # Mount point itself is kept and emptied
+        assert datadir.stat().ino == inode
+        assert datadir.listdir() == []
+
+    def test_remove_in_background(self, tmpdir):
+        tmpdir.join('old', 'db', 't1.ibd').write('', ensure=True)
+        thread = Prepare.remove_in_background(str(tmpdir.join('old')))
+        assert not tmpdir.join('old').check()
+        thread.join()
+        assert tmpdir.listdir() == []
+
+    def test_remove_mount_point_in_background(self, tmpdir, monkeypatch):
+        mount = tmpdir.join('mnt')
+        mount.join('db', 't1.ibd').write('', ensure=True)
+        mount.join('ibdata1').write('')
+        monkeypatch.setattr(os.path, 'ismount', lambda path: path.rstrip('/') == str(mount))
+        Prepare.remove_in_background(str(mount)).join()
+        assert mount.check(dir=True)
+        assert mount.listdir() == []
@@ -0,0 +1,105 @@
+# PyTest file for testing ShadowCopy class
+import fcntl
+import threading
+import pytest
+from test.fixtures import make_backup, add_backup
+from backup_prepare.shadow import ShadowCopy
+from process_runner.process_runner import ProcessRunner
+
+FULL = '2100-01-01_00-00-00'
+INCS = ['2100-01-01_01-00-00', '2100-01-01_02-00-00']
+
+
+def make_shadow(tmpdir, monkeypatch, fail=None):
+    # Full backup with one incremental backup; xtrabackup --prepare is replaced with recording commands
+    backup = make_backup(tmpdir, shadow_dir=tmpdir.join('shadow'))
+    add_backup(backup, FULL, 'Full', 1000)
+    add_backup(backup, INCS[0], 'Inc', 2000, from_lsn=1000)
+    commands = []
+
+    def run_command(command, envelope=None, stdin=None):
+        commands.append(command)
+        return fail is None or fail not in command
+    monkeypatch.setattr(ProcessRunner, 'run_command', run_command)
+    return backup, ShadowCopy(config=backup.conf), commands
+
+
+class TestShadowCopy:
+
+    def test_seed_and_apply(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        assert shadow.refresh() is True
+        assert len(commands) == 2
+        assert '--apply-log-only --target-dir={}'.format(shadow.shadow_full) in commands[0]
+        assert '--incremental-dir' not in commands[0]
+        assert commands[1].endswith('--incremental-dir={}/{}'.format(shadow.shadow_work, INCS[0]))
+        assert shadow.read_state() == {'full': FULL, 'applied': [INCS[0]], 'valid': True}
+        # Unpacked copy of incremental backup is removed, backup itself is kept
+        assert not tmpdir.join('shadow', 'inc_work', INCS[0]).check()
+        assert tmpdir.join('backup_dir', 'inc', INCS[0]).check(dir=True)
+
+    def test_refresh_applies_only_new_incrementals(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        shadow.refresh()
+        add_backup(backup, INCS[1], 'Inc', 3000, from_lsn=2000)
+        del commands[:]
+        shadow.refresh()
+        assert len(commands) == 1
+        assert commands[0].endswith('--incremental-dir={}/{}'.format(shadow.shadow_work, INCS[1]))
+        assert shadow.read_state()['applied'] == INCS
+
+    def test_reseed(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        shadow.refresh()
+        # New full backup, rotation removed incremental backups of previous one
+        add_backup(backup, '2100-01-02_00-00-00', 'Full', 5000)
+        tmpdir.join('backup_dir', 'inc', INCS[0]).remove()
+        del commands[:]
+        shadow.refresh()
+        assert commands == [shadow.prepare_command(shadow.shadow_full)]
+        assert shadow.read_state() == {'full': '2100-01-02_00-00-00', 'applied': [], 'valid': True}
+
+    def test_failed_apply(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch, fail='--incremental-dir')
+        with pytest.raises(RuntimeError):
+            shadow.refresh()
+        assert shadow.read_state() == {'full': FULL, 'applied': [], 'valid': False}
+        # After backup only the failure is logged, next refresh reseeds
+        shadow.refresh_after_backup()
+        assert commands[-2] == shadow.prepare_command(shadow.shadow_full)
+
+    def test_prepare_for_restore(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        assert shadow.prepare_for_restore() == shadow.shadow_full
+        assert commands[-1] == shadow.prepare_command(shadow.shadow_full, final=True)
+        assert '--apply-log-only' not in commands[-1]
+        # Fully prepared copy can not take incremental backups anymore
+        assert shadow.read_state()['valid'] is False
+        del commands[:]
+        shadow.refresh()
+        assert commands[0] == shadow.prepare_command(shadow.shadow_full)
+
+    def test_refresh_waits_for_lock(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        tmpdir.join('shadow').ensure(dir=True)
+        with open(str(tmpdir.join('shadow', ShadowCopy.lock_file)), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            refresh = threading.Thread(target=shadow.refresh)
+            refresh.start()
+            refresh.join(0.2)
+            assert refresh.is_alive() and commands == []
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        refresh.join()
+        assert len(commands) == 2
+
+    def test_refreshed_after_inc_backup(self, tmpdir, monkeypatch):
+        backup, shadow, commands = make_shadow(tmpdir, monkeypatch)
+        steps = []
+        backup.remote_dir = str(tmpdir.join('remote'))
+        monkeypatch.setattr(backup, 'inc_backup_needed', lambda: True)
+        monkeypatch.setattr(backup, 'inc_backup', lambda: steps.append('inc'))
+        monkeypatch.setattr(backup, 'copy_backup_to_remote_host', lambda: steps.append('remote'))
+        monkeypatch.setattr(ShadowCopy, 'refresh_after_backup', lambda self: steps.append('shadow'))
+        # Refresh runs before take_inc_backup returns, so it never outlives the backup lock
+        assert backup.take_inc_backup() is True
+        assert steps == ['inc', 'remote', 'shadow']
@@ -0,0 +1,44 @@
+# PyTest file for testing Sizing class
+import os
+from backup_catalog.catalog import BackupCatalog
+from backup_catalog.sizing import Sizing
+
+
+def make_tree(tmpdir):
+    root = tmpdir.join('backup1')
+    root.join('ibdata1').write_binary(b'0' * 1000, ensure=True)
+    for db in range(5):
+        for table in range(20):
+            root.join('db{}'.format(db), 't{}.ibd.delta'.format(table)).write_binary(b'0' * 10, ensure=True)
+    root.join('empty').ensure(dir=True)
+    return root
+
+
+class TestSizing:
+
+    def test_directory_size(self, tmpdir):
+        root = make_tree(tmpdir)
+        assert Sizing.directory_size(str(root)) == 1000 + 5 * 20 * 10
+        assert Sizing.directory_size(str(root), threads=1) == 2000
+        assert Sizing.directory_size(str(root.join('ibdata1'))) == 1000
+        assert Sizing.directory_size(str(tmpdir.join('missing'))) == 0
+
+    def test_hardlinks_counted_once(self, tmpdir):
+        root = make_tree(tmpdir)
+        os.link(str(root.join('ibdata1')), str(root.join('db0', 'ibdata1')))
+        assert Sizing.directory_size(str(root)) == 2000
+
+    def test_human_size(self):
+        assert Sizing.human_size(5 * 1024 * 1024) == '5 MiB'
+
+    def test_backup_size_cached(self, tmpdir):
+        root = make_tree(tmpdir)
+        catalog = BackupCatalog(str(tmpdir))
+        catalog.add_backup('backup1', 'Full', 'OK')
+        assert Sizing.backup_size(catalog, 'backup1', str(root)) == 2000
+        assert catalog.get_backup('backup1')['size_bytes'] == 2000
+
+        # Finished set is never scanned again
+        root.join('ibdata2').write_binary(b'0' * 1000)
+        assert Sizing.backup_size(catalog, 'backup1', str(root)) == 2000
+        assert Sizing.backup_size(None, 'backup1', str(root)) == 3000
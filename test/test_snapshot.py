@@ -0,0 +1,75 @@
+# PyTest file for testing Snapshot class
+import os
+import pytest
+from test.fixtures import write_config
+from backup_prepare.prepare import Prepare
+from backup_prepare.snapshot import Snapshot
+
+
+def make_backup(tmpdir):
+    backup = tmpdir.join('full', 'backup1')
+    for path in ('ibdata1', 'xtrabackup_checkpoints', 'test/t1.ibd', 'test/t1.frm', 'test/t2.MYD', 'test/db.opt'):
+        backup.join(path).write(path, ensure=True)
+    return backup
+
+
+class TestSnapshot:
+
+    def test_hardlink_farm(self, tmpdir):
+        backup = make_backup(tmpdir)
+        snapshot = tmpdir.join('snapshot', 'backup1')
+        Snapshot('hardlink').clone_tree(str(backup), str(snapshot), overwritten={'test/t2.MYD'})
+        for path in ('ibdata1', 'xtrabackup_checkpoints', 'test/t1.ibd', 'test/t2.MYD'):
+            assert not os.path.samefile(str(backup.join(path)), str(snapshot.join(path)))
+        for path in ('test/t1.frm', 'test/db.opt'):
+            assert os.path.samefile(str(backup.join(path)), str(snapshot.join(path)))
+
+        # Writing InnoDB file of snapshot keeps original backup intact
+        snapshot.join('test/t1.ibd').write('prepared')
+        assert backup.join('test/t1.ibd').read() == 'test/t1.ibd'
+
+    def test_copy(self, tmpdir):
+        backup = make_backup(tmpdir)
+        snapshot = tmpdir.join('snapshot', 'backup1')
+        snap = Snapshot('copy')
+        snap.clone_tree(str(backup), str(snapshot))
+        assert snap.stats['copied'] == 6
+        assert snapshot.join('test/db.opt').read() == 'test/db.opt'
+
+    def test_auto(self, tmpdir):
+        backup = make_backup(tmpdir)
+        snapshot = tmpdir.join('snapshot', 'backup1')
+        method = Snapshot('auto').clone_tree(str(backup), str(snapshot))
+        assert method in ('reflink', 'hardlink')
+        assert not backup.join('.reflink_probe').check()
+        assert snapshot.join('test/t1.ibd').read() == 'test/t1.ibd'
+
+    def test_overwritten_files(self, tmpdir):
+        inc = tmpdir.join('inc', 'inc1')
+        for path in ('test/t1.ibd.delta', 'test/t1.ibd.meta', 'test/t1.frm.qp.xbcrypt', 'xtrabackup_info'):
+            inc.join(path).write('', ensure=True)
+        assert Snapshot.overwritten_files([str(inc)]) == {'test/t1.ibd', 'test/t1.frm', 'xtrabackup_info'}
+
+    def test_streamed_incremental(self, tmpdir):
+        config = write_config(tmpdir, prepare_snapshot='hardlink')
+        config.write(config.read().replace('[Xbstream]\n', '[Xbstream]\nxbstream = xbstream\nstream = xbstream\n'))
+        prepare = Prepare(config=str(config))
+        backup = make_backup(tmpdir.join('backup_dir'))
+        inc = tmpdir.join('backup_dir', 'inc', 'inc1')
+        inc.join('inc_backup.stream').write('', ensure=True)
+        snapshot = tmpdir.join('backup_dir', 'snapshot', 'backup1')
+
+        # Files replaced by incremental backup are not known before its stream is extracted
+        assert prepare.create_snapshot('backup1', ['inc1']) is True
+        for path in ('test/t1.frm', 'test/t2.MYD', 'test/db.opt'):
+            assert not os.path.samefile(str(backup.join(path)), str(snapshot.join(path)))
+
+        inc.join('xtrabackup_checkpoints').write('')
+        inc.join('test/t1.frm').write('', ensure=True)
+        assert prepare.create_snapshot('backup1', ['inc1']) is True
+        assert not os.path.samefile(str(backup.join('test/t1.frm')), str(snapshot.join('test/t1.frm')))
+        assert os.path.samefile(str(backup.join('test/db.opt')), str(snapshot.join('test/db.opt')))
+
+    def test_unknown_method(self):
+        with pytest.raises(RuntimeError):
+            Snapshot('rsync')
@@ -0,0 +1,51 @@
+# PyTest file for testing StreamPipeline class
+import io
+import time
+import hashlib
+import pytest
+from process_runner.stream_pipeline import StreamPipeline, StreamSink, FileSink, HashSink, CommandSink, RatePacer
+
+
+class FailingSink(StreamSink):
+    name = 'failing'
+
+    def write(self, chunk):
+        raise IOError("No space left on device")
+
+
+class TestStreamPipeline:
+
+    data = b'xbstream' * 100000
+
+    def test_fan_out(self, tmpdir):
+        hash_sink = HashSink(path=str(tmpdir.join('full_backup.stream.sha256')), file_name='full_backup.stream')
+        sinks = [FileSink(str(tmpdir.join('full_backup.stream'))),
+                 hash_sink,
+                 CommandSink(['sh', '-c', 'cat > {}'.format(tmpdir.join('uploaded.stream'))])]
+        assert StreamPipeline(sinks, buffer_size=4096, queue_size=2).run(io.BytesIO(self.data)) == len(self.data)
+        assert tmpdir.join('full_backup.stream').read_binary() == self.data
+        assert tmpdir.join('uploaded.stream').read_binary() == self.data
+        assert hash_sink.hexdigest == hashlib.sha256(self.data).hexdigest()
+        assert tmpdir.join('full_backup.stream.sha256').read() == "{}  full_backup.stream\n".format(
+            hash_sink.hexdigest)
+
+    def test_failing_sink(self, tmpdir):
+        sinks = [FileSink(str(tmpdir.join('full_backup.stream'))), FailingSink()]
+        with pytest.raises(RuntimeError):
+            StreamPipeline(sinks, buffer_size=4096, queue_size=2).run(io.BytesIO(self.data))
+
+    def test_failing_command(self):
+        with pytest.raises(RuntimeError):
+            StreamPipeline([CommandSink(['false'])], buffer_size=4096).run(io.BytesIO(b'data'))
+
+    def test_pacer(self, tmpdir):
+        pacer = RatePacer(rate=len(self.data) * 4)
+        start = time.monotonic()
+        StreamPipeline([FileSink(str(tmpdir.join('full_backup.stream')))], buffer_size=len(self.data) // 8,
+                       pacer=pacer).run(io.BytesIO(self.data))
+        assert time.monotonic() - start >= 0.2
+        assert pacer.bytes == len(self.data)
+        assert pacer.paused > 0
+        # Removed limit applies to the rest of the stream
+        pacer.set_rate(None)
+        assert pacer.pace(len(self.data)) == 0
@@ -0,0 +1,57 @@
+# PyTest file for testing synthetic full backups
+import os
+from test.fixtures import CONFIG
+from master_backup_script.backuper import Backup
+
+FULL = '2000-01-01_00-00-00'
+INCS = ['2000-01-01_01-00-00', '2000-01-01_02-00-00']
+
+
+def make_backup(tmpdir, prepare_tool='true'):
+    # prepare_tool stands in for xtrabackup --prepare
+    config = tmpdir.join('autoxtrabackup.cnf')
+    config.write(CONFIG.format(tmpdir=tmpdir, backup_options='prepare_tool = {}\nsynthetic_full = copy'.format(
+        prepare_tool)))
+    backup_dir = tmpdir.join('backup_dir')
+    obj = Backup(config=str(config))
+    for name, backup_type, from_lsn, to_lsn in [(FULL, 'Full', 0, 1000), (INCS[0], 'Inc', 1000, 2000),
+                                                (INCS[1], 'Inc', 2000, 3000)]:
+        directory = backup_dir.join('full' if backup_type == 'Full' else 'inc', name)
+        checkpoints = "backup_type = incremental\nfrom_lsn = {}\nto_lsn = {}\nlast_lsn = {}\n".format(
+            from_lsn, to_lsn, to_lsn)
+        directory.join('xtrabackup_checkpoints').write(checkpoints, ensure=True)
+        backup_dir.join('lsn', name, 'xtrabackup_checkpoints').write(checkpoints, ensure=True)
+        obj.catalog.add_backup(name, backup_type, 'OK', from_lsn=from_lsn, to_lsn=to_lsn)
+    backup_dir.join('full', FULL, 'db', 't1.ibd').write_binary(b'0' * 1000, ensure=True)
+    backup_dir.join('full', FULL, 'db', 't1.frm').write_binary(b'1' * 100)
+    backup_dir.join('inc', INCS[0], 'db', 't1.ibd.delta').write_binary(b'2' * 10, ensure=True)
+    backup_dir.join('lsn', INCS[1], 'xtrabackup_info').write("binlog_pos = filename 'bin.000002', position '4'\n")
+    return obj
+
+
+class TestSyntheticFull:
+
+    def test_synthetic_full_backup(self, tmpdir):
+        obj = make_backup(tmpdir)
+        assert obj.synthetic_full_backup() is True
+
+        name = obj.recent_full_backup_file()
+        assert name > FULL
+        row = obj.catalog.get_backup(name)
+        assert row['parent'] == INCS[1]
+        assert row['status'] == 'OK'
+        new_full = tmpdir.join('backup_dir', 'full', name)
+        assert new_full.join('db', 't1.ibd').read_binary() == b'0' * 1000
+        assert os.path.isfile(os.path.join(obj.lsn_backup_directory(name), 'xtrabackup_info'))
+        assert not tmpdir.join('backup_dir', 'synthetic').exists()
+        # Incremental backups are applied from copies and left as they were taken
+        assert tmpdir.join('backup_dir', 'inc', INCS[0], 'db', 't1.ibd.delta').read_binary() == b'2' * 10
+
+    def test_failed_build_falls_back_to_server(self, tmpdir, monkeypatch):
+        obj = make_backup(tmpdir, prepare_tool='false')
+        taken = []
+        monkeypatch.setattr(obj, 'full_backup', lambda: taken.append('full') or True)
+        assert obj.synthetic_full_backup() is True
+        assert taken == ['full']
+        assert os.listdir(obj.full_dir) == [FULL]
+        assert not tmpdir.join('backup_dir', 'synthetic').exists()
@@ -0,0 +1,106 @@
+# PyTest file for testing ServerHealth, DiskStats and AdaptiveThrottle classes
+import json
+import os
+from test.fixtures import make_scheduler
+from master_backup_script.throttle import DiskStats, ServerHealth, AdaptiveThrottle
+
+MiB = 1024 * 1024
+
+
+def write_diskstats(tmpdir, device, ios, ms):
+    diskstats = tmpdir.join('diskstats')
+    diskstats.write("   8       0 sda 1 0 8 1 1 0 8 1 0 2 2\n"
+                    "{:4} {:7} dm-0 {} 0 800 {} {} 0 800 {} 0 {} {}\n".format(
+                        os.major(device), os.minor(device), ios, ms, ios, ms, ms, ms))
+    return str(diskstats)
+
+
+class FakeHealth:
+
+    def __init__(self, samples):
+        self.samples = list(samples)
+
+    def sample(self):
+        return self.samples.pop(0)
+
+
+class TestServerHealth:
+
+    def test_disk_latency(self, tmpdir):
+        device = os.stat(str(tmpdir)).st_dev
+        disk = DiskStats(str(tmpdir), diskstats=write_diskstats(tmpdir, device, 100, 500))
+        assert disk.latency() is None
+        write_diskstats(tmpdir, device, 150, 1000)
+        # 100 more I/Os took 1000 more milliseconds
+        assert disk.latency() == 0.01
+        assert disk.latency() is None
+
+    def test_sample(self, tmpdir, monkeypatch):
+        outputs = {"SHOW GLOBAL STATUS LIKE 'Threads_running'": "Variable_name\tValue\nThreads_running\t42",
+                   "SHOW SLAVE STATUS\\G": "*** 1. row ***\n        Seconds_Behind_Master: 7\n"}
+        row_ops = iter(["SUM(COUNT_STAR)\tSUM(SUM_TIMER_WAIT)\n1000\t5000000000",
+                        "SUM(COUNT_STAR)\tSUM(SUM_TIMER_WAIT)\n2000\t6000000000000"])
+        health = ServerHealth(lambda statement: statement, str(tmpdir), diskstats=str(tmpdir.join('missing')))
+        monkeypatch.setattr(health, 'query', lambda statement: outputs.get(statement) or next(row_ops))
+        assert health.sample() == {'threads_running': 42, 'replica_lag': 7, 'row_latency': None,
+                                   'disk_latency': None}
+        assert health.sample()['row_latency'] == (6000000000000 - 5000000000) / 1000 / 1e12
+
+    def test_not_replica(self, tmpdir, monkeypatch):
+        health = ServerHealth(lambda statement: statement, str(tmpdir))
+        monkeypatch.setattr(health, 'query', lambda statement: None)
+        assert health.replica_lag() is None
+        assert health.threads_running() is None
+
+
+class TestAdaptiveThrottle:
+
+    healthy = {'threads_running': 10, 'replica_lag': 0, 'row_latency': None, 'disk_latency': 0.001}
+    busy = dict(healthy, threads_running=100)
+
+    def test_backoff_and_recovery(self, tmpdir):
+        throttle = AdaptiveThrottle(FakeHealth([]), {'threads_running': 50}, min_rate=10 * MiB)
+        throttle.pacer.bytes = 200 * MiB
+        # Unlimited backup reading 200MiB/s backs off to half of it
+        assert throttle.adjust(self.busy, 1) == 100 * MiB
+        assert throttle.adjust(self.busy, 1) == 50 * MiB
+        throttle.pacer.bytes += 50 * MiB
+        assert throttle.adjust(self.healthy, 1) == 50 * MiB + 12.5 * MiB
+        for i in range(10):
+            throttle.adjust(self.busy, 1)
+        assert throttle.pacer.rate == 10 * MiB
+        assert throttle.backoffs == 5
+        # Limit is dropped once backup does not reach it
+        assert throttle.adjust(self.healthy, 1) is None
+
+        report = throttle.report(str(tmpdir.join('throttle_report.json')))
+        assert report['metrics']['threads_running'] == {'max': 100, 'avg': 100 * 12 / 14 + 10 * 2 / 14,
+                                                        'limit': 50, 'samples_over_limit': 12}
+        assert report['metrics']['row_latency']['max'] is None
+        assert json.loads(tmpdir.join('throttle_report.json').read())['backoffs'] == 5
+
+    def test_max_rate(self):
+        throttle = AdaptiveThrottle(FakeHealth([]), {'disk_latency': 0.01}, min_rate=10 * MiB, max_rate=40 * MiB)
+        assert throttle.pacer.rate == 40 * MiB
+        assert throttle.adjust(dict(self.healthy, disk_latency=0.05), 1) == 20 * MiB
+        assert throttle.adjust(self.healthy, 1) == 30 * MiB
+        assert throttle.adjust(self.healthy, 1) == 40 * MiB
+        assert throttle.adjust(self.healthy, 1) == 40 * MiB
+
+    def test_sampling_thread(self):
+        throttle = AdaptiveThrottle(FakeHealth([self.healthy] + [self.busy] * 100), {'threads_running': 50},
+                                    min_rate=MiB, interval=0.01)
+        throttle.start()
+        while not throttle.samples:
+            pass
+        throttle.stop()
+        assert throttle.samples[0]['over'] == ['threads_running']
+        assert throttle.pacer.rate == MiB
+
+    def test_backup_options(self, tmpdir):
+        assert make_scheduler(tmpdir.mkdir('off')).backup.adaptive_throttle() is None
+        backup = make_scheduler(tmpdir.mkdir('on'), throttle_lag='30s', throttle_disk_latency='20ms',
+                                throttle_max_rate='1GiB').backup
+        throttle = backup.adaptive_throttle()
+        assert throttle.limits == {'replica_lag': 30, 'disk_latency': 0.02}
+        assert (throttle.min_rate, throttle.max_rate, throttle.interval) == (10 * MiB, 1024 * MiB, 5)